@@ -38,7 +38,7 @@ public class AIChatController {
                 );
             }
             
-            String story = aiStoryService.generateStory(configJson, userInput);
+            String story = aiStoryService.generateStory(configJson, userInput, sessionId);
             
             // Crear mapa de sesión con ambos datos
             Map<String, Object> sessionData = new HashMap<>();
@@ -86,7 +86,7 @@ public class AIChatController {
             String currentStory = (String) sessionData.get("story");
             String configJson = (String) sessionData.get("config");
             
-            String continuedStory = aiStoryService.continueStory(userInput, configJson);
+            String continuedStory = aiStoryService.continueStory(userInput, configJson, sessionId);
             
             String updatedStory = currentStory + "\n\n" + continuedStory;
             sessionData.put("story", updatedStory);
@@ -124,7 +124,7 @@ public class AIChatController {
     @DeleteMapping("/story/{sessionId}")
     public Map<String, String> clearStory(@PathVariable String sessionId) {
         userSessions.remove(sessionId);
-        aiStoryService.clearMemory();
+        aiStoryService.clearMemory(sessionId);
         return Map.of(
             "status", "success", 
             "message", "Historia y memoria limpiadas"
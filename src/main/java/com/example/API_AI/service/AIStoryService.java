@@ -1,6 +1,8 @@
 package com.example.API_AI.service;
 
 import org.springframework.stereotype.Service;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import com.fasterxml.jackson.databind.node.ObjectNode;
 import jakarta.annotation.PostConstruct;
 import jakarta.annotation.PreDestroy;
 import java.io.*;
@@ -14,6 +16,7 @@ public class AIStoryService {
     private BufferedWriter writer;
     private boolean initialized = false;
     private boolean reinitializationAttempted = false;
+    private final ObjectMapper objectMapper = new ObjectMapper();
 
     @PostConstruct
     public void initialize() {
@@ -116,17 +119,44 @@ public class AIStoryService {
     }
 
     public String generateStory(String configJson, String userInput) {
-        return sendCommand("GENERATE", "Start story situation:" + userInput, configJson);
+        return generateStory(configJson, userInput, null);
+    }
+
+    public String generateStory(String configJson, String userInput, String sessionId) {
+        return sendCommand("GENERATE", "Start story situation:" + userInput, withSessionId(configJson, sessionId));
     }
 
     public String continueStory(String userInput, String configJson) {
-        return sendCommand("CONTINUE", userInput, configJson);
+        return continueStory(userInput, configJson, null);
+    }
+
+    public String continueStory(String userInput, String configJson, String sessionId) {
+        return sendCommand("CONTINUE", userInput, withSessionId(configJson, sessionId));
     }
 
     public String clearMemory() {
         return sendCommand("CLEAR_MEMORY", "", "{}");
     }
 
+    public String clearMemory(String sessionId) {
+        return sendCommand("CLEAR_MEMORY", "", withSessionId("{}", sessionId));
+    }
+
+    // Añade el sessionId al JSON de configuración para que Python use la memoria de esa sesión
+    private String withSessionId(String configJson, String sessionId) {
+        if (sessionId == null) {
+            return configJson;
+        }
+        try {
+            ObjectNode node = (ObjectNode) objectMapper.readTree(configJson);
+            node.put("sessionId", sessionId);
+            return objectMapper.writeValueAsString(node);
+        } catch (Exception e) {
+            System.err.println("⚠️  No se pudo añadir sessionId a la configuración: " + e.getMessage());
+            return configJson;
+        }
+    }
+
     private String sendCommand(String commandType, String data, String configJson) {
         try {
             if (!initialized || pythonProcess == null || !pythonProcess.isAlive()) {
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import hashlib
+
+import llama_cpp
+from llama_cpp import Llama
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Settings used when no profile has been tuned for a model yet
+DEFAULT_SETTINGS = {
+    "n_ctx": 16384,
+    "n_batch": 512,
+    "n_threads": 8,
+    "n_gpu_layers": 99,
+}
+
+# Workload the sweep optimizes for: a typical continuation prompt and reply
+EXPECTED_PROMPT_TOKENS = 1500
+EXPECTED_COMPLETION_TOKENS = 500
+
+SAMPLE_BYTES = 16 * 1024 * 1024
+
+
+def profile_dir():
+    return os.environ.get(
+        "STORY_PROFILE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "story_generator", "profiles")
+    )
+
+
+def model_fingerprint(model_path):
+    """Hash of the model's size plus its first, middle and last 16 MB
+
+    Hashing a multi-GB GGUF in full on every start would cost more than the
+    tuning saves; the sampled regions cover the header, tensor layout and
+    quantized data, which is enough to tell model files apart.
+    """
+    size = os.path.getsize(model_path)
+    digest = hashlib.sha256(str(size).encode("ascii"))
+    with open(model_path, "rb") as f:
+        for offset in (0, max(0, size // 2 - SAMPLE_BYTES // 2), max(0, size - SAMPLE_BYTES)):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()[:32]
+
+
+def profile_path(model_path):
+    return os.path.join(profile_dir(), f"{model_fingerprint(model_path)}.json")
+
+
+def load_profile(model_path):
+    """Return the tuned settings for a model file, or None if it was never tuned"""
+    path = profile_path(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Profile read error: {str(e)}", file=sys.stderr)
+        return None
+
+
+def save_profile(model_path, profile):
+    path = profile_path(model_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def usable_cpus():
+    """CPUs this process may run on, honouring affinity masks and cgroup pinning"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    if psutil is not None:
+        return len(psutil.Process().cpu_affinity())
+    return os.cpu_count() or 1
+
+
+def available_memory_bytes():
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def kv_bytes_per_token(metadata):
+    """f16 K and V bytes per context token, read from the GGUF metadata"""
+    def find(suffix):
+        for key, value in metadata.items():
+            if key.endswith(suffix):
+                return int(value)
+        return None
+
+    n_layer = find(".block_count")
+    n_head = find(".attention.head_count")
+    n_head_kv = find(".attention.head_count_kv") or n_head
+    n_embd = find(".embedding_length")
+    key_length = find(".attention.key_length") or (n_embd // n_head if n_embd and n_head else None)
+    value_length = find(".attention.value_length") or key_length
+    if not (n_layer and n_head_kv and key_length):
+        return None
+    return n_layer * n_head_kv * (key_length + value_length) * 2
+
+
+def thread_candidates(cpus):
+    candidates = {cpus, max(1, cpus // 2), max(1, cpus - 1)}
+    n = 1
+    while n < cpus:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def set_threads(llm, n_threads):
+    llama_cpp.llama_set_n_threads(llm._ctx.ctx, n_threads, n_threads)
+
+
+def measure(llm, prompt_tokens, decode_tokens):
+    """Prompt-eval and single-token decode throughput in tokens per second"""
+    llm.reset()
+    start = time.perf_counter()
+    llm.eval(prompt_tokens)
+    prompt_tps = len(prompt_tokens) / (time.perf_counter() - start)
+
+    token = prompt_tokens[-1]
+    start = time.perf_counter()
+    for _ in range(decode_tokens):
+        llm.eval([token])
+    decode_tps = decode_tokens / (time.perf_counter() - start)
+    return prompt_tps, decode_tps
+
+
+def expected_seconds(prompt_tps, decode_tps):
+    return EXPECTED_PROMPT_TOKENS / prompt_tps + EXPECTED_COMPLETION_TOKENS / decode_tps
+
+
+def autotune(model_path, ctx_sizes=(4096, 8192, 16384), batch_sizes=(128, 256, 512, 1024), decode_tokens=32):
+    """Sweep threads, batch and context sizes and persist the fastest profile"""
+    cpus = usable_cpus()
+    available = available_memory_bytes()
+    model_bytes = os.path.getsize(model_path)
+    gpu_layers = DEFAULT_SETTINGS["n_gpu_layers"] if llama_cpp.llama_supports_gpu_offload() else 0
+    print(f"🔧 Autotune: {cpus} usable CPUs, "
+          f"{(available or 0) / 1024 ** 3:.1f} GB available, GPU offload: {bool(gpu_layers)}", file=sys.stderr)
+
+    # Probe the KV footprint once with a tiny context to filter context sizes by RAM
+    probe = Llama(model_path=model_path, n_ctx=256, n_gpu_layers=gpu_layers, verbose=False, use_mmap=True)
+    per_token = kv_bytes_per_token(probe.metadata)
+    del probe
+    if available is not None and per_token:
+        # Leave the weights plus a quarter of the remaining memory for everything else
+        budget = (available - model_bytes) * 0.75
+        fitting = [n_ctx for n_ctx in ctx_sizes if n_ctx * per_token <= budget]
+        ctx_sizes = fitting or [min(ctx_sizes)]
+
+    # Every candidate prefills the same prompt, so their tok/s measure the same workload
+    prompt_length = min(EXPECTED_PROMPT_TOKENS, min(ctx_sizes) // 2)
+    results = []
+    for n_ctx in ctx_sizes:
+        for n_batch in batch_sizes:
+            llm = Llama(
+                model_path=model_path, n_ctx=n_ctx, n_batch=n_batch, n_threads=cpus,
+                n_gpu_layers=gpu_layers, verbose=False, use_mmap=True, use_mlock=False
+            )
+            prompt_tokens = llm.tokenize(b"Once upon a time " * 800)[:prompt_length]
+            for n_threads in thread_candidates(cpus):
+                set_threads(llm, n_threads)
+                prompt_tps, decode_tps = measure(llm, prompt_tokens, decode_tokens)
+                result = {
+                    "n_ctx": n_ctx,
+                    "n_batch": n_batch,
+                    "n_threads": n_threads,
+                    "n_gpu_layers": gpu_layers,
+                    "prompt_tokens_per_second": round(prompt_tps, 2),
+                    "decode_tokens_per_second": round(decode_tps, 2),
+                    "expected_seconds": round(expected_seconds(prompt_tps, decode_tps), 3),
+                }
+                results.append(result)
+                print(f"🔧 ctx={n_ctx} batch={n_batch} threads={n_threads}: "
+                      f"prompt {prompt_tps:.1f} tok/s, decode {decode_tps:.1f} tok/s", file=sys.stderr)
+            del llm
+
+    # Fastest setting, preferring the larger context among near-ties
+    best_time = min(r["expected_seconds"] for r in results)
+    near_best = [r for r in results if r["expected_seconds"] <= best_time * 1.05]
+    best = max(near_best, key=lambda r: (r["n_ctx"], -r["expected_seconds"]))
+
+    profile = {
+        "model_path": os.path.abspath(model_path),
+        "fingerprint": model_fingerprint(model_path),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "usable_cpus": cpus,
+        "settings": {key: best[key] for key in DEFAULT_SETTINGS},
+        "measurements": results,
+    }
+    path = save_profile(model_path, profile)
+    print(f"✅ Autotune profile saved to {path}: {profile['settings']}", file=sys.stderr)
+    return profile
+
+
+def model_settings(model_path):
+    """Defaults, overridden by the tuned profile, overridden by explicit STORY_* env vars"""
+    settings = dict(DEFAULT_SETTINGS)
+    profile = load_profile(model_path)
+    if profile:
+        settings.update(profile.get("settings", {}))
+        print(f"🔧 Using tuned profile: {settings}", file=sys.stderr)
+    for key in DEFAULT_SETTINGS:
+        env_value = os.environ.get(f"STORY_{key.upper()}")
+        if env_value:
+            settings[key] = int(env_value)
+    return settings
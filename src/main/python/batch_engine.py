@@ -0,0 +1,378 @@
+import sys
+import time
+import codecs
+import threading
+import traceback
+from collections import deque
+
+import numpy as np
+import llama_cpp
+
+# Llama's defaults for the settings the generator leaves unset: the repeat penalty looks back
+# over this many tokens of prompt and output, and min-p drops tokens this unlikely next to the best
+PENALTY_LAST_N = 64
+DEFAULT_MIN_P = 0.05
+
+
+def remove_positions(ctx, seq_id, p0, p1=-1):
+    """Drop KV cells of a sequence from p0 on (the API name changed across llama.cpp versions)"""
+    if hasattr(llama_cpp, "llama_get_memory"):
+        llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, p0, p1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+        llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, p0, p1)
+    else:
+        llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, p0, p1)
+
+
+class BatchSequence:
+    """One generation request living as a sequence id inside the shared context"""
+
+    def __init__(self, prompt_tokens, max_tokens, options, on_chunk=None, should_stop=None, seed=None,
+                 drafter=None):
+        self.prompt_tokens = prompt_tokens
+        self.pending = deque(prompt_tokens)
+        self.max_tokens = max_tokens
+        self.temperature = options.get("temperature", 0.8)
+        self.top_p = options.get("top_p", 0.9)
+        self.top_k = options.get("top_k", 40)
+        self.min_p = options.get("min_p", DEFAULT_MIN_P)
+        self.repeat_penalty = options.get("repeat_penalty", 1.1)
+        self.stop = options.get("stop") or []
+        self.on_chunk = on_chunk
+        self.should_stop = should_stop
+        self.rng = np.random.default_rng(seed)
+        self.seq_id = None
+        self.n_past = 0
+        self.last_token = None
+        self.tokens = []
+        self.text = ""
+        self.emitted = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.finish_reason = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.first_token_at = None
+        self.done = threading.Event()
+        # Speculative decoding: drafter(history) proposes tokens that one decode verifies
+        self.drafter = drafter
+        self.drafts = []
+        self.drafted = 0
+        self.accepted = 0
+
+    def recent_tokens(self, n):
+        """The last n tokens of prompt and output, the window the repeat penalty looks at"""
+        recent = self.tokens[-n:]
+        if len(recent) < n:
+            recent = self.prompt_tokens[len(recent) - n:] + recent
+        return recent
+
+    def budget(self):
+        return len(self.prompt_tokens) + self.max_tokens
+
+    def acceptance_rate(self):
+        return round(self.accepted / self.drafted, 4) if self.drafted else 0.0
+
+
+class ContinuousBatchEngine:
+    """Decode several story sessions together in one llama context
+
+    Every active request owns a sequence id in a dedicated context created on
+    the already-loaded model, so no weights are duplicated. Each step packs one
+    pending token per decoding sequence plus as much prompt prefill as fits
+    into a single llama_decode call; new requests join at the next step and
+    finished ones free their sequence id and KV cells immediately.
+
+    A sequence with a drafter decodes speculatively: its pending token goes
+    in with the drafted continuation, every position is sampled as usual and
+    drafts are kept only while they equal the sampled token, so matching
+    drafts just cost no extra step. Since sample() follows llama.cpp's
+    default chain, turning speculation on keeps the output distribution of
+    the blocking path; only the random stream, and so the exact text for a
+    seed, differs.
+    """
+
+    def __init__(self, llm, max_sequences=4, n_ctx=16384, n_batch=512, n_threads=None, seed=42):
+        self.llm = llm
+        self.max_sequences = max_sequences
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.n_vocab = llm.n_vocab()
+        self.seed = seed
+        self.eog_tokens = {llm.token_eos()}
+        end_of_turn = llm.tokenize(b"<end_of_turn>", add_bos=False, special=True)
+        if len(end_of_turn) == 1:
+            self.eog_tokens.add(end_of_turn[0])
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx
+        params.n_batch = n_batch
+        params.n_seq_max = max_sequences
+        if hasattr(params, "kv_unified"):
+            # Newer llama.cpp splits the KV cache into n_ctx / n_seq_max per sequence unless
+            # unified; admission shares n_ctx between sequences, so it needs one pool
+            params.kv_unified = True
+        if n_threads:
+            params.n_threads = n_threads
+            params.n_threads_batch = n_threads
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self.ctx = new_context(llm.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create batched llama context")
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, max_sequences)
+
+        self.free_ids = list(range(max_sequences))
+        self.waiting = deque()
+        self.active = []
+        self.steps = 0
+        self.tokens_decoded = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="batch-engine", daemon=True)
+        self.thread.start()
+        print(f"🧮 Batch engine ready: {max_sequences} sequences, n_ctx={n_ctx}", file=sys.stderr)
+
+    def generate(self, prompt, max_tokens, options, on_chunk=None, should_stop=None, seed=None, drafter=None):
+        """Queue a prompt and block until its sequence finishes"""
+        prompt_tokens = self.llm.tokenize(prompt.encode("utf-8"), special=True)
+        sequence = BatchSequence(
+            prompt_tokens, max_tokens, options, on_chunk, should_stop,
+            self.seed if seed is None else seed, drafter
+        )
+        if sequence.budget() > self.n_ctx:
+            raise ValueError(f"Prompt of {len(prompt_tokens)} tokens does not fit the batch context")
+        with self.condition:
+            self.waiting.append(sequence)
+            self.condition.notify()
+        sequence.done.wait()
+        if sequence.error:
+            raise RuntimeError(sequence.error)
+        return sequence
+
+    def admit(self):
+        """Move waiting requests into free sequence slots while KV space remains"""
+        used = sum(sequence.budget() for sequence in self.active)
+        while self.waiting and self.free_ids:
+            sequence = self.waiting[0]
+            if self.active and used + sequence.budget() > self.n_ctx:
+                break
+            self.waiting.popleft()
+            sequence.seq_id = self.free_ids.pop()
+            used += sequence.budget()
+            self.active.append(sequence)
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.waiting and not self.active:
+                    self.condition.wait()
+                self.admit()
+            if not self.active:
+                continue
+            try:
+                self.step()
+            except Exception as e:
+                traceback.print_exc(file=sys.stderr)
+                for sequence in list(self.active):
+                    self.finish(sequence, "error", f"Batch decode error: {str(e)}")
+
+    def add_token(self, index, token, pos, seq_id, want_logits):
+        self.batch.token[index] = token
+        self.batch.pos[index] = pos
+        self.batch.n_seq_id[index] = 1
+        self.batch.seq_id[index][0] = seq_id
+        self.batch.logits[index] = want_logits
+
+    def step(self):
+        """Build and decode one mixed batch of decode tokens and prefill chunks"""
+        n = 0
+        logits_index = {}
+
+        # Decoding sequences first so a long prefill can't stall running stories
+        decoding = [sequence for sequence in self.active if not sequence.pending]
+        for position, sequence in enumerate(decoding):
+            if sequence.should_stop is not None and sequence.should_stop():
+                self.finish(sequence, "stop")
+                continue
+            # Drafts may not take the slots of the sequences still to come in this step
+            sequence.drafts = self.draft(sequence, self.n_batch - n - (len(decoding) - position))
+            indices = []
+            for token in [sequence.last_token] + sequence.drafts:
+                self.add_token(n, token, sequence.n_past, sequence.seq_id, True)
+                sequence.n_past += 1
+                indices.append(n)
+                n += 1
+            logits_index[sequence.seq_id] = indices
+
+        for sequence in self.active:
+            if not sequence.pending or n >= self.n_batch:
+                continue
+            take = min(len(sequence.pending), self.n_batch - n)
+            for k in range(take):
+                token = sequence.pending.popleft()
+                last = not sequence.pending
+                self.add_token(n, token, sequence.n_past + k, sequence.seq_id, last)
+                if last:
+                    logits_index[sequence.seq_id] = [n]
+                n += 1
+            sequence.n_past += take
+
+        if n == 0:
+            return
+        self.batch.n_tokens = n
+        result = llama_cpp.llama_decode(self.ctx, self.batch)
+        if result != 0:
+            # Admission keeps KV usage within n_ctx, so this only happens on a real failure
+            raise RuntimeError(f"llama_decode returned {result}")
+        self.steps += 1
+        self.tokens_decoded += n
+
+        for sequence in list(self.active):
+            indices = logits_index.get(sequence.seq_id)
+            if indices is None:
+                continue
+            if len(indices) == 1:
+                self.accept(sequence, self.sample(self.logits(indices[0]), sequence))
+            else:
+                self.verify(sequence, indices)
+
+    def logits(self, index):
+        return np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.ctx, index), shape=(self.n_vocab,))
+
+    def draft(self, sequence, room):
+        """Tokens proposed by the sequence's drafter, limited by batch room and its token budget"""
+        if sequence.drafter is None:
+            return []
+        limit = min(room, sequence.max_tokens - len(sequence.tokens) - 1)
+        if limit <= 0:
+            return []
+        history = np.array(sequence.prompt_tokens + sequence.tokens, dtype=np.intc)
+        return [int(token) for token in sequence.drafter(history)[:limit]]
+
+    def verify(self, sequence, indices):
+        """Sample every drafted position in order, keeping drafts until the first mismatch"""
+        start = sequence.n_past - len(indices)
+        accepted = 0
+        try:
+            for j, index in enumerate(indices):
+                token = self.sample(self.logits(index), sequence)
+                self.accept(sequence, token)
+                if sequence.done.is_set():
+                    return
+                if j < len(sequence.drafts) and token == sequence.drafts[j]:
+                    accepted += 1
+                    continue
+                break
+        finally:
+            sequence.drafted += len(sequence.drafts)
+            sequence.accepted += accepted
+            self.drafted += len(sequence.drafts)
+            self.accepted += accepted
+        # Rejected drafts leave KV cells behind; the last sampled token is decoded next step
+        keep = start + 1 + accepted
+        if keep < sequence.n_past:
+            remove_positions(self.ctx, sequence.seq_id, keep)
+            sequence.n_past = keep
+
+    def sample(self, logits, sequence):
+        """Llama's default sampler chain with the blocking path's settings
+
+        Repeat penalty over the last PENALTY_LAST_N tokens of prompt and
+        output, then top-k, top-p and min-p on the unscaled logits, and
+        temperature last, so a token is drawn from the same distribution
+        llama.cpp would draw it from (with a different random stream).
+        """
+        logits = np.array(logits, dtype=np.float32)
+        if sequence.repeat_penalty != 1.0:
+            ids = np.fromiter(set(sequence.recent_tokens(PENALTY_LAST_N)), dtype=np.int64)
+            values = logits[ids]
+            logits[ids] = np.where(values > 0, values / sequence.repeat_penalty, values * sequence.repeat_penalty)
+        if sequence.temperature <= 0:
+            return int(np.argmax(logits))
+
+        k = min(sequence.top_k if sequence.top_k > 0 else self.n_vocab, self.n_vocab)
+        candidates = np.argpartition(-logits, k - 1)[:k]
+        candidates = candidates[np.argsort(-logits[candidates])]
+        scores = logits[candidates]
+        probs = np.exp(scores - scores[0])
+        probs /= probs.sum()
+        keep = len(candidates)
+        if sequence.top_p < 1.0:
+            keep = min(keep, int(np.searchsorted(np.cumsum(probs), sequence.top_p)) + 1)
+        if sequence.min_p > 0:
+            # Sorted, so the tokens at least min_p times as likely as the best are a prefix
+            keep = min(keep, max(1, int(np.count_nonzero(probs >= sequence.min_p * probs[0]))))
+        scaled = scores[:keep] / sequence.temperature
+        probs = np.exp(scaled - scaled[0])
+        probs /= probs.sum()
+        return int(sequence.rng.choice(candidates[:keep], p=probs))
+
+    def accept(self, sequence, token):
+        if sequence.first_token_at is None:
+            sequence.first_token_at = time.time()
+        if token in self.eog_tokens:
+            self.finish(sequence, "stop")
+            return
+
+        sequence.tokens.append(token)
+        sequence.last_token = token
+        piece = self.llm.detokenize([token])
+        sequence.text += sequence.decoder.decode(piece)
+
+        for stop in sequence.stop:
+            position = sequence.text.find(stop)
+            if position != -1:
+                sequence.text = sequence.text[:position]
+                self.flush(sequence)
+                self.finish(sequence, "stop")
+                return
+
+        # Hold back text that could still grow into a stop sequence
+        holdback = max((len(stop) - 1 for stop in sequence.stop), default=0)
+        self.flush(sequence, holdback)
+        if len(sequence.tokens) >= sequence.max_tokens:
+            self.flush(sequence)
+            self.finish(sequence, "length")
+
+    def flush(self, sequence, holdback=0):
+        if sequence.on_chunk is None:
+            return
+        end = max(sequence.emitted, len(sequence.text) - holdback)
+        if end > sequence.emitted:
+            sequence.on_chunk(sequence.text[sequence.emitted:end])
+            sequence.emitted = end
+
+    def finish(self, sequence, reason, error=None):
+        if sequence in self.active:
+            self.active.remove(sequence)
+            self.clear_sequence(sequence.seq_id)
+            self.free_ids.append(sequence.seq_id)
+        sequence.finish_reason = reason
+        sequence.error = error
+        sequence.done.set()
+
+    def clear_sequence(self, seq_id):
+        """Release a sequence's KV cells"""
+        remove_positions(self.ctx, seq_id, -1)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "max_sequences": self.max_sequences,
+                "active": len(self.active),
+                "waiting": len(self.waiting),
+                "steps": self.steps,
+                "tokens_decoded": self.tokens_decoded,
+                "drafted": self.drafted,
+                "accepted": self.accepted,
+                "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else 0.0,
+            }
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        llama_cpp.llama_batch_free(self.batch)
+        llama_cpp.llama_free(self.ctx)
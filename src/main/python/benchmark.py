@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Benchmarks for the generator's own overhead: prompt building, memory
+extraction, protocol framing and end-to-end command handling.
+
+By default the model is replaced by FakeLlama, a deterministic stand-in that
+produces tokens at a configurable rate, so results measure this project's
+code rather than llama.cpp. Pass --model to run the same suite on a real GGUF.
+
+    python benchmark.py --iterations 200 --output bench.json
+    python benchmark.py --model path/to/model.gguf --iterations 5
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import atexit
+import argparse
+import platform
+import tempfile
+import contextlib
+from functools import partial
+
+from protocol import encode_frame, decode_frame, HEADER
+from session_memory import StoryMemory
+from story_generator_v2 import StoryGenerator, StorySetting
+
+SAMPLE_PASSAGE = (
+    "Elena decided to follow the river north before the storm arrived. "
+    "Marcus was tall and quiet, with a scar that crossed his left cheek. "
+    "They found an abandoned lighthouse where the keeper had left a journal full of maps. "
+    "Elena realized the maps described the same valley where her brother disappeared. "
+    "Marcus promised to guide her through the pass, although he seemed nervous about the old ruins. "
+    "At dawn they began the climb, and Elena discovered a hidden door carved into the rock. "
+)
+
+TOKEN_PATTERN = re.compile(rb"\s*\S+|\s+")
+
+# Background work that would add noise to the timings, and state that must not reach the user's files
+BENCHMARK_ENV = {
+    "STORY_SUMMARIZER": "0",
+    "STORY_SESSION_DB": "off",
+    "STORY_MEMORY_CHECK_SECONDS": "0",
+    "STORY_RETRIEVAL": "0",
+}
+
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class FakeState:
+    def __init__(self, input_ids):
+        self.input_ids = list(input_ids)
+        self.n_tokens = len(self.input_ids)
+        self.llama_state_size = 4 * self.n_tokens
+        self.scores = None
+
+
+class FakeLlama:
+    """Deterministic stand-in for llama_cpp.Llama
+
+    Tokens are whitespace-delimited words. Generation replays SAMPLE_PASSAGE
+    word by word, sleeping to emulate prompt-eval and decode rates (0 means no
+    delay). Prefix reuse mirrors llama.cpp: only prompt tokens past the longest
+    common prefix with the previous evaluation are charged as prefill, and a
+    cache set with set_cache is consulted and filled like Llama does.
+    """
+
+    def __init__(self, model_path=None, tokens_per_second=0.0, prompt_tokens_per_second=0.0,
+                 n_ctx=16384, **kwargs):
+        self.model_path = model_path
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self._n_ctx = n_ctx
+        self.vocab = {}
+        self.input_ids = []
+        self.cache = None
+        self.draft_model = None
+        self.metadata = {}
+        self.seed = kwargs.get("seed")
+        self.output_tokens = self.tokenize(SAMPLE_PASSAGE.encode("utf-8"), add_bos=False)
+
+    def tokenize(self, text, add_bos=True, special=False):
+        tokens = [1] if add_bos else []
+        for piece in TOKEN_PATTERN.findall(text):
+            token = 16 + zlib.crc32(piece) % 32000
+            self.vocab[token] = piece
+            tokens.append(token)
+        return tokens
+
+    def detokenize(self, tokens):
+        return b"".join(self.vocab.get(token, b"") for token in tokens)
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def set_seed(self, seed):
+        self.seed = seed
+
+    def n_vocab(self):
+        return 32016
+
+    def token_eos(self):
+        return 2
+
+    def reset(self):
+        self.input_ids = []
+
+    def save_state(self):
+        return FakeState(self.input_ids)
+
+    def load_state(self, state):
+        self.input_ids = list(state.input_ids)
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def prefill(self, prompt_tokens):
+        if self.cache is not None:
+            try:
+                cached = self.cache[prompt_tokens]
+                if common_prefix(cached.input_ids, prompt_tokens) > common_prefix(self.input_ids, prompt_tokens):
+                    self.load_state(cached)
+            except KeyError:
+                pass
+        common = common_prefix(self.input_ids, prompt_tokens)
+        if self.prompt_tokens_per_second:
+            time.sleep((len(prompt_tokens) - common) / self.prompt_tokens_per_second)
+        self.input_ids = list(prompt_tokens)
+
+    def __call__(self, prompt, max_tokens=16, stream=False, stop=None, stopping_criteria=None, **kwargs):
+        if kwargs.get("seed") is not None:
+            # Like Llama, a per-call seed sticks for later calls
+            self.set_seed(kwargs["seed"])
+        prompt_tokens = self.tokenize(prompt.encode("utf-8"), special=True) if isinstance(prompt, str) else prompt
+        self.prefill(prompt_tokens)
+        if stream:
+            return self.stream(prompt_tokens, max_tokens, stop or [], stopping_criteria)
+        text = "".join(chunk["choices"][0]["text"]
+                       for chunk in self.stream(prompt_tokens, max_tokens, stop or [], stopping_criteria))
+        completion_tokens = len(self.input_ids) - len(prompt_tokens)
+        return {
+            "choices": [{"text": text, "index": 0, "finish_reason": "length"}],
+            "usage": {
+                "prompt_tokens": len(prompt_tokens),
+                "completion_tokens": completion_tokens,
+                "total_tokens": len(prompt_tokens) + completion_tokens,
+            },
+        }
+
+    def stream(self, prompt_tokens, max_tokens, stop, stopping_criteria):
+        text = ""
+        for i in range(max_tokens):
+            if stopping_criteria is not None and stopping_criteria(self.input_ids, None):
+                break
+            if self.tokens_per_second:
+                time.sleep(1.0 / self.tokens_per_second)
+            token = self.output_tokens[i % len(self.output_tokens)]
+            self.input_ids.append(token)
+            piece = self.detokenize([token]).decode("utf-8", errors="ignore")
+            if any(s in text + piece for s in stop):
+                break
+            text += piece
+            yield {"choices": [{"text": piece, "index": 0, "finish_reason": None}]}
+        if self.cache is not None:
+            self.cache[self.input_ids] = self.save_state()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(function, iterations, warmup=3):
+    """Time a zero-argument callable and summarize its latency distribution"""
+    for _ in range(min(warmup, iterations)):
+        function()
+    samples = []
+    total_start = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    total = time.perf_counter() - total_start
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "total_seconds": round(total, 6),
+        "ops_per_second": round(iterations / total, 2) if total > 0 else 0.0,
+        "mean_ms": round(1000 * total / iterations, 4),
+        "p50_ms": round(1000 * percentile(samples, 0.50), 4),
+        "p99_ms": round(1000 * percentile(samples, 0.99), 4),
+    }
+
+
+def build_generator(args):
+    os.environ.update(BENCHMARK_ENV)
+    if args.model:
+        return StoryGenerator(model_path=args.model)
+    # StoryGenerator checks and maps the model file, so give it a small placeholder
+    placeholder = tempfile.NamedTemporaryFile(prefix="fake_model_", suffix=".gguf", delete=False)
+    placeholder.write(b"GGUF" + b"\0" * 4092)
+    placeholder.close()
+    atexit.register(os.remove, placeholder.name)
+    factory = partial(
+        FakeLlama,
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second
+    )
+    return StoryGenerator(model_path=placeholder.name, llm_factory=factory)
+
+
+def run_benchmarks(args):
+    generator = build_generator(args)
+    config = StorySetting(firstCharacter="Elena", secondCharacter="Marcus", genre="ADVENTURE")
+    config_json = json.dumps({
+        "firstCharacter": "Elena", "secondCharacter": "Marcus", "genre": "ADVENTURE", "sessionId": "bench"
+    })
+
+    populated = StoryMemory("populated")
+    for _ in range(5):
+        generator.update_story_memory(SAMPLE_PASSAGE, populated)
+
+    def update_memory():
+        generator.update_story_memory(SAMPLE_PASSAGE, StoryMemory("bench-update"))
+
+    request = {"id": 1, "command": "CONTINUE", "data": "They enter the ruins", "config": json.loads(config_json)}
+
+    def frame_round_trip():
+        frame = encode_frame(request)
+        decode_frame(frame[HEADER.size:])
+
+    generator.process_command("GENERATE", "A storm over the valley", config_json)
+    model_iterations = args.model_iterations or args.iterations
+
+    cases = [
+        ("create_story_prompt.generate",
+         lambda: generator.create_story_prompt(config, "A storm over the valley", False), args.iterations),
+        ("create_story_prompt.continue",
+         lambda: generator.create_story_prompt(config, "They enter the ruins", True, populated), args.iterations),
+        ("update_story_memory", update_memory, args.iterations),
+        ("get_memory_context", lambda: generator.get_memory_context(populated), args.iterations),
+        ("protocol.frame_round_trip", frame_round_trip, args.iterations),
+        ("process_command.generate",
+         lambda: generator.process_command("GENERATE", "A storm over the valley", config_json), model_iterations),
+        ("process_command.continue",
+         lambda: generator.process_command("CONTINUE", "They enter the ruins", config_json), model_iterations),
+    ]
+
+    results = {}
+    for name, function, iterations in cases:
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        # Generator logging goes to devnull so a slow terminal doesn't skew timings
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            results[name] = run_case(function, iterations)
+        print(f"⏱️  {name}: p50 {results[name]['p50_ms']} ms, p99 {results[name]['p99_ms']} ms, "
+              f"{results[name]['ops_per_second']} ops/s", file=sys.stderr)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark StoryGenerator overhead")
+    parser.add_argument("--model", help="Real GGUF to benchmark instead of the stand-in backend")
+    parser.add_argument("--iterations", type=int, default=200, help="Iterations per CPU-only case")
+    parser.add_argument("--model-iterations", type=int, default=0,
+                        help="Iterations for process_command cases (defaults to --iterations)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0,
+                        help="Stand-in decode rate; 0 measures pure overhead")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=0.0,
+                        help="Stand-in prefill rate; 0 measures pure overhead")
+    parser.add_argument("--only", nargs="*", help="Run only cases whose name starts with these prefixes")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    report = {
+        "backend": "llama.cpp" if args.model else "fake",
+        "model": args.model,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            "iterations": args.iterations,
+            "model_iterations": args.model_iterations or args.iterations,
+            "tokens_per_second": args.tokens_per_second,
+            "prompt_tokens_per_second": args.prompt_tokens_per_second,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"✅ Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
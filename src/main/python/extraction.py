@@ -0,0 +1,129 @@
+import re
+
+# All patterns are compiled once at import instead of on every memory update
+PROPER_NOUN = re.compile(r"\b[A-Z][a-z]{2,}\b")
+DIALOGUE_NAME = re.compile(r"\"([A-Z][a-z]+ [A-Z][a-z]+|[A-Z][a-z]+)\"")
+# Anchored on the (lower-case) verb so the scan stays on the regex engine's fast
+# literal-prefix path; the subject is read back from the words just before it.
+# The description sits in a lookahead so matches can overlap: in "Elena was happy
+# and Marcus was tall." the first description must not swallow Marcus's verb
+TRAIT = re.compile(r" (?=(?:was|is|had|has|seemed|looked|appeared) ([^.!?]+)[.!?])")
+SUBJECT_LOOKBACK = 64
+PUNCTUATION = "\"'()[]{},;:-"
+# Attribute patterns run on lower-cased text, which is much faster than IGNORECASE
+CUP_SIZE = re.compile(r"\b([a-d]+\s*cup)\b")
+EMOTIONAL_STATE = re.compile(r"\b(aroused|excited|embarrassed|terrified|calm|nervous|desperate)\b")
+SENTENCE_SPLIT = re.compile(r"[.!?]+")
+
+COMMON_WORDS = frozenset({
+    'The', 'And', 'But', 'For', 'With', 'This', 'That',
+    'There', 'Then', 'You', 'Your', 'They', 'She', 'He',
+    'It', 'We', 'Us', 'Our', 'Their', 'What', 'When', 'Where'
+})
+
+EVENT_KEYWORDS = (
+    'decided', 'began', 'found', 'discovered', 'realized',
+    'promised', 'agreed', 'refused', 'encountered', 'met',
+    'fought', 'traveled', 'learned', 'changed', 'revealed',
+    'grew', 'shrunk', 'aroused', 'calmed', 'grow', 'started'
+)
+
+MAX_CHARACTERS = 5
+MAX_EVENTS = 3
+
+
+class Extraction:
+    """Everything update_story_memory needs from one generated segment
+
+    Cup size and emotional state are only read when an already-known character
+    is mentioned again, so they are computed on first access.
+    """
+
+    def __init__(self, text, characters, traits, events):
+        self.text = text
+        self.characters = characters
+        self.traits = traits
+        self.events = events
+        self.attributes = None
+
+    def traits_for(self, name):
+        return self.traits.get(name.lower(), [])
+
+    @property
+    def cup_size(self):
+        return self.read_attributes()[0]
+
+    @property
+    def emotional_state(self):
+        return self.read_attributes()[1]
+
+    def read_attributes(self):
+        if self.attributes is None:
+            lowered = self.text.lower()
+            self.attributes = (first_match(CUP_SIZE, self.text, lowered),
+                               first_match(EMOTIONAL_STATE, self.text, lowered))
+        return self.attributes
+
+
+def first_match(pattern, text, lowered):
+    """First case-insensitive match of pattern, returned in the text's original case"""
+    if len(lowered) != len(text):
+        # Some characters change length when lower-cased, so spans would not line up
+        match = re.compile(pattern.pattern, re.IGNORECASE).search(text)
+        return match.group(1) if match else None
+    match = pattern.search(lowered)
+    return text[match.start(1):match.end(1)] if match else None
+
+
+class StoryExtractor:
+    """Single-pass entity and keyword extraction for story memory
+
+    Each pattern scans the text once and trait descriptions are grouped by
+    subject name, so the cost is linear in the text length no matter how many
+    characters are tracked. Event keywords are one compiled alternation
+    instead of a substring test per keyword.
+    """
+
+    def __init__(self, keywords=EVENT_KEYWORDS, max_characters=MAX_CHARACTERS, max_events=MAX_EVENTS, event_words=6):
+        self.keywords = re.compile("|".join(re.escape(k) for k in sorted(set(keywords), key=len, reverse=True)))
+        self.max_characters = max_characters
+        self.max_events = max_events
+        self.event_words = event_words
+
+    def extract(self, text):
+        return Extraction(text, self.characters(text), self.traits(text), self.events(text))
+
+    def characters(self, text):
+        """Likely character names in order of first appearance"""
+        names = [word for word in PROPER_NOUN.findall(text) if word not in COMMON_WORDS]
+        names.extend(DIALOGUE_NAME.findall(text))
+        return list(dict.fromkeys(names))[:self.max_characters]
+
+    def traits(self, text):
+        """Meaningful descriptions keyed by lower-cased one- and two-word subject names"""
+        traits = {}
+        for match in TRAIT.finditer(text):
+            description = match.group(1).strip()
+            if len(description.split()) <= 2:
+                continue
+            # Two words of lookback covers "John Smith was ..." style names
+            words = text[max(0, match.start() - SUBJECT_LOOKBACK):match.start()].rsplit(None, 2)[-2:]
+            if not words:
+                continue
+            name = words[-1].strip(PUNCTUATION).lower()
+            keys = [name]
+            if len(words) == 2:
+                keys.append(f"{words[0].strip(PUNCTUATION).lower()} {name}")
+            for key in keys:
+                traits.setdefault(key, []).append(description)
+        return traits
+
+    def events(self, text):
+        """Sentences longer than event_words words that mention an event keyword"""
+        events = []
+        for sentence in SENTENCE_SPLIT.split(text):
+            if len(sentence.split()) > self.event_words and self.keywords.search(sentence.lower()):
+                events.append(sentence.strip())
+                if len(events) == self.max_events:
+                    break
+        return events
@@ -0,0 +1,129 @@
+import sys
+import time
+import threading
+from collections import deque
+
+from model_registry import resident_set_bytes
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Degradation steps in the order they are taken; each level keeps the ones before it
+PRESSURE_LEVELS = ("normal", "shrink_caches", "reduce_context", "cap_tokens", "small_model")
+
+
+def available_memory_bytes():
+    """MemAvailable of the system, or None where it cannot be read"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    return None
+
+
+def gigabytes(value):
+    return "n/a" if value is None else f"{value / 1024 ** 3:.2f} GB"
+
+
+class MemoryPressureMonitor:
+    """Step the generator down through PRESSURE_LEVELS before the box starts swapping
+
+    A daemon thread samples the process RSS and the system's available
+    memory every interval seconds. While RSS is over rss_limit (0: not
+    checked) or available memory under min_available, the level rises one
+    step per sample, so each step gets a sample's time to take effect. The
+    level only falls back one step once both readings are clear by the
+    relief factor and the current level has held for hold_seconds, which
+    keeps a freed cache from flapping the level up and down. on_change(old,
+    new) applies a level; every transition is logged and kept for STATUS.
+    """
+
+    def __init__(self, on_change, rss_limit=0, min_available=1024 ** 3, interval=2.0, hold_seconds=30.0,
+                 relief=1.25, max_level=len(PRESSURE_LEVELS) - 1):
+        self.on_change = on_change
+        self.rss_limit = rss_limit
+        self.min_available = min_available
+        self.interval = interval
+        self.hold_seconds = hold_seconds
+        self.relief = relief
+        self.max_level = max_level
+        self.level = 0
+        self.changed_at = time.monotonic()
+        self.rss = 0
+        self.available = None
+        self.transitions = deque(maxlen=20)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="memory-monitor", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"❌ Memory check error: {str(e)}", file=sys.stderr)
+
+    def under_pressure(self):
+        return bool(
+            (self.rss_limit and self.rss > self.rss_limit)
+            or (self.available is not None and self.available < self.min_available)
+        )
+
+    def relieved(self):
+        return (
+            (not self.rss_limit or self.rss * self.relief < self.rss_limit)
+            and (self.available is None or self.available > self.min_available * self.relief)
+        )
+
+    def check(self):
+        """Take one sample and move at most one level"""
+        self.rss = resident_set_bytes()
+        self.available = available_memory_bytes()
+        held = time.monotonic() - self.changed_at >= self.hold_seconds
+        if self.under_pressure() and self.level < self.max_level:
+            self.set_level(self.level + 1)
+        elif self.level > 0 and held and self.relieved():
+            self.set_level(self.level - 1)
+
+    def set_level(self, level):
+        old = self.level
+        with self.lock:
+            self.level = level
+            self.changed_at = time.monotonic()
+            self.transitions.append({
+                "ts": round(time.time(), 3),
+                "from": PRESSURE_LEVELS[old],
+                "to": PRESSURE_LEVELS[level],
+                "rss_bytes": self.rss,
+                "available_bytes": self.available,
+            })
+        marker = "⚠️ " if level > old else "🌡️ "
+        print(f"{marker} Memory pressure: {PRESSURE_LEVELS[old]} -> {PRESSURE_LEVELS[level]} "
+              f"(RSS {gigabytes(self.rss)}, available {gigabytes(self.available)})", file=sys.stderr)
+        self.on_change(old, level)
+
+    def at_least(self, name):
+        return self.level >= PRESSURE_LEVELS.index(name)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "level": self.level,
+                "state": PRESSURE_LEVELS[self.level],
+                "rss_bytes": self.rss,
+                "available_bytes": self.available,
+                "rss_limit_bytes": self.rss_limit,
+                "min_available_bytes": self.min_available,
+                "transitions": list(self.transitions),
+            }
+
+    def close(self):
+        self.stop_event.set()
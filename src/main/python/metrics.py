@@ -0,0 +1,169 @@
+import time
+import bisect
+import threading
+import contextlib
+
+# Seconds, from a sub-millisecond regex pass to a full-length generation
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """Fixed-bucket histogram; quantiles are reported as the bucket's upper bound"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, round(self.max, 4))
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 4),
+        }
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, read back by the STATS command
+
+    Metrics are created on first use, so call sites only name what they
+    measure. Collectors are callables returning {group: {key: number}} that
+    are read at snapshot time, which is how the caches' own hit counters are
+    exported without double bookkeeping.
+    """
+
+    def __init__(self, prefix="story"):
+        self.prefix = prefix
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def counter(self, name, help_text=""):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, help_text)
+            return self.metrics[name]
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help_text, buckets)
+            return self.metrics[name]
+
+    def inc(self, name, amount=1, help_text=""):
+        metric = self.counter(name, help_text)
+        with self.lock:
+            metric.value += amount
+
+    def observe(self, name, value, help_text="", buckets=LATENCY_BUCKETS):
+        metric = self.histogram(name, help_text, buckets)
+        with self.lock:
+            metric.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, help_text=""):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help_text)
+
+    def collect(self, collector):
+        self.collectors.append(collector)
+
+    def collected(self):
+        groups = {}
+        for collector in self.collectors:
+            try:
+                groups.update(collector())
+            except Exception:
+                continue
+        return groups
+
+    def snapshot(self):
+        with self.lock:
+            counters = {name: m.snapshot() for name, m in self.metrics.items() if isinstance(m, Counter)}
+            histograms = {name: m.snapshot() for name, m in self.metrics.items() if isinstance(m, Histogram)}
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "counters": counters,
+            "histograms": histograms,
+            "collected": self.collected(),
+        }
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+            for name, metric in metrics:
+                full_name = f"{self.prefix}_{name}"
+                if metric.help_text:
+                    lines.append(f"# HELP {full_name} {metric.help_text}")
+                if isinstance(metric, Counter):
+                    lines.append(f"# TYPE {full_name} counter")
+                    lines.append(f"{full_name} {metric.value}")
+                    continue
+                lines.append(f"# TYPE {full_name} histogram")
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    cumulative += count
+                    lines.append(f'{full_name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{full_name}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{full_name}_sum {metric.sum}")
+                lines.append(f"{full_name}_count {metric.count}")
+        for group, values in sorted(self.collected().items()):
+            for key, value in sorted(flatten(values).items()):
+                full_name = f"{self.prefix}_{group}_{key}"
+                lines.append(f"# TYPE {full_name} gauge")
+                lines.append(f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def flatten(values, prefix=""):
+    """Numeric leaves of a nested stats dict, keyed by their joined path"""
+    flat = {}
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}_"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
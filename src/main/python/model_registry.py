@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Name of the model the generator loads at startup
+DEFAULT_MODEL = "default"
+
+
+def resident_set_bytes():
+    """This process's resident memory, or 0 where it cannot be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return 0
+
+
+def parse_models(spec):
+    """name=path,... or the path of a JSON file mapping names to GGUF paths"""
+    if not spec:
+        return {}
+    if spec.endswith(".json"):
+        with open(spec, encoding="utf-8") as f:
+            return {name: os.path.expanduser(path) for name, path in json.load(f).items()}
+    models = {}
+    for entry in filter(None, spec.split(",")):
+        name, _, path = entry.partition("=")
+        models[name.strip()] = os.path.expanduser(path.strip())
+    return models
+
+
+class LoadedModel:
+    def __init__(self, name, path, llm, load_seconds, resident_bytes, pinned=False):
+        self.name = name
+        self.path = path
+        self.llm = llm
+        self.load_seconds = load_seconds
+        self.resident_bytes = resident_bytes
+        # The main model backs the batch engine, prefix cache and session states
+        self.pinned = pinned
+        self.users = 0
+        self.requests = 0
+        self.last_used = time.time()
+
+    def stats(self):
+        return {
+            "load_seconds": self.load_seconds,
+            "resident_bytes": self.resident_bytes,
+            "requests": self.requests,
+            "in_use": self.users,
+            "idle_seconds": round(time.time() - self.last_used, 1),
+            "pinned": self.pinned,
+        }
+
+
+class ModelRegistry:
+    """GGUF models by name, loaded on first use and kept resident within a RAM budget
+
+    The generator's main model is adopted pinned and never evicted; any other
+    registered model is loaded the first time a request names it. Loaded
+    models are kept in least recently used order, and when a load would go
+    over ram_budget the models nobody is using are closed, oldest first.
+    A model's resident size is the larger of its file size and the RSS growth
+    measured across its load, which also covers its KV cache.
+    """
+
+    def __init__(self, loader, ram_budget=0, default=DEFAULT_MODEL):
+        self.loader = loader
+        self.ram_budget = ram_budget
+        self.default = default
+        self.paths = {}
+        self.loaded = OrderedDict()
+        self.warned = set()
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # One load at a time: two multi-GB loads racing would both overshoot the budget
+        self.load_lock = threading.Lock()
+
+    def register(self, name, path):
+        with self.lock:
+            self.paths[name] = path
+
+    def adopt(self, name, path, llm, load_seconds, resident_bytes):
+        """Add an already loaded model that is never evicted"""
+        with self.lock:
+            self.paths[name] = path
+            self.loaded[name] = LoadedModel(name, path, llm, load_seconds, resident_bytes, pinned=True)
+
+    def resolve(self, name):
+        """Registered name to serve a request with; the caller holds the lock"""
+        name = name or self.default
+        if name not in self.paths:
+            if name not in self.warned:
+                self.warned.add(name)
+                print(f"⚠️  Unknown model '{name}', using {self.default}", file=sys.stderr)
+            return self.default
+        # An entry for the main model's own file shares the loaded copy
+        path = os.path.abspath(self.paths[name])
+        for model in self.loaded.values():
+            if model.pinned and os.path.abspath(model.path) == path:
+                return model.name
+        return name
+
+    def acquire(self, name=None):
+        """The loaded model for name, loading it first if needed; pair with release()"""
+        with self.lock:
+            name = self.resolve(name)
+            model = self.loaded.get(name)
+            if model is not None:
+                return self.touch(model)
+        with self.load_lock:
+            with self.lock:
+                # Another request may have loaded it while this one waited
+                model = self.loaded.get(name)
+                if model is not None:
+                    return self.touch(model)
+                path = self.paths[name]
+            self.make_room(os.path.getsize(path))
+            print(f"⏳ Loading model '{name}'...", file=sys.stderr)
+            rss_before = resident_set_bytes()
+            start_time = time.time()
+            llm = self.loader(path)
+            load_seconds = round(time.time() - start_time, 3)
+            resident = max(os.path.getsize(path), resident_set_bytes() - rss_before)
+            model = LoadedModel(name, path, llm, load_seconds, resident)
+            with self.lock:
+                self.loaded[name] = model
+                self.loads += 1
+                self.touch(model)
+            print(f"📦 Model '{name}' loaded in {load_seconds:.1f}s ({resident / 1024 ** 3:.2f} GB resident)",
+                  file=sys.stderr)
+            return model
+
+    def release(self, model):
+        with self.lock:
+            model.users -= 1
+
+    def touch(self, model):
+        """Mark a model used; the caller holds the lock"""
+        model.users += 1
+        model.requests += 1
+        model.last_used = time.time()
+        self.loaded.move_to_end(model.name)
+        return model
+
+    def resident_bytes(self):
+        return sum(model.resident_bytes for model in self.loaded.values())
+
+    def make_room(self, needed):
+        """Close idle models, least recently used first, until needed more bytes fit the budget"""
+        if not self.ram_budget:
+            return
+        evicted = []
+        with self.lock:
+            while self.resident_bytes() + needed > self.ram_budget:
+                idle = [model for model in self.loaded.values() if not model.pinned and not model.users]
+                if not idle:
+                    print(f"⚠️  Model budget of {self.ram_budget / 1024 ** 3:.2f} GB exceeded, "
+                          f"every other model is in use", file=sys.stderr)
+                    break
+                del self.loaded[idle[0].name]
+                self.evictions += 1
+                evicted.append(idle[0])
+        self.close(evicted)
+
+    def evict_idle(self, keep=None):
+        """Close every loaded model nobody is using, except the pinned one and keep"""
+        with self.lock:
+            evicted = [model for model in self.loaded.values()
+                       if not model.pinned and not model.users and model.name != keep]
+            for model in evicted:
+                del self.loaded[model.name]
+            self.evictions += len(evicted)
+        self.close(evicted)
+        return len(evicted)
+
+    def close(self, models):
+        for model in models:
+            if hasattr(model.llm, "close"):
+                model.llm.close()
+            print(f"📦 Model '{model.name}' evicted ({model.resident_bytes / 1024 ** 3:.2f} GB freed)",
+                  file=sys.stderr)
+
+    def names(self):
+        with self.lock:
+            return sorted(self.paths)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "budget_bytes": self.ram_budget,
+                "resident_bytes": self.resident_bytes(),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "loaded": {name: model.stats() for name, model in self.loaded.items()},
+            }
+
+
+def build_model_registry(loader):
+    """Models from STORY_MODELS, within STORY_MODEL_RAM_BUDGET bytes (0: no limit)"""
+    registry = ModelRegistry(loader, ram_budget=int(os.environ.get("STORY_MODEL_RAM_BUDGET", 8 * 1024 ** 3)))
+    for name, path in parse_models(os.environ.get("STORY_MODELS")).items():
+        registry.register(name, path)
+    return registry
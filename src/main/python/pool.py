@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import zlib
+import itertools
+import threading
+import subprocess
+
+from protocol import FrameWriter, ProtocolError, read_frame, parse_request
+from session_memory import DEFAULT_SESSION_ID
+
+# Frame types that finish a request; anything else (chunk) is intermediate
+TERMINAL_FRAMES = {"response", "end", "error", "cancelled", "deadline"}
+
+
+class Worker:
+    """One framed-protocol StoryGenerator child process"""
+
+    def __init__(self, index, command, env):
+        self.index = index
+        self.command = command
+        self.env = env
+        self.process = None
+        self.writer = None
+        self.reader = None
+        self.in_flight = {}
+        self.requests = 0
+        self.restarts = -1
+        self.busy_seconds = 0.0
+        self.busy_since = None
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def start(self, on_frame, on_exit):
+        # stderr is inherited so worker logs reach the same place as the dispatcher's
+        self.process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=self.env
+        )
+        self.writer = FrameWriter(self.process.stdin)
+        self.restarts += 1
+        self.reader = threading.Thread(
+            target=self.read_loop, args=(on_frame, on_exit), name=f"worker-{self.index}-reader", daemon=True
+        )
+        self.reader.start()
+        print(f"👷 Worker {self.index} started (pid {self.process.pid})", file=sys.stderr)
+
+    def read_loop(self, on_frame, on_exit):
+        try:
+            while True:
+                message = read_frame(self.process.stdout)
+                if message is None:
+                    break
+                on_frame(self, message)
+        except (ProtocolError, ValueError, OSError) as e:
+            print(f"❌ Worker {self.index} stream error: {str(e)}", file=sys.stderr)
+        on_exit(self)
+
+    def mark_started(self, request_id):
+        with self.lock:
+            if not self.in_flight:
+                self.busy_since = time.monotonic()
+            self.in_flight[request_id] = time.monotonic()
+            self.requests += 1
+
+    def mark_finished(self, request_id):
+        with self.lock:
+            if self.in_flight.pop(request_id, None) is not None and not self.in_flight:
+                self.busy_seconds += time.monotonic() - self.busy_since
+                self.busy_since = None
+
+    def stats(self):
+        with self.lock:
+            busy = self.busy_seconds
+            if self.busy_since is not None:
+                busy += time.monotonic() - self.busy_since
+            uptime = time.monotonic() - self.started_at
+            return {
+                "worker": self.index,
+                "pid": self.process.pid if self.process else None,
+                "alive": self.process is not None and self.process.poll() is None,
+                "in_flight": len(self.in_flight),
+                "requests": self.requests,
+                "restarts": self.restarts,
+                "busy_seconds": round(busy, 3),
+                "utilization": round(busy / uptime, 4) if uptime > 0 else 0.0,
+            }
+
+
+class WorkerPool:
+    """Dispatch framed requests over N StoryGenerator processes
+
+    Each worker loads the model with use_mmap, so the weights stay in the
+    shared page cache once instead of being copied into every process. A
+    session is pinned to one worker, keeping its memory and KV state local.
+    """
+
+    def __init__(self, script_path, num_workers, protocol_args=None):
+        self.num_workers = max(1, num_workers)
+        self.client = None
+        self.routes = {}
+        self.broadcasts = {}
+        self.internal_ids = itertools.count()
+        self.closing = False
+        self.lock = threading.Lock()
+
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        threads_per_worker = max(1, cores // self.num_workers)
+        command = [sys.executable, script_path, "--protocol", "framed"] + (protocol_args or [])
+        self.workers = []
+        for index in range(self.num_workers):
+            env = dict(os.environ)
+            env["STORY_N_THREADS"] = str(threads_per_worker)
+            if env.get("STORY_STATE_CACHE_DIR"):
+                env["STORY_STATE_CACHE_DIR"] = os.path.join(env["STORY_STATE_CACHE_DIR"], f"worker-{index}")
+            self.workers.append(Worker(index, command, env))
+        print(f"👷 Pool: {self.num_workers} workers x {threads_per_worker} threads", file=sys.stderr)
+
+    def start(self, client_writer):
+        self.client = client_writer
+        for worker in self.workers:
+            worker.start(self.on_worker_frame, self.on_worker_exit)
+
+    def pick_worker(self, config_json):
+        """Sessions hash to a fixed worker
+
+        Session-less requests use DEFAULT_SESSION_ID inside the worker, so
+        they hash like it: a GENERATE and the CONTINUE after it must meet
+        the same story memory.
+        """
+        try:
+            session_id = json.loads(config_json or "{}").get("sessionId")
+        except (ValueError, AttributeError):
+            session_id = None
+        key = DEFAULT_SESSION_ID if session_id is None else session_id
+        return self.workers[zlib.crc32(str(key).encode("utf-8")) % self.num_workers], session_id
+
+    def dispatch(self, message):
+        try:
+            request_id, command, data, config_json = parse_request(message)
+        except ProtocolError as e:
+            self.client.send(message.get("id"), "error", error=f"Invalid request: {str(e)}")
+            return
+
+        if command == "POOL_STATS":
+            self.client.send(request_id, "response", result=json.dumps(self.stats()))
+            return
+
+        if command == "CANCEL":
+            target_id = message.get("target", data)
+            worker = self.routes.get(self.route_key(target_id))
+            if worker is None:
+                self.client.send(request_id, "response", result=f"Request not found: {target_id}")
+                return
+            self.forward(worker, request_id, message)
+            return
+
+        worker, session_id = self.pick_worker(config_json)
+        if command == "CLEAR_MEMORY" and session_id is None:
+            self.broadcast(request_id, message)
+            return
+        self.forward(worker, request_id, message)
+
+    def route_key(self, request_id):
+        return json.dumps(request_id)
+
+    def forward(self, worker, request_id, message):
+        with self.lock:
+            self.routes[self.route_key(request_id)] = worker
+        worker.mark_started(request_id)
+        try:
+            worker.writer.write(message)
+        except OSError as e:
+            self.finish(worker, request_id)
+            self.client.send(request_id, "error", error=f"Worker {worker.index} unavailable: {str(e)}")
+
+    def broadcast(self, request_id, message):
+        """Send a session-less CLEAR_MEMORY to every worker and answer once"""
+        internal = [f"pool-broadcast-{next(self.internal_ids)}" for _ in self.workers]
+        with self.lock:
+            for internal_id in internal:
+                self.broadcasts[internal_id] = (request_id, internal)
+        for worker, internal_id in zip(self.workers, list(internal)):
+            self.forward(worker, internal_id, dict(message, id=internal_id))
+
+    def on_worker_frame(self, worker, message):
+        request_id = message.get("id")
+        if message.get("type") in TERMINAL_FRAMES:
+            self.finish(worker, request_id)
+
+        with self.lock:
+            broadcast = self.broadcasts.pop(request_id, None) if isinstance(request_id, str) else None
+        if broadcast is not None:
+            client_id, internal = broadcast
+            with self.lock:
+                internal.remove(request_id)
+                done = not internal
+            if done:
+                self.client.send(client_id, "response", result=message.get("result", message.get("error", "")))
+            return
+
+        self.client.write(message)
+
+    def finish(self, worker, request_id):
+        worker.mark_finished(request_id)
+        with self.lock:
+            self.routes.pop(self.route_key(request_id), None)
+
+    def on_worker_exit(self, worker):
+        """Fail the dead worker's in-flight requests and start a replacement"""
+        code = worker.process.wait()
+        print(f"❌ Worker {worker.index} exited with code {code}", file=sys.stderr)
+        for request_id in list(worker.in_flight):
+            self.finish(worker, request_id)
+            self.client.send(request_id, "error", error=f"Worker {worker.index} exited with code {code}")
+        if not self.closing:
+            worker.start(self.on_worker_frame, self.on_worker_exit)
+
+    def stats(self):
+        return {"workers": [worker.stats() for worker in self.workers]}
+
+    def serve(self, stream, client_stream):
+        """Read client frames until the stream closes, then let workers drain and exit"""
+        self.start(FrameWriter(client_stream))
+        while True:
+            try:
+                message = read_frame(stream)
+            except (ProtocolError, ValueError) as e:
+                print(f"❌ Protocol error: {str(e)}", file=sys.stderr)
+                self.client.send(None, "error", error=f"Protocol error: {str(e)}")
+                break
+            if message is None:
+                print("📭 Input closed (possible shutdown)", file=sys.stderr)
+                break
+            self.dispatch(message)
+
+        self.closing = True
+        for worker in self.workers:
+            try:
+                worker.process.stdin.close()
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker.reader.join()
@@ -0,0 +1,148 @@
+import abc
+import sys
+import threading
+
+import diskcache
+from llama_cpp import LlamaRAMCache, LlamaDiskCache
+
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class CountingPrefixCache(abc.ABC):
+    """Hit/miss accounting and a minimum useful prefix for llama-cpp-python caches
+
+    Llama looks the cache up with every prompt and stores the evaluated state
+    after every completion, so a new story whose prompt starts with an already
+    evaluated preamble restores that state and only prefills the rest. A match
+    shorter than min_prefix_tokens (every prompt shares the BOS token) counts
+    as a miss, so a large state is never restored to save a handful of tokens.
+    """
+
+    def init_counters(self, min_prefix_tokens):
+        self.min_prefix_tokens = min_prefix_tokens
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.reused_tokens = 0
+        self.stats_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def cached_keys(self):
+        """Token tuples currently cached"""
+
+    @abc.abstractmethod
+    def load(self, key):
+        """State stored under an exact cached key"""
+
+    @abc.abstractmethod
+    def store(self, key, value):
+        """Save a state under key, evicting as the backend's capacity requires"""
+
+    def lookup(self, key):
+        """Longest cached key sharing a prefix with key, and the prefix length"""
+        best_key, best_len = None, 0
+        for cached in self.cached_keys():
+            prefix = common_prefix(cached, key)
+            if prefix > best_len:
+                best_key, best_len = cached, prefix
+        return best_key, best_len
+
+    def __getitem__(self, key):
+        key = tuple(key)
+        best_key, prefix = self.lookup(key)
+        with self.stats_lock:
+            if best_key is None or prefix < self.min_prefix_tokens:
+                self.misses += 1
+                raise KeyError("No cached prefix long enough")
+            self.hits += 1
+            self.reused_tokens += prefix
+        return self.load(best_key)
+
+    def __contains__(self, key):
+        return self.lookup(tuple(key))[1] >= self.min_prefix_tokens
+
+    def __setitem__(self, key, value):
+        self.store(tuple(key), value)
+        with self.stats_lock:
+            self.stores += 1
+
+    def stats(self):
+        with self.stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "reused_tokens": self.reused_tokens,
+                "bytes": self.cache_size,
+                "capacity_bytes": self.capacity_bytes,
+            }
+
+
+class RAMPrefixCache(CountingPrefixCache, LlamaRAMCache):
+    """LRU prefix cache in process memory, bounded by capacity_bytes"""
+
+    def __init__(self, capacity_bytes, min_prefix_tokens=32):
+        LlamaRAMCache.__init__(self, capacity_bytes)
+        self.init_counters(min_prefix_tokens)
+
+    def cached_keys(self):
+        return list(self.cache_state.keys())
+
+    def load(self, key):
+        self.cache_state.move_to_end(key)
+        return self.cache_state[key]
+
+    def store(self, key, value):
+        LlamaRAMCache.__setitem__(self, key, value)
+
+    def resize(self, capacity_bytes):
+        """Change the capacity, dropping least recently used states until they fit"""
+        self.capacity_bytes = capacity_bytes
+        while self.cache_size > self.capacity_bytes and self.cache_state:
+            self.cache_state.popitem(last=False)
+
+
+class DiskPrefixCache(CountingPrefixCache, LlamaDiskCache):
+    """Prefix cache in a diskcache directory, bounded by capacity_bytes
+
+    LlamaDiskCache removes an entry when it is read, so the same preamble
+    could only be reused once; here reads leave the entry in place and
+    diskcache itself evicts the least recently used states.
+    """
+
+    def __init__(self, cache_dir, capacity_bytes, min_prefix_tokens=32):
+        self.capacity_bytes = capacity_bytes
+        self.cache = diskcache.Cache(
+            cache_dir, size_limit=capacity_bytes, eviction_policy="least-recently-used"
+        )
+        self.init_counters(min_prefix_tokens)
+
+    def cached_keys(self):
+        return list(self.cache.iterkeys())
+
+    def load(self, key):
+        return self.cache[key]
+
+    def store(self, key, value):
+        self.cache[key] = value
+
+
+def build_prefix_cache(kind, capacity_bytes, cache_dir=None, min_prefix_tokens=32):
+    """ram, disk or off; returns None when disabled"""
+    if kind == "off" or capacity_bytes <= 0:
+        return None
+    if kind == "disk":
+        cache_dir = cache_dir or ".cache/story_prefix_cache"
+        print(f"🗂️  Prefix cache: disk {cache_dir}, {capacity_bytes / 1024 ** 3:.1f} GB", file=sys.stderr)
+        return DiskPrefixCache(cache_dir, capacity_bytes, min_prefix_tokens)
+    print(f"🗂️  Prefix cache: RAM, {capacity_bytes / 1024 ** 3:.1f} GB", file=sys.stderr)
+    return RAMPrefixCache(capacity_bytes, min_prefix_tokens)
@@ -0,0 +1,351 @@
+import os
+import sys
+import importlib
+import threading
+
+from extraction import StoryExtractor, EVENT_KEYWORDS
+
+DEFAULT_PROFILE = "v2"
+
+
+class StoryProfile:
+    """Prompt and memory policy of one generator variant
+
+    A profile only decides what goes into a prompt and what is remembered
+    from a generated segment; the model, caches and sessions are shared by
+    every profile, so serving several profiles costs no extra model load.
+    """
+
+    name = DEFAULT_PROFILE
+    event_keywords = EVENT_KEYWORDS
+    max_characters = 5
+    max_events = 3
+    event_words = 6
+    # Cup size and emotional state per character
+    track_attributes = True
+    # Feed finished turns to the background summarizer
+    summarize = True
+    # Index segments for embedding retrieval and recall them into continuations
+    recall = True
+    generate_tokens = 500
+    continue_tokens = 500
+    # Cap on prompt plus output, below the loaded context (None: the whole context)
+    context_tokens = None
+
+    def __init__(self):
+        self.extractor = StoryExtractor(
+            self.event_keywords, self.max_characters, self.max_events, self.event_words
+        )
+
+    def add_first_chapter(self, builder, config, user_input):
+        # Genre and perspective come first so stories of the same kind share a cached prefix
+        builder.add("preamble", f"""<start_of_turn>system
+            You are a skilled storyteller. Write the FIRST CHAPTER of a {config.genre} story.
+
+            WRITING STYLE:
+            - Use {config.perspective} perspective
+            - Write in a style fitting for {config.genre}
+            - Introduce an engaging conflict or mystery
+            - Create vivid descriptions and natural dialogue
+            - Length: approximately 400-500 words
+
+            Respond only with the story text, no commentary or metadata.
+            """)
+        builder.add("system", f"""INITIAL SITUATION: {user_input}
+
+            MAIN CHARACTERS:
+            - {config.firstCharacter}
+            - {config.secondCharacter}<end_of_turn>
+            """)
+        builder.add("user", """<start_of_turn>user
+            Begin the story now<end_of_turn>
+            <start_of_turn>model
+            """)
+
+    def continuation_preamble(self, config):
+        return f"""<start_of_turn>system
+            You are continuing a {config.genre} story. Maintain perfect consistency.
+
+            PERSPECTIVE: {config.perspective}
+
+            INSTRUCTIONS:
+            - Maintain perfect consistency with established characters, events, tone and last conversation
+            - Develop the plot forward in a compelling way
+            - Take extra attention on describing physical traits if {config.genre} is "EROTIC"
+            - Include descriptive elements and natural dialogue
+            - Length: 400-500 words
+            - Respond only with the next narrative segment
+            """
+
+    def add_continuation(self, builder, config, user_input, memory):
+        # Enhanced context for continuations
+        builder.add("preamble", self.continuation_preamble(config))
+        builder.add("system", f"""CHARACTERS:
+            - {config.firstCharacter}
+            - {config.secondCharacter}
+            """)
+        self.add_memory_sections(builder, memory)
+        builder.add("instructions", f"""Continue naturally based on: {user_input}<end_of_turn>
+            """)
+        builder.add("user", f"""<start_of_turn>user
+            {user_input}<end_of_turn>
+            <start_of_turn>model
+            """)
+
+    def turn_prompt(self, user_input):
+        """Next user turn appended to a session transcript"""
+        return (
+            f"<start_of_turn>user\n"
+            f"Continue the story based on: {user_input}\n"
+            f"Keep characters, events and tone consistent. Length: 400-500 words.<end_of_turn>\n"
+            f"<start_of_turn>model\n"
+        )
+
+    def add_memory_sections(self, builder, memory):
+        """Add memory as prompt sections; higher priority numbers are dropped first when over budget
+
+        The two main characters and the latest plot developments are kept
+        longest, then the rolling summary; minor characters and older events
+        go first.
+        """
+        if memory is None or not (memory.character_memory or memory.recalled):
+            builder.add("memory", "CONTEXT: Beginning a new story.")
+            return builder
+
+        builder.group("characters", "CHARACTER CONTEXT:")
+        for index, (char, info) in enumerate(list(memory.character_memory.items())[:4]):  # Main characters
+            entry = f"- {char}: mentioned {info['mentions']} times"
+            if info.get('traits'):
+                entry += f", traits: {', '.join(info['traits'][:2])}"
+            if info.get('cup_size'):
+                entry += f", cup size: {info['cup_size']}"
+            if info.get('emotional_state'):
+                entry += f", emotional state: {info['emotional_state']}"
+            builder.add(f"character:{char}", entry, priority=1 if index < 2 else 4, group="characters")
+
+        if memory.key_events:
+            builder.group("events", "RECENT PLOT DEVELOPMENTS:")
+            recent = memory.key_events[-3:]  # Recent key events
+            for index, event in enumerate(recent):
+                builder.add(f"event:{index}", f"- {event}", priority=2 if index == len(recent) - 1 else 5,
+                            group="events")
+
+        if memory.story_summary:
+            builder.add("summary", f"STORY SUMMARY: {memory.story_summary}", priority=3)
+
+        if memory.recalled:
+            builder.group("passages", "RELEVANT EARLIER PASSAGES:")
+            for index, passage in enumerate(memory.recalled):
+                builder.add(f"passage:{index}", f"- {passage}", priority=4, group="passages")
+        return builder
+
+    def new_character(self, text, extraction, char):
+        entry = {
+            "mentions": 1,
+            "last_seen": text[:250],
+            "traits": list(extraction.traits_for(char)),
+        }
+        if self.track_attributes:
+            entry["cup_size"] = None  # Track cup size
+            entry["emotional_state"] = None  # Track emotional state
+        return entry
+
+    def update_character(self, entry, extraction, char):
+        # Update traits if new ones are discovered
+        entry["traits"].extend(t for t in extraction.traits_for(char) if t not in entry["traits"])
+        if not self.track_attributes:
+            return
+        # Update cup size and emotional state if mentioned
+        if extraction.cup_size:
+            entry["cup_size"] = extraction.cup_size
+        if extraction.emotional_state:
+            entry["emotional_state"] = extraction.emotional_state
+
+    def memory_log(self, memory):
+        return (f"🧠 Memory updated [{memory.session_id}]: {len(memory.character_memory)} chars, "
+                f"{len(memory.key_events)} events")
+
+
+class CensoredProfile(StoryProfile):
+    """story_generator_censored.py: no physical attributes and a neutral continuation prompt"""
+
+    name = "censored"
+    event_keywords = (
+        'decided', 'began', 'found', 'discovered', 'realized',
+        'promised', 'agreed', 'refused', 'encountered', 'met',
+        'fought', 'traveled', 'learned', 'changed', 'revealed'
+    )
+    track_attributes = False
+    continue_tokens = 450
+
+    def continuation_preamble(self, config):
+        return f"""<start_of_turn>system
+            You are continuing a {config.perspective} story. Maintain perfect consistency.
+
+            PERSPECTIVE: {config.perspective}
+
+            INSTRUCTIONS:
+            - Maintain perfect consistency with established characters, events, and tone
+            - Develop the plot forward in a compelling way
+            - Include descriptive elements and natural dialogue
+            - Length: 400-500 words
+            - Respond only with the next narrative segment
+            """
+
+
+class V1Profile(StoryProfile):
+    """story_generator.py: short chapters, Spanish plot-point keywords and a mentions-only memory"""
+
+    name = "v1"
+    event_keywords = ('decidió', 'empezó', 'encontró', 'descubrió', 'sintió', 'pensó')
+    max_characters = 4
+    max_events = 2
+    event_words = 5
+    track_attributes = False
+    summarize = False
+    recall = False
+    context_tokens = 8192
+
+    def add_first_chapter(self, builder, config, user_input):
+        builder.add("preamble", f"""<start_of_turn>system
+            Write the FIRST CHAPTER of a {config.perspective} story with:
+            """)
+        builder.add("system", f"""INITIAL SITUATION: {config.situation}
+
+            MAIN CHARACTERS:
+            1. {config.firstCharacter}
+            2. {config.secondCharacter}
+
+            RULES:
+            - Use perspective: {config.perspective}
+            - Narrative style appropriate for the genre
+            - Introduce initial conflict or mystery
+            - Length: approximately 300-400 words
+
+            Respond only with the story text, no comments.<end_of_turn>
+            """)
+        builder.add("user", """<start_of_turn>user
+            Begin the story<end_of_turn>
+            <start_of_turn>model
+            """)
+
+    def add_continuation(self, builder, config, user_input, memory):
+        builder.add("preamble", f"""<start_of_turn>system
+            Continue the story maintaining coherence with:
+
+            Genre: {config.genre}
+            Characters: {config.firstCharacter} and {config.secondCharacter}
+            Perspective: {config.perspective}
+            """)
+        self.add_memory_sections(builder, memory)
+        if config.current_story:
+            builder.add("previous", f"Previous context: {config.current_story[:800]}...", priority=6)
+        builder.add("instructions", f"""INSTRUCTIONS:
+            - Develop the story naturally based on: {user_input}
+            - Maintain consistency with established characters and events
+            - Length: 300-400 words
+            - Respond only with the next narrative segment
+
+            Respond only with narrative text, no metadata.<end_of_turn>
+            """)
+        builder.add("user", f"""<start_of_turn>user
+            {user_input}<end_of_turn>
+            <start_of_turn>model
+            """)
+
+    def turn_prompt(self, user_input):
+        return (
+            f"<start_of_turn>user\n"
+            f"Continue the story based on: {user_input}\n"
+            f"Maintain consistency with established characters and events. Length: 300-400 words.<end_of_turn>\n"
+            f"<start_of_turn>model\n"
+        )
+
+    def add_memory_sections(self, builder, memory):
+        if memory is None or not memory.character_memory:
+            builder.add("memory", "MEMORIA: Primera generación de la historia.")
+            return builder
+        builder.group("characters", "MEMORIA DE PERSONAJES:")
+        for index, (char, info) in enumerate(list(memory.character_memory.items())[:3]):
+            builder.add(f"character:{char}", f"- {char}: mentioned {info['mentions']} times",
+                        priority=1 if index < 2 else 4, group="characters")
+        if memory.key_events:
+            builder.group("events", "RECENT EVENTS:")
+            recent = memory.key_events[-3:]
+            for index, event in enumerate(recent):
+                builder.add(f"event:{index}", f"- {event}", priority=2 if index == len(recent) - 1 else 5,
+                            group="events")
+        return builder
+
+    def new_character(self, text, extraction, char):
+        return {"mentions": 1, "last_seen": text[:200], "traits": []}
+
+    def update_character(self, entry, extraction, char):
+        pass
+
+    def memory_log(self, memory):
+        return (f"🧠 Memoria actualizada [{memory.session_id}]: {len(memory.character_memory)} personajes, "
+                f"{len(memory.key_events)} eventos")
+
+
+# Built-in profiles; more can be added with STORY_PROFILE_PLUGINS="name=module:Class,..."
+BUILTIN_PROFILES = {
+    "v2": "profiles:StoryProfile",
+    "censored": "profiles:CensoredProfile",
+    "v1": "profiles:V1Profile",
+}
+
+
+class ProfileRegistry:
+    """Profiles by name, imported and instantiated the first time a request asks for one"""
+
+    def __init__(self, default=DEFAULT_PROFILE, plugins=None):
+        self.default = default
+        self.factories = dict(BUILTIN_PROFILES)
+        self.profiles = {}
+        self.lock = threading.Lock()
+        for entry in filter(None, (plugins or "").split(",")):
+            name, _, target = entry.partition("=")
+            self.register(name.strip(), target.strip())
+
+    def register(self, name, factory):
+        """factory is a profile class, or a "module:attribute" path imported on first use"""
+        with self.lock:
+            self.factories[name] = factory
+            self.profiles.pop(name, None)
+
+    def get(self, name=None):
+        name = name or self.default
+        with self.lock:
+            profile = self.profiles.get(name)
+            if profile is not None:
+                return profile
+            if name not in self.factories:
+                # Remembered as an alias of the default, so the warning shows once
+                print(f"⚠️  Unknown profile '{name}', using {self.default}", file=sys.stderr)
+                profile = self.profiles[name] = self.load(self.default)
+                return profile
+            return self.load(name)
+
+    def load(self, name):
+        """Import and instantiate a profile; the caller holds the lock"""
+        if name in self.profiles:
+            return self.profiles[name]
+        factory = self.factories[name]
+        if isinstance(factory, str):
+            module_name, _, attribute = factory.partition(":")
+            factory = getattr(importlib.import_module(module_name), attribute)
+        profile = self.profiles[name] = factory()
+        print(f"🎭 Profile loaded: {name}", file=sys.stderr)
+        return profile
+
+    def names(self):
+        with self.lock:
+            return sorted(self.factories)
+
+
+def build_registry():
+    return ProfileRegistry(
+        default=os.environ.get("STORY_PROFILE", DEFAULT_PROFILE),
+        plugins=os.environ.get("STORY_PROFILE_PLUGINS")
+    )
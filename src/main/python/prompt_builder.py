@@ -0,0 +1,89 @@
+import re
+
+BLANK_LINES = re.compile(r"\n{3,}")
+
+# Sections with this priority are never dropped; higher numbers are dropped first
+REQUIRED = 0
+
+
+def compact(text):
+    """Strip template indentation and collapse runs of blank lines"""
+    lines = "\n".join(line.strip() for line in text.strip().splitlines())
+    return BLANK_LINES.sub("\n\n", lines) + "\n"
+
+
+class PromptSection:
+    def __init__(self, name, text, priority, group=None):
+        self.name = name
+        self.text = compact(text)
+        self.priority = priority
+        self.group = group
+        self.tokens = None
+
+
+class PromptBuilder:
+    """Assemble a prompt from named sections within a token budget
+
+    Sections render in the order they were added, separated by a blank line;
+    consecutive sections of the same group share one header line. When the
+    rendered prompt is over budget the optional section with the highest
+    priority number (the latest one on ties) is dropped until it fits.
+    After build(), report holds the token count of every section.
+    """
+
+    def __init__(self, count_tokens, budget):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.sections = []
+        self.groups = {}
+        self.report = {}
+
+    def add(self, name, text, priority=REQUIRED, group=None):
+        if text and text.strip():
+            self.sections.append(PromptSection(name, text, priority, group))
+        return self
+
+    def group(self, name, header):
+        self.groups[name] = header
+        return self
+
+    def render(self, sections):
+        blocks = []
+        current_group = None
+        for section in sections:
+            if section.group is not None and section.group == current_group:
+                blocks[-1] += section.text
+                continue
+            current_group = section.group
+            header = f"{self.groups[section.group]}\n" if section.group is not None else ""
+            blocks.append(header + section.text)
+        return "\n".join(blocks)
+
+    def render_all(self):
+        """Every section, ignoring the budget"""
+        return self.render(self.sections)
+
+    def build(self):
+        kept = list(self.sections)
+        dropped = []
+        prompt = self.render(kept)
+        total = self.count_tokens(prompt)
+        while self.budget and total > self.budget:
+            optional = [s for s in kept if s.priority != REQUIRED]
+            if not optional:
+                break
+            victim = max(reversed(optional), key=lambda s: s.priority)
+            kept.remove(victim)
+            dropped.append(victim.name)
+            prompt = self.render(kept)
+            total = self.count_tokens(prompt)
+
+        for section in kept:
+            section.tokens = self.count_tokens(section.text)
+        self.report = {
+            "total_tokens": total,
+            "budget": self.budget,
+            "sections": {section.name: section.tokens for section in kept},
+            "dropped": dropped,
+        }
+        return prompt
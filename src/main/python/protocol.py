@@ -0,0 +1,85 @@
+import json
+import struct
+import threading
+
+# Every frame is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON
+HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(message):
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(body) > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Frame too large: {len(body)} bytes")
+    return HEADER.pack(len(body)) + body
+
+
+def decode_frame(body):
+    message = json.loads(body.decode("utf-8"))
+    if not isinstance(message, dict):
+        raise ProtocolError("Frame payload must be a JSON object")
+    return message
+
+
+def read_exact(stream, size):
+    """Read exactly size bytes, or return None on a clean end of stream"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ProtocolError("Stream closed in the middle of a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(stream):
+    """Read one frame from a binary stream, None when the peer closed it"""
+    header = read_exact(stream, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Frame too large: {length} bytes")
+    body = read_exact(stream, length) if length else b""
+    if body is None:
+        raise ProtocolError("Stream closed in the middle of a frame")
+    return decode_frame(body)
+
+
+class FrameWriter:
+    """Thread-safe frame writer so responses to different requests never interleave"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, message):
+        frame = encode_frame(message)
+        with self.lock:
+            self.stream.write(frame)
+            self.stream.flush()
+
+    def send(self, request_id, kind, **payload):
+        message = {"id": request_id, "type": kind}
+        message.update(payload)
+        self.write(message)
+
+
+def parse_request(message):
+    """Split a request frame into (request_id, command, data, config_json)"""
+    request_id = message.get("id")
+    command = message.get("command")
+    if not command:
+        raise ProtocolError("Request frame without a command")
+    data = message.get("data", "")
+    config = message.get("config", {})
+    config_json = config if isinstance(config, str) else json.dumps(config or {}, ensure_ascii=False)
+    return request_id, command, data, config_json
@@ -0,0 +1,145 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Whitespace-insensitive form of a prompt, so template indentation changes still hit"""
+    return WHITESPACE.sub(" ", prompt).strip()
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of finished generations
+
+    Entries are JSON files named by the SHA-256 of the model fingerprint,
+    the sampling parameters and the normalized prompt, so any change to
+    one of them is a different key. Files are written to a temporary name
+    and moved into place with os.replace, which makes the directory safe
+    to share between worker processes: a reader sees either no entry or a
+    complete one. Reads refresh the file's mtime, and when the directory
+    grows past max_bytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, directory, fingerprint, max_bytes=256 * 1024 * 1024, ttl_seconds=86400):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+
+    def key(self, prompt, params):
+        digest = hashlib.sha256()
+        digest.update(self.fingerprint.encode("utf-8"))
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        digest.update(normalize_prompt(prompt).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Cached entry dict, or None on a miss or an expired entry"""
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        if self.ttl_seconds and time.time() - entry.get("created", 0) > self.ttl_seconds:
+            self.remove(path)
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, response, usage=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"created": time.time(), "response": response, "usage": usage or {}}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"❌ Response cache write error: {str(e)}", file=sys.stderr)
+            self.remove(tmp_path)
+            return
+        with self.lock:
+            self.stores += 1
+            self.total_bytes += os.path.getsize(path)
+            over_budget = self.total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def entries(self):
+        """(path, size, mtime) for every entry file; other processes may delete them meanwhile"""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                found.append((path, info.st_size, info.st_mtime))
+        return found
+
+    def evict(self):
+        """Delete least recently used entries until the directory is under 90% of max_bytes"""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            if self.remove(path):
+                removed += 1
+            total -= size
+        with self.lock:
+            self.total_bytes = total
+            self.evictions += removed
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
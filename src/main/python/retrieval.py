@@ -0,0 +1,230 @@
+import sys
+import threading
+import traceback
+from collections import deque
+
+import numpy as np
+
+
+def chunk_text(text, words=120, overlap=30):
+    """Split text into passages of about words words, each sharing overlap words with the previous one"""
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    return [" ".join(tokens[start:start + words]) for start in range(0, max(1, len(tokens) - overlap), step)]
+
+
+def unit_vector(embedding):
+    """float32 unit vector from an embedding; per-token embeddings are mean-pooled first"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    if vector.ndim > 1:
+        vector = vector.mean(axis=0)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class VectorIndex:
+    """One session's passage embeddings as the rows of a float32 matrix
+
+    Rows are unit length, so a single matrix-vector product gives the cosine
+    similarity of every passage to the query, and argpartition picks the top
+    k without sorting the rest. The matrix doubles when full, so adding a
+    passage is amortized O(1).
+    """
+
+    def __init__(self, dim, capacity=64):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.texts = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, vector, text):
+        count = len(self.texts)
+        if count == self.vectors.shape[0]:
+            grown = np.empty((count * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:count] = self.vectors
+            self.vectors = grown
+        self.vectors[count] = vector
+        self.texts.append(text)
+
+    def search(self, query, k):
+        """Row numbers and scores of the k passages closest to a unit query vector, best first"""
+        count = len(self.texts)
+        scores = self.vectors[:count] @ query
+        if count > k:
+            top = np.argpartition(scores, count - k)[count - k:]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(scores[top])[::-1]]
+        return top, scores[top]
+
+    def nbytes(self):
+        return self.vectors.nbytes
+
+
+class RetrievalMemory:
+    """Earlier story passages per session, recalled by embedding similarity
+
+    Each finished segment is chunked into overlapping passages that a
+    daemon thread embeds while no user request is running, in a separate
+    embedding-mode context (a small embedding GGUF or the story model
+    itself). A continuation embeds the user's input and recalls the most
+    similar passages of its session, which keeps plot points from early
+    chapters within reach long after they left the recent events. The query
+    waits at most query_wait seconds for a passage being embedded and
+    otherwise goes without recall, so indexing never stalls a request.
+    """
+
+    def __init__(self, generator, load_embedder, top_k=3, chunk_words=120, chunk_overlap=30,
+                 idle_seconds=0.5, query_wait=0.05):
+        self.generator = generator
+        self.load_embedder = load_embedder
+        self.top_k = top_k
+        self.chunk_words = chunk_words
+        self.chunk_overlap = chunk_overlap
+        self.idle_seconds = idle_seconds
+        self.query_wait = query_wait
+        self.indexes = {}
+        self.pending = deque()
+        self.embedder = None
+        self.load_error = None
+        self.embedded = 0
+        self.recalls = 0
+        self.failures = 0
+        self.skipped = 0
+        # Bumped by every discard, so a passage embedded across one is checked again before it is stored
+        self.discards = 0
+        self.condition = threading.Condition()
+        # A llama context is not thread-safe; indexing and queries take turns
+        self.embed_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="retrieval", daemon=True)
+        self.thread.start()
+
+    def embed(self, text, timeout=-1):
+        """Unit embedding of text, or None if the context stayed busy for timeout seconds"""
+        if not self.embed_lock.acquire(timeout=timeout):
+            return None
+        try:
+            if self.embedder is None:
+                if self.load_error:
+                    raise RuntimeError(self.load_error)
+                try:
+                    self.embedder = self.load_embedder()
+                except Exception as e:
+                    self.load_error = f"Embedding model unavailable: {str(e)}"
+                    raise
+                print("🔎 Embedding model loaded", file=sys.stderr)
+            with self.generator.metrics.timer("embed_seconds", "Time to embed one passage or query"):
+                return unit_vector(self.embedder.embed(text, truncate=True))
+        finally:
+            self.embed_lock.release()
+
+    def index(self, memory, text):
+        """Queue a finished segment's passages for embedding"""
+        if self.load_error:
+            return
+        chunks = chunk_text(text, self.chunk_words, self.chunk_overlap)
+        with self.condition:
+            self.pending.extend((memory, chunk) for chunk in chunks)
+            self.condition.notify()
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            # Embedding competes with generation for the same cores
+            self.generator.wait_for_idle(self.idle_seconds)
+            with self.condition:
+                if not self.pending:
+                    continue
+                memory, chunk = self.pending.popleft()
+            if not self.generator.sessions.is_current(memory):
+                continue
+            try:
+                vector = self.embed(chunk)
+            except Exception as e:
+                self.failures += 1
+                print(f"❌ Embedding error [{memory.session_id}]: {str(e)}", file=sys.stderr)
+                if self.load_error:
+                    traceback.print_exc(file=sys.stderr)
+                    self.discard()
+                continue
+            self.store(memory, vector, chunk)
+
+    def store(self, memory, vector, chunk):
+        """Add an embedded passage to its session's index, unless the session was cleared meanwhile"""
+        while True:
+            with self.condition:
+                discards = self.discards
+            # Asked outside the condition: eviction holds the session store's lock when it calls discard
+            if not self.generator.sessions.is_current(memory):
+                return
+            with self.condition:
+                if self.discards != discards:
+                    continue
+                index = self.indexes.get(memory.session_id)
+                if index is None:
+                    index = self.indexes[memory.session_id] = VectorIndex(len(vector))
+                index.add(vector, chunk)
+                self.embedded += 1
+                return
+
+    def recall(self, session_id, query, k=None):
+        """Passages most similar to query, in story order; empty until something is indexed"""
+        with self.condition:
+            index = self.indexes.get(session_id)
+            if index is None or not len(index) or not query.strip():
+                return []
+        try:
+            vector = self.embed(query, timeout=self.query_wait)
+        except Exception as e:
+            print(f"❌ Recall error [{session_id}]: {str(e)}", file=sys.stderr)
+            return []
+        if vector is None:
+            with self.condition:
+                self.skipped += 1
+            print(f"⏭️  Recall skipped [{session_id}]: embedder busy", file=sys.stderr)
+            return []
+        with self.condition:
+            with self.generator.metrics.timer("retrieval_search_seconds", "Top-k passage search"):
+                rows, scores = index.search(vector, k or self.top_k)
+            passages = [(int(row), index.texts[row]) for row in rows]
+            self.recalls += 1
+        print(f"🧠 Recalled {len(passages)} passages [{session_id}] "
+              f"(best score {float(scores[0]):.3f})", file=sys.stderr)
+        return [text for _, text in sorted(passages)]
+
+    def discard(self, session_id=None):
+        """Forget one session's passages, or every session's"""
+        with self.condition:
+            self.discards += 1
+            if session_id is None:
+                self.indexes.clear()
+                self.pending.clear()
+                return
+            self.indexes.pop(session_id, None)
+            self.pending = deque(item for item in self.pending if item[0].session_id != session_id)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "sessions": len(self.indexes),
+                "passages": sum(len(index) for index in self.indexes.values()),
+                "matrix_bytes": sum(index.nbytes() for index in self.indexes.values()),
+                "pending": len(self.pending),
+                "embedded": self.embedded,
+                "recalls": self.recalls,
+                "failures": self.failures,
+                "skipped": self.skipped,
+            }
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -0,0 +1,233 @@
+import sys
+import time
+import asyncio
+import itertools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from protocol import ProtocolError, read_frame, parse_request
+
+# Commands that never touch the model run immediately instead of queueing
+CONTROL_COMMANDS = {"CANCEL", "CLEAR_MEMORY", "STATUS", "STATS", "LOGS"}
+
+# Lower runs first; requests may override with a "priority" field
+DEFAULT_PRIORITIES = {
+    "CHOOSE": 1,
+    "CONTINUE": 1,
+    "ALTERNATIVES": 2,
+    "GENERATE": 2,
+}
+DEFAULT_PRIORITY = 3
+
+
+class ScheduledRequest:
+    """A framed request waiting for, or holding, the model"""
+
+    def __init__(self, request_id, command, data, config_json, priority, deadline=None, writer=None):
+        self.request_id = request_id
+        # Frames go back to the client that sent the request; ids are only unique per client
+        self.writer = writer
+        self.key = (id(writer), request_id)
+        self.command = command
+        self.data = data
+        self.config_json = config_json
+        self.priority = priority
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.cancel_event = threading.Event()
+        self.started = False
+        self.answered = False
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def should_stop(self):
+        return self.cancel_event.is_set() or self.expired()
+
+    def stop_reason(self):
+        if self.cancel_event.is_set():
+            return "cancelled"
+        if self.expired():
+            return "deadline"
+        return None
+
+
+class RequestScheduler:
+    """Asyncio front end for StoryGenerator.process_command
+
+    Model-bound commands go through a bounded priority queue and run on
+    max_concurrent model threads: one for a single llama context, or one per
+    sequence slot when the generator batches sessions together. Control
+    commands bypass the queue so they are never stuck behind a long GENERATE.
+    A CANCEL sets the target's stop flag, which the model's stopping criterion
+    polls after every token. Requests may come from several clients, each
+    answered through the writer its requests were submitted with.
+    """
+
+    def __init__(self, generator, writer, max_queue=32, max_concurrent=1):
+        self.generator = generator
+        self.writer = writer
+        self.queue = asyncio.PriorityQueue(maxsize=max_queue)
+        self.sequence = itertools.count()
+        self.requests = {}
+        self.max_concurrent = max(1, max_concurrent)
+        self.model_executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="model")
+        self.control_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="control")
+
+    def build_request(self, message, writer):
+        request_id, command, data, config_json = parse_request(message)
+        base_command = command[:-len("_STREAM")] if command.endswith("_STREAM") else command
+        priority = message.get("priority")
+        # Coerced here so a bad value is rejected before it reaches the heap, where it would not compare
+        priority = DEFAULT_PRIORITIES.get(base_command, DEFAULT_PRIORITY) if priority is None else int(priority)
+        deadline = None
+        if message.get("timeout_ms"):
+            deadline = time.monotonic() + float(message["timeout_ms"]) / 1000.0
+        return ScheduledRequest(request_id, command, data, config_json, priority, deadline, writer)
+
+    async def submit(self, message, writer=None):
+        """Route one incoming frame: run it now, queue it, or reject it"""
+        writer = writer or self.writer
+        try:
+            request = self.build_request(message, writer)
+        except (ProtocolError, TypeError, ValueError) as e:
+            writer.send(message.get("id"), "error", error=f"Invalid request: {str(e)}")
+            return
+
+        if request.command == "CANCEL":
+            self.cancel(request.request_id, message.get("target", request.data), writer)
+            return
+
+        if request.command in CONTROL_COMMANDS:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(self.control_executor, self.execute, request)
+            return
+
+        if request.request_id is not None and request.key in self.requests:
+            writer.send(request.request_id, "error", error="Duplicate request id")
+            return
+
+        try:
+            self.queue.put_nowait((request.priority, next(self.sequence), request))
+        except asyncio.QueueFull:
+            writer.send(request.request_id, "error", error="Queue full, retry later")
+            return
+        self.requests[request.key] = request
+        print(f"📬 Queued {request.command} {request.request_id} (priority {request.priority}, "
+              f"{self.queue.qsize()} waiting)", file=sys.stderr)
+
+    def cancel(self, request_id, target_id, writer):
+        """Stop a queued request now, or a running one at its next token"""
+        target = self.requests.get((id(writer), target_id))
+        if target is None or target.answered:
+            writer.send(request_id, "response", result=f"Request not found: {target_id}")
+            return
+        target.cancel_event.set()
+        print(f"🛑 Cancel requested for {target_id}", file=sys.stderr)
+        if not target.started:
+            self.answer_stopped(target, "")
+        writer.send(request_id, "response", result=f"Cancel requested: {target_id}")
+
+    def cancel_client(self, writer):
+        """Stop every request of a client that disconnected, so nobody waits on unread output"""
+        for request in list(self.requests.values()):
+            if request.writer is writer and not request.answered:
+                request.cancel_event.set()
+                if not request.started:
+                    # Still queued: the worker skips it without answering
+                    request.answered = True
+
+    async def run_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, request = await self.queue.get()
+            try:
+                if request.answered:
+                    continue
+                if request.should_stop():
+                    # Expired while queued: answer without touching the model
+                    self.answer_stopped(request, "")
+                    continue
+                request.started = True
+                wait = time.monotonic() - request.enqueued_at
+                self.generator.metrics.observe("queue_wait_seconds", wait, "Time spent queued before the model")
+                print(f"▶️  Running {request.command} {request.request_id} after {wait:.2f}s in queue",
+                      file=sys.stderr)
+                await loop.run_in_executor(self.model_executor, self.execute, request)
+            finally:
+                self.requests.pop(request.key, None)
+                self.queue.task_done()
+
+    def execute(self, request):
+        """Run one request on an executor thread and send its final frame"""
+        try:
+            streaming = request.command.endswith("_STREAM")
+            frames_sent = []
+
+            def emit(kind, payload):
+                frames_sent.append(kind)
+                if kind == "end" and request.stop_reason():
+                    payload = dict(payload, stopped=request.stop_reason())
+                request.writer.send(request.request_id, kind, **payload)
+
+            start_time = time.perf_counter()
+            result = self.generator.process_command(
+                request.command, request.data, request.config_json,
+                emit=emit if streaming else None,
+                should_stop=request.should_stop
+            )
+            self.generator.metrics.observe("request_seconds", time.perf_counter() - start_time,
+                                           "End-to-end command time")
+
+            if request.stop_reason():
+                if not streaming or "end" not in frames_sent:
+                    self.answer_stopped(request, result)
+            elif not streaming:
+                request.writer.send(request.request_id, "response", result=result)
+            elif "end" not in frames_sent:
+                request.writer.send(request.request_id, "end", error=result)
+            request.answered = True
+
+        except Exception as e:
+            error_msg = f"❌ Error handling frame {request.request_id}: {str(e)}"
+            print(error_msg, file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            request.writer.send(request.request_id, "error", error=error_msg)
+
+    def answer_stopped(self, request, partial):
+        reason = request.stop_reason()
+        print(f"🛑 {request.command} {request.request_id} stopped ({reason})", file=sys.stderr)
+        request.writer.send(request.request_id, reason, result=partial)
+        request.answered = True
+
+    def start_workers(self):
+        return [asyncio.create_task(self.run_worker()) for _ in range(self.max_concurrent)]
+
+    def stop_workers(self, workers):
+        for worker in workers:
+            worker.cancel()
+        self.control_executor.shutdown(wait=True)
+        self.model_executor.shutdown(wait=True)
+
+    async def serve(self, stream):
+        """Read frames until the peer closes the stream, then drain the queue"""
+        loop = asyncio.get_running_loop()
+        workers = self.start_workers()
+        reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reader")
+        try:
+            while True:
+                try:
+                    message = await loop.run_in_executor(reader, read_frame, stream)
+                except (ProtocolError, ValueError) as e:
+                    print(f"❌ Protocol error: {str(e)}", file=sys.stderr)
+                    self.writer.send(None, "error", error=f"Protocol error: {str(e)}")
+                    break
+                if message is None:
+                    print("📭 Input closed (possible shutdown)", file=sys.stderr)
+                    break
+                await self.submit(message)
+            await self.queue.join()
+        finally:
+            reader.shutdown(wait=False)
+            self.stop_workers(workers)
@@ -0,0 +1,171 @@
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_SESSION_ID = "default"
+
+
+class StoryMemory:
+    """Character, event and summary memory for a single story session"""
+
+    def __init__(self, session_id=DEFAULT_SESSION_ID):
+        self.session_id = session_id
+        # Prompt profile the story was started with; None is the generator's default
+        self.profile = None
+        self.character_memory = {}
+        self.key_events = []
+        self.story_summary = ""
+        # Finished turns the background summarizer has not folded in yet
+        self.unsummarized_turns = []
+        self.last_chunk = ""
+        # Exact text already evaluated in the model context for this session
+        self.transcript = ""
+        # Passages recalled for the prompt being built; the retrieval index holds the rest
+        self.recalled = []
+        self.last_access = time.monotonic()
+        self.size_bytes = 0
+
+    @classmethod
+    def from_dict(cls, session_id, data):
+        memory = cls(session_id)
+        memory.profile = data.get("profile")
+        memory.character_memory = data.get("character_memory", {})
+        memory.key_events = data.get("key_events", [])
+        memory.story_summary = data.get("story_summary", "")
+        memory.unsummarized_turns = data.get("unsummarized_turns", [])
+        memory.last_chunk = data.get("last_chunk", "")
+        memory.transcript = data.get("transcript", "")
+        return memory
+
+    def is_empty(self):
+        return not self.character_memory and not self.key_events and not self.story_summary
+
+    def to_dict(self):
+        return {
+            "profile": self.profile,
+            "character_memory": self.character_memory,
+            "key_events": self.key_events,
+            "story_summary": self.story_summary,
+            "unsummarized_turns": self.unsummarized_turns,
+            "last_chunk": self.last_chunk,
+            "transcript": self.transcript,
+        }
+
+    def estimate_size(self):
+        """Approximate the memory footprint as the size of its JSON encoding"""
+        self.size_bytes = len(json.dumps(self.to_dict(), ensure_ascii=False).encode("utf-8"))
+        return self.size_bytes
+
+
+class SessionMemoryStore:
+    """Session-keyed StoryMemory store with LRU and TTL eviction
+
+    Lookups are O(1) through an OrderedDict kept in recency order, so the
+    least recently used session is always at the front.
+    """
+
+    def __init__(self, max_sessions=64, max_bytes=16 * 1024 * 1024, ttl_seconds=3600, on_evict=None, loader=None):
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sessions = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+        self.on_evict = on_evict
+        # loader(session_id) -> StoryMemory or None, consulted when a session is not in memory
+        self.loader = loader
+        self.lock = threading.RLock()
+
+    def get(self, session_id, load=True):
+        """Return the memory for a session, rehydrating or creating it if needed"""
+        with self.lock:
+            self.expire()
+            memory = self.sessions.get(session_id)
+            if memory is None:
+                if load and self.loader is not None:
+                    memory = self.loader(session_id)
+                if memory is None:
+                    memory = StoryMemory(session_id)
+                else:
+                    self.total_bytes += memory.estimate_size()
+                self.sessions[session_id] = memory
+                self.enforce_limits(keep=session_id)
+            else:
+                self.sessions.move_to_end(session_id)
+            memory.last_access = time.monotonic()
+            return memory
+
+    def reset(self, session_id):
+        """Start a fresh memory for a session, dropping any previous one"""
+        with self.lock:
+            self.discard(session_id)
+            return self.get(session_id, load=False)
+
+    def discard(self, session_id):
+        with self.lock:
+            memory = self.sessions.pop(session_id, None)
+            if memory is not None:
+                self.total_bytes -= memory.size_bytes
+            return memory is not None
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+            self.total_bytes = 0
+
+    def is_current(self, memory):
+        """False once the session was reset, cleared or evicted"""
+        with self.lock:
+            return self.sessions.get(memory.session_id) is memory
+
+    def update_size(self, memory):
+        """Re-measure a session after it changed and evict others if over budget"""
+        with self.lock:
+            if self.sessions.get(memory.session_id) is not memory:
+                return
+            previous = memory.size_bytes
+            self.total_bytes += memory.estimate_size() - previous
+            self.enforce_limits(keep=memory.session_id)
+
+    def expire(self):
+        """Drop sessions idle for longer than the TTL"""
+        if not self.ttl_seconds:
+            return
+        deadline = time.monotonic() - self.ttl_seconds
+        while self.sessions:
+            session_id, memory = next(iter(self.sessions.items()))
+            if memory.last_access >= deadline:
+                break
+            self.evict(session_id, "expired")
+
+    def enforce_limits(self, keep=None):
+        while len(self.sessions) > self.max_sessions or (
+            self.max_bytes and self.total_bytes > self.max_bytes and len(self.sessions) > 1
+        ):
+            session_id = next(iter(self.sessions))
+            if session_id == keep:
+                # Never evict the session being served; rotate it to the back
+                self.sessions.move_to_end(session_id)
+                if len(self.sessions) == 1:
+                    break
+                session_id = next(iter(self.sessions))
+            self.evict(session_id, "evicted")
+
+    def evict(self, session_id, reason):
+        self.discard(session_id)
+        self.evictions += 1
+        if self.on_evict:
+            self.on_evict(session_id)
+        print(f"🗑️  Session {session_id} {reason}", file=sys.stderr)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "bytes": self.total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
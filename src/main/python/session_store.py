@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def default_path():
+    return os.path.join(os.path.expanduser("~"), ".cache", "story_generator", "sessions.db")
+
+
+class SessionStore:
+    """Durable per-session memory in SQLite, so stories survive process restarts
+
+    The database runs in WAL mode: each turn is one small upsert that does
+    not block readers, and pool workers can share the file. Only the compact
+    memory is stored; the transcript is left out because the KV state it
+    pairs with does not survive a restart anyway.
+    """
+
+    def __init__(self, path, ttl_seconds=7 * 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.saves = 0
+        self.loads = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL only syncs at checkpoints, so a save costs no fsync
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+        self.prune()
+
+    def save(self, memory):
+        data = memory.to_dict()
+        data.pop("transcript", None)
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (memory.session_id, payload, time.time())
+            )
+            self.connection.commit()
+            self.saves += 1
+
+    def load(self, session_id):
+        """Stored memory dict for a session, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data, updated_at = row
+        if self.ttl_seconds and time.time() - updated_at > self.ttl_seconds:
+            self.delete(session_id)
+            return None
+        try:
+            memory = json.loads(data)
+        except ValueError as e:
+            print(f"❌ Stored session {session_id} unreadable: {str(e)}", file=sys.stderr)
+            return None
+        with self.lock:
+            self.loads += 1
+        return memory
+
+    def delete(self, session_id=None):
+        """Remove one session, or every session when session_id is None"""
+        with self.lock:
+            if session_id is None:
+                self.connection.execute("DELETE FROM sessions")
+            else:
+                self.connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self.connection.commit()
+
+    def prune(self):
+        if not self.ttl_seconds:
+            return
+        with self.lock:
+            cursor = self.connection.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self.connection.commit()
+        if cursor.rowcount:
+            print(f"🗑️  Pruned {cursor.rowcount} stored sessions older than the TTL", file=sys.stderr)
+
+    def stats(self):
+        with self.lock:
+            count = self.connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {"path": self.path, "sessions": count, "saves": self.saves, "loads": self.loads}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import socket
+import asyncio
+import itertools
+import threading
+
+from protocol import FrameWriter, ProtocolError, read_frame
+from scheduler import RequestScheduler
+from pool import TERMINAL_FRAMES
+
+
+class ClientFrameWriter(FrameWriter):
+    """FrameWriter for one socket client; a vanished client only loses its own frames
+
+    The first failed write calls on_close(writer), so the client's requests
+    stop at their next token instead of generating for nobody.
+    """
+
+    def __init__(self, stream, on_close=None):
+        super().__init__(stream)
+        self.closed = False
+        self.on_close = on_close
+
+    def write(self, message):
+        if self.closed:
+            return
+        try:
+            super().write(message)
+        except (OSError, ValueError):
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.on_close is not None:
+            self.on_close(self)
+
+
+class LineClientWriter(ClientFrameWriter):
+    """Renders scheduler frames in the legacy line protocol: text or STREAM_* lines, then END_RESPONSE"""
+
+    def __init__(self, stream, on_close=None):
+        super().__init__(stream, on_close)
+        self.done = threading.Event()
+
+    def write(self, message):
+        kind = message.pop("type")
+        if self.closed:
+            # Nobody reads the frame, but serve_lines still waits for the request to finish
+            if kind in TERMINAL_FRAMES:
+                self.done.set()
+            return
+        message.pop("id", None)
+        if kind in ("chunk", "end"):
+            text = f"STREAM_{kind.upper()}|{json.dumps(message, ensure_ascii=False)}\n"
+        else:
+            text = f"{message.get('result', message.get('error', ''))}\n"
+        if kind in TERMINAL_FRAMES:
+            text += "END_RESPONSE\n"
+        try:
+            with self.lock:
+                self.stream.write(text.encode("utf-8"))
+                self.stream.flush()
+        except (OSError, ValueError):
+            self.close()
+        if kind in TERMINAL_FRAMES:
+            self.done.set()
+
+
+class SocketServer:
+    """Serve StoryGenerator to many clients over a Unix domain socket
+
+    The model stays loaded for the life of this process, so clients (a
+    redeployed Spring Boot app, a devtools reload) connect and disconnect
+    without paying for a model load. All clients share one RequestScheduler
+    and so one priority queue and model concurrency. Each connection speaks
+    either the framed protocol or the legacy line protocol, told apart by its
+    first byte: a frame starts with its length header, a line with a command
+    name. Connections beyond max_clients are refused with an error, and
+    a client that disconnects has its outstanding requests cancelled.
+    """
+
+    def __init__(self, generator, path, max_clients=16, max_queue=32):
+        self.generator = generator
+        self.path = path
+        self.max_clients = max_clients
+        self.scheduler = RequestScheduler(
+            generator, None, max_queue=max_queue, max_concurrent=generator.model_concurrency()
+        )
+        self.clients = 0
+        self.connections = 0
+        self.refused = 0
+        self.client_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.listener = None
+        self.loop = None
+        generator.metrics.collect(lambda: {"socket_server": self.stats()})
+
+    def listen(self):
+        """Bind the socket, replacing a stale socket file left by a crashed server"""
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise RuntimeError(f"Another server is already listening on {self.path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        # Only the owning user may talk to the model
+        os.chmod(self.path, 0o600)
+        listener.listen(self.max_clients)
+        return listener
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        workers = self.scheduler.start_workers()
+        self.listener = self.listen()
+        accept_thread = threading.Thread(target=self.accept_loop, name="socket-accept", daemon=True)
+        accept_thread.start()
+        print(f"🔌 Listening on {self.path} (max {self.max_clients} clients)", file=sys.stderr)
+        try:
+            # Runs until the process is interrupted
+            await asyncio.Event().wait()
+        finally:
+            self.listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.scheduler.stop_workers(workers)
+
+    def accept_loop(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            with self.lock:
+                full = self.clients >= self.max_clients
+                if full:
+                    self.refused += 1
+                else:
+                    self.clients += 1
+                    self.connections += 1
+            if full:
+                print(f"⚠️  Connection refused: {self.max_clients} clients connected", file=sys.stderr)
+                self.refuse(connection)
+                continue
+            client_id = next(self.client_ids)
+            threading.Thread(
+                target=self.handle_client, args=(connection, client_id), name=f"client-{client_id}", daemon=True
+            ).start()
+
+    def refuse(self, connection):
+        try:
+            ClientFrameWriter(connection.makefile("wb")).send(None, "error", error="Too many connections")
+        finally:
+            connection.close()
+
+    def handle_client(self, connection, client_id):
+        reader = connection.makefile("rb")
+        stream = connection.makefile("wb")
+        print(f"🔌 Client {client_id} connected", file=sys.stderr)
+        writer = None
+        try:
+            first = reader.peek(1)[:1]
+            if first and first[0] >= 0x20:
+                writer = LineClientWriter(stream, self.client_gone)
+                self.serve_lines(reader, writer)
+            elif first:
+                writer = ClientFrameWriter(stream, self.client_gone)
+                self.serve_frames(reader, writer)
+        except (OSError, ValueError) as e:
+            print(f"❌ Client {client_id} error: {str(e)}", file=sys.stderr)
+        finally:
+            if writer is not None:
+                writer.close()
+            for stream_end in (reader, stream, connection):
+                try:
+                    stream_end.close()
+                except OSError:
+                    pass
+            with self.lock:
+                self.clients -= 1
+            print(f"🔌 Client {client_id} disconnected", file=sys.stderr)
+
+    def client_gone(self, writer):
+        """Cancel a client's requests from any thread, once its socket is closed or broken"""
+        asyncio.run_coroutine_threadsafe(self.disconnect(writer), self.loop)
+
+    async def disconnect(self, writer):
+        self.scheduler.cancel_client(writer)
+
+    def submit(self, message, writer):
+        asyncio.run_coroutine_threadsafe(self.scheduler.submit(message, writer), self.loop).result()
+
+    def serve_frames(self, reader, writer):
+        while True:
+            try:
+                message = read_frame(reader)
+            except (ProtocolError, ValueError) as e:
+                writer.send(None, "error", error=f"Protocol error: {str(e)}")
+                return
+            if message is None:
+                return
+            self.submit(message, writer)
+
+    def serve_lines(self, reader, writer):
+        """One COMMAND|DATA|CONFIG line at a time, answered before the next is read"""
+        for request_id in itertools.count(1):
+            line = reader.readline().decode("utf-8").strip()
+            if not line or line == "EXIT":
+                return
+            parts = line.split("|", 2)
+            if len(parts) < 2:
+                writer.send(None, "error", error="ERROR: Invalid command format. Expected: COMMAND|DATA|CONFIG")
+                continue
+            writer.done.clear()
+            self.submit({
+                "id": request_id,
+                "command": parts[0],
+                "data": parts[1],
+                "config": parts[2] if len(parts) > 2 else "{}",
+            }, writer)
+            writer.done.wait()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "path": self.path,
+                "clients": self.clients,
+                "max_clients": self.max_clients,
+                "connections": self.connections,
+                "refused": self.refused,
+            }
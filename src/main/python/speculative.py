@@ -0,0 +1,62 @@
+import sys
+
+import numpy as np
+import llama_cpp
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+SPECULATIVE_MODES = ("off", "lookup", "draft")
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Greedy drafts from a small GGUF that shares the main model's vocabulary
+
+    The draft context keeps the longest prefix it has already evaluated, so
+    each call only evaluates the tokens accepted since the previous call.
+    """
+
+    def __init__(self, model_path, num_pred_tokens=8, n_ctx=8192, n_threads=None, n_gpu_layers=0):
+        self.llm = Llama(
+            model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=n_gpu_layers,
+            verbose=False, use_mmap=True
+        )
+        self.num_pred_tokens = num_pred_tokens
+        self.n_vocab = self.llm.n_vocab()
+        self.eos = self.llm.token_eos()
+
+    def next_token(self):
+        logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.llm._ctx.ctx, -1), shape=(self.n_vocab,))
+        return int(np.argmax(logits))
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = input_ids.tolist()
+        if len(tokens) + self.num_pred_tokens >= self.llm.n_ctx():
+            return np.array([], dtype=np.intc)
+        evaluated = self.llm.input_ids.tolist()
+        keep = 0
+        for old, new in zip(evaluated, tokens):
+            if old != new:
+                break
+            keep += 1
+        # Re-evaluate at least the last token so its logits are fresh; eval() drops the stale KV cells
+        self.llm.n_tokens = min(keep, len(tokens) - 1)
+        self.llm.eval(tokens[self.llm.n_tokens:])
+
+        drafts = []
+        for _ in range(self.num_pred_tokens):
+            token = self.next_token()
+            if token == self.eos:
+                break
+            drafts.append(token)
+            self.llm.eval([token])
+        return np.array(drafts, dtype=np.intc)
+
+
+def build_drafters(draft_model_path=None, num_pred_tokens=8, n_ctx=8192, n_threads=None):
+    """Drafter per mode; draft falls back to prompt lookup without a draft GGUF"""
+    lookup = LlamaPromptLookupDecoding(max_ngram_size=3, num_pred_tokens=num_pred_tokens)
+    drafters = {"lookup": lookup, "draft": lookup}
+    if draft_model_path:
+        print(f"⏳ Loading draft model: {draft_model_path}", file=sys.stderr)
+        drafters["draft"] = GGUFDraftModel(draft_model_path, num_pred_tokens, n_ctx=n_ctx, n_threads=n_threads)
+    return drafters
@@ -0,0 +1,164 @@
+import os
+import sys
+import glob
+import atexit
+import shutil
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def state_size(state):
+    """Bytes held by a LlamaState snapshot (KV cache plus logits)"""
+    size = getattr(state, "llama_state_size", 0) or 0
+    scores = getattr(state, "scores", None)
+    if scores is not None and hasattr(scores, "nbytes"):
+        size += scores.nbytes
+    return size
+
+
+class SessionStateCache:
+    """Two-tier cache of evaluated llama.cpp state per story session
+
+    Snapshots live in RAM in LRU order up to ``ram_bytes``. When the RAM tier
+    is full the least recently used snapshot is pickled to ``disk_dir`` instead
+    of being thrown away, and a later lookup promotes it back into RAM.
+    """
+
+    def __init__(self, ram_bytes=2 * 1024 ** 3, disk_bytes=8 * 1024 ** 3, disk_dir=None):
+        self.ram_bytes = ram_bytes
+        self.disk_bytes = disk_bytes
+        self.disk_dir = disk_dir
+        self.ram = OrderedDict()
+        self.ram_sizes = {}
+        self.ram_used = 0
+        self.disk = OrderedDict()
+        self.disk_used = 0
+        self.hits = {"ram": 0, "disk": 0}
+        self.misses = 0
+        self.lock = threading.RLock()
+        if self.disk_bytes:
+            if self.disk_dir:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                # Snapshots from a previous process are unindexed, so reclaim the space
+                for path in glob.glob(os.path.join(self.disk_dir, "*.state")):
+                    os.remove(path)
+            else:
+                self.disk_dir = tempfile.mkdtemp(prefix="story_state_")
+                atexit.register(shutil.rmtree, self.disk_dir, True)
+
+    def disk_path(self, session_id):
+        digest = hashlib.sha1(str(session_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.state")
+
+    def has(self, session_id):
+        with self.lock:
+            return session_id in self.ram or session_id in self.disk
+
+    def get(self, session_id):
+        """Return the snapshot for a session, promoting it from disk if needed"""
+        with self.lock:
+            state = self.ram.get(session_id)
+            if state is not None:
+                self.ram.move_to_end(session_id)
+                self.hits["ram"] += 1
+                return state
+
+            if session_id in self.disk:
+                path = self.disk_path(session_id)
+                try:
+                    with open(path, "rb") as f:
+                        state = pickle.load(f)
+                except Exception as e:
+                    print(f"❌ State cache read error [{session_id}]: {str(e)}", file=sys.stderr)
+                    state = None
+                self.drop_from_disk(session_id)
+                if state is not None:
+                    self.hits["disk"] += 1
+                    self.put(session_id, state)
+                    return state
+
+            self.misses += 1
+            return None
+
+    def put(self, session_id, state):
+        with self.lock:
+            self.discard(session_id)
+            size = state_size(state)
+            if size > self.ram_bytes:
+                self.spill(session_id, state, size)
+                return
+            self.ram[session_id] = state
+            self.ram_sizes[session_id] = size
+            self.ram_used += size
+            self.evict_ram(keep=1)
+
+    def evict_ram(self, keep=0):
+        """Spill least recently used snapshots until the RAM tier fits its budget"""
+        while self.ram_used > self.ram_bytes and len(self.ram) > keep:
+            old_id, old_state = self.ram.popitem(last=False)
+            old_size = self.ram_sizes.pop(old_id, 0)
+            self.ram_used -= old_size
+            self.spill(old_id, old_state, old_size)
+
+    def resize(self, ram_bytes):
+        """Change the RAM tier's budget; snapshots over it move to disk"""
+        with self.lock:
+            self.ram_bytes = ram_bytes
+            self.evict_ram()
+
+    def spill(self, session_id, state, size):
+        """Write a snapshot evicted from RAM to the disk tier"""
+        if not self.disk_bytes or size > self.disk_bytes:
+            return
+        path = self.disk_path(session_id)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"❌ State cache spill error [{session_id}]: {str(e)}", file=sys.stderr)
+            return
+        self.disk[session_id] = size
+        self.disk_used += size
+        while self.disk_used > self.disk_bytes and self.disk:
+            self.drop_from_disk(next(iter(self.disk)))
+        print(f"💾 KV state spilled to disk [{session_id}] ({size / (1024 * 1024):.1f} MB)", file=sys.stderr)
+
+    def drop_from_disk(self, session_id):
+        size = self.disk.pop(session_id, None)
+        if size is None:
+            return
+        self.disk_used -= size
+        try:
+            os.remove(self.disk_path(session_id))
+        except OSError:
+            pass
+
+    def discard(self, session_id):
+        with self.lock:
+            if session_id in self.ram:
+                del self.ram[session_id]
+                self.ram_used -= self.ram_sizes.pop(session_id, 0)
+            self.drop_from_disk(session_id)
+
+    def clear(self):
+        with self.lock:
+            for session_id in list(self.ram):
+                self.discard(session_id)
+            for session_id in list(self.disk):
+                self.drop_from_disk(session_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "ram_entries": len(self.ram),
+                "ram_bytes": self.ram_used,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_used,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+            }
@@ -1,22 +1,65 @@
 #!/usr/bin/env python3
 import sys
 import json
-import re
 import os
+import asyncio
+import argparse
 import traceback
-from llama_cpp import Llama
 import time
+import mmap
+import threading
+import contextlib
+
+# Timed so the startup breakdown can show what importing llama.cpp costs
+_import_start = time.perf_counter()
+import llama_cpp
+from llama_cpp import Llama, StoppingCriteriaList
+LLAMA_IMPORT_SECONDS = time.perf_counter() - _import_start
+
+from session_memory import SessionMemoryStore, StoryMemory, DEFAULT_SESSION_ID
+from session_store import SessionStore, default_path as default_session_db
+from state_cache import SessionStateCache
+from protocol import FrameWriter
+from scheduler import RequestScheduler
+from pool import WorkerPool
+from socket_server import SocketServer
+from batch_engine import ContinuousBatchEngine
+from autotune import autotune, model_settings, model_fingerprint, DEFAULT_SETTINGS
+from profiles import build_registry
+from model_registry import build_model_registry, resident_set_bytes, DEFAULT_MODEL
+from memory_pressure import MemoryPressureMonitor, PRESSURE_LEVELS
+from summarizer import BackgroundSummarizer
+from retrieval import RetrievalMemory
+from prompt_builder import PromptBuilder
+from prefix_cache import build_prefix_cache
+from response_cache import ResponseCache
+from speculative import build_drafters, SPECULATIVE_MODES
+from metrics import MetricsRegistry, TOKEN_BUCKETS, RATE_BUCKETS
+import structured_log
+
+MODEL_PATH = os.environ.get(
+    "STORY_MODEL_PATH",
+    "C:/Users/Ben/AppData/Local/Programs/Microsoft VS Code/downloaded_models/models--bartowski--gemma-2-2b-it-abliterated-GGUF/snapshots/11124c8787de96de70c3d5cb8d5d49c420ebcdf8/gemma-2-2b-it-abliterated-Q8_0.gguf"
+)
+
+# Fixed sampling seed: identical first-chapter requests produce identical text
+MODEL_SEED = 42
+
+# Commands process_command answers; each gets its own counter, anything else counts as unknown
+COMMANDS = ("GENERATE", "CONTINUE", "ALTERNATIVES", "CHOOSE", "CLEAR_MEMORY", "STATUS", "STATS", "LOGS")
 
 class StorySetting:
     def __init__(self, firstCharacter="Character 1", secondCharacter="Character 2", 
                  background="", genre="EROTIC", perspective="third person", 
-                 situation="an exciting adventure begins"):
+                 situation="an exciting adventure begins", current_story=""):
         self.firstCharacter = firstCharacter
         self.secondCharacter = secondCharacter
         self.background = background
         self.genre = genre
         self.perspective = perspective
         self.situation = situation
+        # Story so far as the client sees it; only the v1 profile quotes it
+        self.current_story = current_story
 
     def __str__(self):
         return (
@@ -29,10 +72,11 @@ class StorySetting:
         )
 
 class StoryGenerator:
-    def __init__(self):
+    def __init__(self, background_load=False, model_path=None, llm_factory=Llama):
         try:
-            # Setup paths
-            self.model_path = "C:/Users/Ben/AppData/Local/Programs/Microsoft VS Code/downloaded_models/models--bartowski--gemma-2-2b-it-abliterated-GGUF/snapshots/11124c8787de96de70c3d5cb8d5d49c420ebcdf8/gemma-2-2b-it-abliterated-Q8_0.gguf"
+            # Setup paths; llm_factory lets benchmarks swap in a stand-in backend
+            self.model_path = model_path or MODEL_PATH
+            self.llm_factory = llm_factory
             
             print(f"📍 Model path: {self.model_path}", file=sys.stderr)
             print(f"📁 Exists: {os.path.exists(self.model_path)}", file=sys.stderr)
@@ -44,13 +88,96 @@ class StoryGenerator:
             print(f"✅ Model verified: {os.path.getsize(self.model_path) / (1024*1024*1024):.2f} GB", file=sys.stderr)
             
             self.llm = None
-            self.initialize_model()
+            self.batch_engine = None
+            self.prefix_cache = None
+            self.response_cache = None
+            self.model_ready = threading.Event()
+            self.load_error = None
+            self.timings = {"import_seconds": round(LLAMA_IMPORT_SECONDS, 3)}
+            # Per-phase timings and token counts, read back by the STATS command
+            self.metrics = MetricsRegistry()
+            self.metrics.collect(self.component_stats)
+            self.batch_sequences = int(os.environ.get("STORY_BATCH_SEQUENCES", 1))
+            # Speculative decoding runs in the batch engine, created on first use when not batching
+            self.speculative_default = self.speculative_mode(os.environ.get("STORY_SPECULATIVE", "off"))
+            self.drafters = None
+            self.engine_lock = threading.Lock()
+            
+            # Evaluated KV state per session, so continuations only prefill the new turn
+            self.state_cache = SessionStateCache(
+                ram_bytes=int(os.environ.get("STORY_STATE_CACHE_RAM", 2 * 1024 ** 3)),
+                disk_bytes=int(os.environ.get("STORY_STATE_CACHE_DISK", 8 * 1024 ** 3)),
+                disk_dir=os.environ.get("STORY_STATE_CACHE_DIR")
+            )
+            self.resident_session = None
+            # Candidate continuations per session, waiting for CHOOSE to pick one
+            self.alternatives = {}
+            self.max_alternatives = int(os.environ.get("STORY_MAX_ALTERNATIVES", 5))
+            # Usage of the latest generation, per thread since batched requests overlap
+            self.local = threading.local()
+            
+            # Durable copy of every session's memory so a restarted process can pick stories up again
+            self.session_store = None
+            session_db = os.environ.get("STORY_SESSION_DB", default_session_db())
+            if session_db and session_db != "off":
+                self.session_store = SessionStore(
+                    session_db, ttl_seconds=int(os.environ.get("STORY_SESSION_DB_TTL", 7 * 86400))
+                )
+                print(f"💽 Session store: {session_db}", file=sys.stderr)
+            
+            # Enhanced memory system for better context, one per story session
+            self.sessions = SessionMemoryStore(
+                max_sessions=int(os.environ.get("STORY_MAX_SESSIONS", 64)),
+                max_bytes=int(os.environ.get("STORY_MAX_SESSION_BYTES", 16 * 1024 * 1024)),
+                ttl_seconds=int(os.environ.get("STORY_SESSION_TTL", 3600)),
+                on_evict=self.forget_session_state,
+                loader=self.load_session if self.session_store is not None else None
+            )
+            # Prompt and memory policies (v2, censored, v1), all served by the one loaded model
+            self.profiles = build_registry()
+            # Further GGUFs (say a Q4_K_M beside the Q8_0) loaded when a request names one
+            self.models = build_model_registry(self.load_model)
+            # Optional cap below n_ctx - max_tokens, to bound prefill time
+            self.max_prompt_tokens = int(os.environ.get("STORY_MAX_PROMPT_TOKENS", 0))
+            
+            # Foreground generations hold model_lock; background work waits for them to finish
+            self.model_lock = threading.Lock()
+            self.activity = threading.Condition()
+            self.foreground_requests = 0
+            self.last_foreground = time.monotonic()
+            self.summarizer = None
+            if os.environ.get("STORY_SUMMARIZER", "1") != "0":
+                self.summarizer = BackgroundSummarizer(
+                    self,
+                    max_tokens=int(os.environ.get("STORY_SUMMARY_TOKENS", 220)),
+                    idle_seconds=float(os.environ.get("STORY_SUMMARY_IDLE_SECONDS", 0.5))
+                )
+            # Opt-in: earlier passages recalled by embedding similarity, once they are out of the recent events
+            self.retrieval = None
+            if os.environ.get("STORY_RETRIEVAL", "0") == "1":
+                self.retrieval = RetrievalMemory(
+                    self, self.load_embedder,
+                    top_k=int(os.environ.get("STORY_RETRIEVAL_TOP_K", 3)),
+                    chunk_words=int(os.environ.get("STORY_RETRIEVAL_CHUNK_WORDS", 120)),
+                    query_wait=float(os.environ.get("STORY_RETRIEVAL_WAIT_MS", 50)) / 1000
+                )
+            
+            # Under memory pressure, give up cache hits, context and length before the box swaps
+            self.pressure = None
+            self.pressure_model = os.environ.get("STORY_PRESSURE_MODEL")
+            self.pressure_prompt_tokens = int(os.environ.get("STORY_PRESSURE_PROMPT_TOKENS", 4096))
+            self.pressure_max_tokens = int(os.environ.get("STORY_PRESSURE_MAX_TOKENS", 256))
+            self.pressure_cache_fraction = float(os.environ.get("STORY_PRESSURE_CACHE_FRACTION", 0.25))
+            # Full-size cache budgets, saved as each cache is built; the monitor starts once the model is loaded
+            self.cache_budgets = {"state": self.state_cache.ram_bytes}
             
-            # Enhanced memory system for better context
-            self.character_memory = {}
-            self.key_events = []
-            self.story_summary = ""
-            self.last_chunk = ""
+            if background_load:
+                # The command channel opens now; model commands wait for model_ready
+                loader = threading.Thread(target=self.load_in_background, name="model-loader", daemon=True)
+                loader.start()
+                print("⏳ Status: loading - model warming up in background", file=sys.stderr)
+            else:
+                self.initialize_model()
             
             # Signal that Java expects
             print("✅ READY - StoryGenerator initialized!", file=sys.stderr)
@@ -60,29 +187,94 @@ class StoryGenerator:
             traceback.print_exc(file=sys.stderr)
             sys.exit(1)
         
+    def load_in_background(self):
+        """Loader thread body: a failed load is reported to waiting commands instead of exiting"""
+        try:
+            self.initialize_model()
+        except SystemExit:
+            self.load_error = "Model loading failed"
+            print("❌ Status: failed - model could not be loaded", file=sys.stderr)
+        finally:
+            self.model_ready.set()
+    
+    def wait_until_ready(self):
+        """Block a model command until the background load finishes"""
+        if not self.model_ready.is_set():
+            print("⏳ Waiting for model to finish loading...", file=sys.stderr)
+            self.model_ready.wait()
+        if self.load_error:
+            raise RuntimeError(self.load_error)
+    
+    def status(self):
+        if not self.model_ready.is_set():
+            state = "loading"
+        elif self.load_error:
+            state = "failed"
+        else:
+            state = "ready"
+        status = {"status": state, "timings": self.timings, "profiles": self.profiles.names(),
+                  "models": self.models.names()}
+        status.update(self.component_stats())
+        if isinstance(sys.stderr, structured_log.StructuredLog):
+            status["log"] = sys.stderr.stats()
+        return status
+    
+    def component_stats(self):
+        """Stats of every enabled cache and background component"""
+        stats = {"state_cache": self.state_cache.stats(), "model_registry": self.models.stats()}
+        if self.summarizer is not None:
+            stats["summarizer"] = self.summarizer.stats()
+        if self.retrieval is not None:
+            stats["retrieval"] = self.retrieval.stats()
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.stats()
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.stats()
+        if self.batch_engine is not None:
+            stats["batch_engine"] = self.batch_engine.stats()
+        if self.session_store is not None:
+            stats["session_store"] = self.session_store.stats()
+        if self.pressure is not None:
+            stats["memory_pressure"] = self.pressure.stats()
+        return stats
+    
+    def stats(self, fmt="json"):
+        """STATS payload: the metrics snapshot as JSON, or Prometheus text"""
+        if fmt.strip().lower() == "prometheus":
+            return self.metrics.prometheus()
+        return json.dumps(self.metrics.snapshot())
+    
+    def prefetch_model_file(self):
+        """Map the GGUF and ask the OS to start reading it ahead of the load"""
+        with open(self.model_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+                    mapped.madvise(mmap.MADV_WILLNEED)
+    
     def initialize_model(self):
         """Set up the AI model with optimal story generation settings"""
         try:
             print("⏳ Loading Gemma 2B model...", file=sys.stderr)
             
             start_time = time.time()
+            self.prefetch_model_file()
+            self.timings["mmap_seconds"] = round(time.time() - start_time, 3)
             
-            # Configuration optimized for story generation
-            self.llm = Llama(
-                model_path=self.model_path,
-                n_ctx=16384,        # Large context window for stories
-                n_gpu_layers=99,  
-                n_batch=512,       
-                n_threads=8,       
-                verbose=False,
-                seed=42,
-                use_mmap=True,      # Enable memory mapping for large models
-                use_mlock=False     # Disable memory locking for flexibility
-            )
+            # Tuned per-machine profile from --autotune, if one exists for this model file
+            self.settings = model_settings(self.model_path)
+            
+            rss_before = resident_set_bytes()
+            start_time = time.time()
+            self.llm = self.load_model(self.model_path, self.settings)
             
             load_time = time.time() - start_time
+            self.timings["load_seconds"] = round(load_time, 3)
+            self.models.adopt(DEFAULT_MODEL, self.model_path, self.llm, round(load_time, 3),
+                              max(os.path.getsize(self.model_path), resident_set_bytes() - rss_before))
             print(f"✅ Model loaded in {load_time:.1f} seconds", file=sys.stderr)
             
+            start_time = time.time()
+            
             # Quick test to verify model works
             test_response = self.llm(
                 "Once upon a time", 
@@ -92,256 +284,821 @@ class StoryGenerator:
             )
             
             test_text = test_response['choices'][0]['text'].strip()
+            self.timings["warmup_seconds"] = round(time.time() - start_time, 3)
             print(f"✅ Test passed: '{test_text}'", file=sys.stderr)
             
+            # Prompts sharing a preamble (same genre and perspective) reuse its evaluated state
+            self.prefix_cache = build_prefix_cache(
+                os.environ.get("STORY_PREFIX_CACHE", "ram"),
+                int(os.environ.get("STORY_PREFIX_CACHE_BYTES", 1024 ** 3)),
+                cache_dir=os.environ.get("STORY_PREFIX_CACHE_DIR"),
+                min_prefix_tokens=int(os.environ.get("STORY_PREFIX_MIN_TOKENS", 32))
+            )
+            if self.prefix_cache is not None:
+                self.llm.set_cache(self.prefix_cache)
+                if hasattr(self.prefix_cache, "resize"):
+                    self.cache_budgets["prefix"] = self.prefix_cache.capacity_bytes
+            
+            # Optional on-disk cache of deterministic GENERATE responses, shareable by workers
+            response_cache_dir = os.environ.get("STORY_RESPONSE_CACHE_DIR")
+            if response_cache_dir:
+                self.response_cache = ResponseCache(
+                    response_cache_dir, model_fingerprint(self.model_path),
+                    max_bytes=int(os.environ.get("STORY_RESPONSE_CACHE_BYTES", 256 * 1024 * 1024)),
+                    ttl_seconds=int(os.environ.get("STORY_RESPONSE_CACHE_TTL", 86400))
+                )
+                print(f"💾 Response cache: {response_cache_dir}", file=sys.stderr)
+            
+            # Optional continuous batching: several sessions decoded together in one context
+            if self.batch_sequences > 1 or self.speculative_default != "off":
+                self.ensure_batch_engine()
+            
+            self.start_pressure_monitor()
+            self.model_ready.set()
+            # Machine-readable line so cold-start regressions can be tracked
+            print(f"STARTUP_TIMING {json.dumps(self.timings)}", file=sys.stderr)
+            
         except Exception as e:
             print(f"❌ Model loading error: {str(e)}", file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
             
             if "CUDA" in str(e) or "GPU" in str(e):
-                print("💡 Try n_gpu_layers=0 for CPU-only", file=sys.stderr)
+                print("💡 Try STORY_N_GPU_LAYERS=0 for CPU-only", file=sys.stderr)
             elif "memory" in str(e).lower():
-                print("💡 Try reducing n_ctx to 8192 if memory issues", file=sys.stderr)
+                print("💡 Try STORY_N_CTX=8192 or run --autotune if memory issues", file=sys.stderr)
                 
             sys.exit(1)
     
-    def generate_text(self, prompt, max_tokens=400, temperature=0.8):
-        """Generate text using the model with story-optimized settings"""
+    def load_model(self, model_path, settings=None):
+        """Create a Llama for a GGUF with its tuned settings; also the model registry's loader"""
+        settings = settings or model_settings(model_path)
+        # Configuration optimized for story generation
+        return self.llm_factory(
+            model_path=model_path,
+            n_ctx=settings["n_ctx"],        # Large context window for stories
+            n_gpu_layers=settings["n_gpu_layers"],
+            n_batch=settings["n_batch"],
+            n_threads=settings["n_threads"],
+            verbose=False,
+            seed=MODEL_SEED,
+            use_mmap=True,      # Enable memory mapping for large models
+            use_mlock=False     # Disable memory locking for flexibility
+        )
+    
+    def load_embedder(self):
+        """Embedding-mode context on STORY_EMBEDDING_MODEL_PATH, else on the story model itself"""
+        model_path = os.environ.get("STORY_EMBEDDING_MODEL_PATH")
+        n_ctx = int(os.environ.get("STORY_EMBEDDING_CTX", 256))
+        return self.llm_factory(
+            model_path=model_path or self.model_path,
+            embedding=True,
+            n_ctx=n_ctx,
+            n_batch=n_ctx,
+            n_ubatch=n_ctx,
+            # On the CPU by default, so a second context never takes VRAM from the story model
+            n_gpu_layers=int(os.environ.get("STORY_EMBEDDING_GPU_LAYERS", 0)),
+            n_threads=self.settings["n_threads"],
+            # A chat model has no pooling of its own; embedding GGUFs declare theirs
+            pooling_type=(llama_cpp.LLAMA_POOLING_TYPE_UNSPECIFIED if model_path
+                          else llama_cpp.LLAMA_POOLING_TYPE_MEAN),
+            verbose=False,
+            use_mmap=True
+        )
+    
+    @property
+    def llm(self):
+        """The model serving this thread's request: a registry model while one is entered, else the main model"""
+        return getattr(self.local, "llm", None) or self.main_llm
+    
+    @llm.setter
+    def llm(self, value):
+        self.main_llm = value
+    
+    def enter_model(self, name):
+        """Serve this thread's request from the named registry model until leave_model()"""
+        if not name and self.under_pressure("small_model"):
+            # The main model's mapped weights are clean pages the kernel can reclaim once unused
+            name = self.pressure_model
+        model = self.models.acquire(name)
+        self.local.model = model
+        if not model.pinned:
+            self.local.llm = model.llm
+    
+    def leave_model(self):
+        model = getattr(self.local, "model", None)
+        if model is not None:
+            self.local.model = None
+            self.local.llm = None
+            self.models.release(model)
+    
+    def serving_main_model(self):
+        """False while this thread's request runs on a registry model other than the main one"""
+        return getattr(self.local, "llm", None) is None
+    
+    def model_name(self):
+        model = getattr(self.local, "model", None)
+        return model.name if model is not None else DEFAULT_MODEL
+    
+    def model_cache(self):
+        """Prefix cache of the model in use; only the main model has one"""
+        return self.prefix_cache if self.serving_main_model() else None
+    
+    def under_pressure(self, level):
+        return self.pressure is not None and self.pressure.at_least(level)
+    
+    def start_pressure_monitor(self):
+        """Start sampling memory once the model and its caches exist (STORY_MEMORY_CHECK_SECONDS=0: never)"""
+        check_seconds = float(os.environ.get("STORY_MEMORY_CHECK_SECONDS", 2.0))
+        if check_seconds <= 0 or self.pressure is not None:
+            return
+        self.pressure = MemoryPressureMonitor(
+            self.apply_pressure,
+            rss_limit=int(os.environ.get("STORY_MEMORY_RSS_LIMIT", 0)),
+            min_available=int(os.environ.get("STORY_MEMORY_MIN_AVAILABLE", 1024 ** 3)),
+            interval=check_seconds,
+            hold_seconds=float(os.environ.get("STORY_MEMORY_HOLD_SECONDS", 30.0)),
+            # Switching quantization needs a smaller model to switch to
+            max_level=len(PRESSURE_LEVELS) - (1 if self.pressure_model else 2)
+        )
+    
+    def apply_pressure(self, old, new):
+        """Resize the caches for a new memory pressure level; the later steps are read per request"""
+        shrink = new >= PRESSURE_LEVELS.index("shrink_caches")
+        if shrink == (old >= PRESSURE_LEVELS.index("shrink_caches")):
+            return
+        # Always scaled from the full-size budgets, never from a cache's current, possibly shrunk, size
+        fraction = self.pressure_cache_fraction if shrink else 1.0
+        self.state_cache.resize(int(self.cache_budgets["state"] * fraction))
+        if "prefix" in self.cache_budgets:
+            # Llama reads the prefix cache while it holds the model
+            with self.model_lock:
+                self.prefix_cache.resize(int(self.cache_budgets["prefix"] * fraction))
+        if shrink:
+            self.models.evict_idle(keep=self.pressure_model)
+    
+    def token_limit(self, max_tokens):
+        """max_tokens, capped while memory pressure is at cap_tokens or above"""
+        if self.under_pressure("cap_tokens"):
+            return min(max_tokens, self.pressure_max_tokens)
+        return max_tokens
+    
+    def sampling_options(self, max_tokens, temperature, should_stop=None):
+        """Story-optimized sampling settings shared by every generation path"""
+        options = {
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.9,
+            "top_k": 40,           # Add top_k sampling for better diversity
+            "repeat_penalty": 1.2,
+            "stop": ["<end_of_turn>", "<eos>", "###", "\n\n\n", "END_OF_STORY", "The end"],
+            "echo": False
+        }
+        if should_stop is not None:
+            # Checked after every decoded token, so a cancel takes effect immediately
+            options["stopping_criteria"] = StoppingCriteriaList([lambda input_ids, logits: should_stop()])
+        return options
+    
+    def ensure_batch_engine(self):
+        """Create the batch engine (and speculative drafters) on first use"""
+        with self.engine_lock:
+            if self.batch_engine is None:
+                self.batch_engine = ContinuousBatchEngine(
+                    self.llm,
+                    max_sequences=max(1, self.batch_sequences),
+                    n_ctx=int(os.environ.get("STORY_BATCH_CTX", self.settings["n_ctx"])),
+                    n_batch=self.settings["n_batch"],
+                    n_threads=self.settings["n_threads"],
+                    seed=MODEL_SEED
+                )
+            if self.drafters is None:
+                self.drafters = build_drafters(
+                    os.environ.get("STORY_DRAFT_MODEL_PATH"),
+                    num_pred_tokens=int(os.environ.get("STORY_DRAFT_TOKENS", 8)),
+                    n_ctx=self.batch_engine.n_ctx,
+                    n_threads=self.settings["n_threads"]
+                )
+            return self.batch_engine
+    
+    def batching(self):
+        """True when every generation goes through the batch engine"""
+        return self.batch_engine is not None and self.batch_sequences > 1
+    
+    def uses_batch_engine(self, speculative=None):
+        """True when a generation with this speculative setting goes through the batch engine"""
+        mode = self.speculative_default if speculative is None else self.speculative_mode(speculative)
+        # The batch engine and session KV states are built on the main model
+        return self.serving_main_model() and (mode != "off" or self.batching())
+    
+    def speculative_mode(self, value):
+        """Normalize a speculative setting: true means prompt lookup, false or None means off"""
+        if value is None or value is False:
+            return "off"
+        if value is True:
+            return "lookup"
+        mode = str(value).lower()
+        if mode not in SPECULATIVE_MODES:
+            print(f"⚠️  Unknown speculative mode '{value}', decoding normally", file=sys.stderr)
+            return "off"
+        return mode
+    
+    def generate_text(self, prompt, max_tokens=400, temperature=0.8, session_id=None, on_chunk=None,
+                      should_stop=None, speculative=None):
+        """Generate text using the model with story-optimized settings
+        
+        With on_chunk the model streams and on_chunk(text) is called for every
+        decoded piece as soon as it is available. should_stop() is polled after
+        each token and ends the generation early when it returns True.
+        speculative ("lookup" or "draft") drafts tokens from the context or a
+        small GGUF and verifies them in one batch on the batch engine, which
+        samples from the same distribution as llama.cpp but not the same
+        random stream; None uses STORY_SPECULATIVE.
+        """
         try:
             print(f"📝 Generating story text with {max_tokens} tokens...", file=sys.stderr)
             
-            response = self.llm(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=0.9,
-                top_k=40,           # Add top_k sampling for better diversity
-                repeat_penalty=1.2,
-                stop=["<end_of_turn>", "<eos>", "###", "\n\n\n", "END_OF_STORY", "The end"],
-                echo=False
-            )
+            start_time = time.time()
+            mode = self.speculative_default if speculative is None else self.speculative_mode(speculative)
+            if self.uses_batch_engine(speculative):
+                drafter = None
+                if mode != "off":
+                    self.ensure_batch_engine()
+                    drafter = self.drafters[mode]
+                with self.foreground_turn(exclusive=False):
+                    result = self.generate_text_batched(prompt, max_tokens, temperature, on_chunk, start_time,
+                                                        should_stop, drafter)
+            else:
+                with self.foreground_turn(exclusive=True):
+                    if session_id is not None and self.serving_main_model():
+                        self.activate_session(session_id)
+                    perf_before = self.model_perf()
+                    if on_chunk is not None:
+                        result = self.generate_text_stream(prompt, max_tokens, temperature, on_chunk, start_time,
+                                                           should_stop)
+                    else:
+                        result = self.generate_text_blocking(prompt, max_tokens, temperature, start_time,
+                                                             should_stop)
+                    self.add_eval_timings(self.local.last_usage, perf_before)
             
-            result = response["choices"][0]["text"].strip()
-            print(f"✅ Story segment generated ({len(result)} chars)", file=sys.stderr)
+            self.record_usage(self.local.last_usage)
             return result
             
         except Exception as e:
+            self.metrics.inc("generation_errors_total", help_text="Generations that raised")
             error_msg = f"❌ Generation error: {str(e)}"
             print(error_msg, file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
             return error_msg
     
-    def create_story_prompt(self, config, user_input, is_continuation=False):
-        """Create the prompt for generation with enhanced context"""
+    def generate_text_cached(self, prompt, max_tokens, session_id=None, on_chunk=None, should_stop=None,
+                             use_cache=True, speculative=None):
+        """generate_text through the response cache, for requests whose output depends only on the prompt"""
+        if self.response_cache is None or not use_cache:
+            return self.generate_text(prompt, max_tokens=max_tokens, session_id=session_id, on_chunk=on_chunk,
+                                      should_stop=should_stop, speculative=speculative)
+        
+        start_time = time.time()
+        temperature = 0.8
+        options = self.sampling_options(max_tokens, temperature)
+        options["seed"] = MODEL_SEED
+        # The batch engine draws from the same distribution as llama.cpp with its own random stream,
+        # so the same seed gives different text
+        options["backend"] = "batch" if self.uses_batch_engine(speculative) else "llama"
+        if not self.serving_main_model():
+            options["model"] = self.model_name()
+        key = self.response_cache.key(prompt, options)
+        
+        entry = self.response_cache.get(key)
+        if entry is not None:
+            response = entry["response"]
+            print(f"💾 Response cache hit ({len(response)} chars)", file=sys.stderr)
+            if on_chunk is not None and response:
+                on_chunk(response)
+            usage = entry.get("usage", {})
+            self.local.last_usage = self.build_usage(
+                usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), start_time, time.time()
+            )
+            self.local.last_usage["cached"] = True
+            self.metrics.inc("response_cache_hits_total", help_text="Requests answered from the response cache")
+            return response
+        
+        response = self.generate_text(prompt, max_tokens=max_tokens, temperature=temperature, session_id=session_id,
+                                      on_chunk=on_chunk, should_stop=should_stop, speculative=speculative)
+        # A cancelled or timed-out generation is cut short, so it must not be replayed
+        stopped = should_stop is not None and should_stop()
+        if self.llm_ok(response) and not stopped:
+            self.response_cache.put(key, response, self.last_usage())
+        return response
+    
+    def generate_alternatives(self, prompt, count, max_tokens=500, temperature=0.8, session_id=None,
+                              should_stop=None, seed=MODEL_SEED):
+        """Sample count continuations of one prompt, evaluating the prompt once
+        
+        Every branch runs in the same context with its own seed. Llama keeps
+        the longest evaluated prefix, so after the first branch the prompt is
+        already in the KV cache and each later branch only re-evaluates its
+        last token before decoding: one prefill plus count decodes.
+        """
+        start_time = time.time()
+        branches = []
+        prompt_tokens = 0
+        with self.foreground_turn(exclusive=True):
+            if session_id is not None and self.serving_main_model():
+                self.activate_session(session_id)
+            perf_before = self.model_perf()
+            options = self.sampling_options(max_tokens, temperature, should_stop)
+            try:
+                for index in range(count):
+                    branch_start = time.time()
+                    response = self.llm(prompt, seed=seed + index, **options)
+                    if index == 0:
+                        # Caching every branch's final state would copy the whole KV cache once per branch
+                        self.llm.set_cache(None)
+                    choice = response["choices"][0]
+                    usage = response.get("usage", {})
+                    prompt_tokens = usage.get("prompt_tokens", prompt_tokens)
+                    branches.append({
+                        "index": index,
+                        "seed": seed + index,
+                        "text": choice["text"].strip(),
+                        "completion_tokens": usage.get("completion_tokens", 0),
+                        "finish_reason": choice.get("finish_reason"),
+                        "elapsed_seconds": round(time.time() - branch_start, 3),
+                    })
+                    if should_stop is not None and should_stop():
+                        break
+            finally:
+                self.llm.set_cache(self.model_cache())
+                # Llama keeps a per-call seed for later calls; every other path samples with MODEL_SEED
+                self.llm.set_seed(MODEL_SEED)
+            self.local.last_usage = self.build_usage(
+                prompt_tokens, sum(branch["completion_tokens"] for branch in branches), start_time, None
+            )
+            self.add_eval_timings(self.local.last_usage, perf_before)
+        self.local.last_usage["branches"] = len(branches)
+        self.record_usage(self.local.last_usage)
+        print(f"🔀 {len(branches)} alternatives from one prefill of {prompt_tokens} tokens", file=sys.stderr)
+        return branches
+    
+    def generate_text_blocking(self, prompt, max_tokens, temperature, start_time, should_stop=None):
+        """Generate in one call and return the whole text"""
+        response = self.llm(prompt, **self.sampling_options(max_tokens, temperature, should_stop))
+        result = response["choices"][0]["text"].strip()
+        usage = response.get("usage", {})
+        self.local.last_usage = self.build_usage(
+            usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), start_time, None
+        )
+        print(f"✅ Story segment generated ({len(result)} chars)", file=sys.stderr)
+        return result
+    
+    def generate_text_stream(self, prompt, max_tokens, temperature, on_chunk, start_time, should_stop=None):
+        """Stream a generation, forwarding each decoded chunk to on_chunk"""
+        with self.metrics.timer("tokenize_seconds"):
+            prompt_tokens = len(self.llm.tokenize(prompt.encode("utf-8"), special=True))
+        pieces = []
+        completion_tokens = 0
+        first_token_time = None
+        
+        for chunk in self.llm(prompt, stream=True, **self.sampling_options(max_tokens, temperature, should_stop)):
+            text = chunk["choices"][0]["text"]
+            if not text:
+                continue
+            completion_tokens += 1
+            if not pieces:
+                # Match the stripped output of the blocking path
+                text = text.lstrip()
+                if not text:
+                    continue
+                first_token_time = time.time()
+            pieces.append(text)
+            on_chunk(text)
+        
+        result = "".join(pieces).strip()
+        self.local.last_usage = self.build_usage(prompt_tokens, completion_tokens, start_time, first_token_time)
+        print(f"✅ Story segment streamed ({len(result)} chars)", file=sys.stderr)
+        return result
+    
+    def generate_text_batched(self, prompt, max_tokens, temperature, on_chunk, start_time, should_stop=None,
+                              drafter=None):
+        """Run the generation as one sequence of the continuous batch engine"""
+        options = self.sampling_options(max_tokens, temperature)
+        started = False
+        
+        def forward_chunk(text):
+            nonlocal started
+            # Match the stripped output of the blocking path
+            if not started:
+                text = text.lstrip()
+                if not text:
+                    return
+                started = True
+            on_chunk(text)
+        
+        sequence = self.batch_engine.generate(
+            prompt, max_tokens, options,
+            on_chunk=forward_chunk if on_chunk is not None else None,
+            should_stop=should_stop,
+            drafter=drafter
+        )
+        result = sequence.text.strip()
+        self.local.last_usage = self.build_usage(
+            len(sequence.prompt_tokens), len(sequence.tokens), start_time, sequence.first_token_at
+        )
+        if drafter is not None:
+            self.local.last_usage["speculative"] = {
+                "drafted": sequence.drafted,
+                "accepted": sequence.accepted,
+                "acceptance_rate": sequence.acceptance_rate(),
+            }
+            print(f"🎯 Speculative: {sequence.accepted}/{sequence.drafted} drafts accepted", file=sys.stderr)
+        print(f"✅ Story segment generated in batch ({len(result)} chars)", file=sys.stderr)
+        return result
+    
+    @contextlib.contextmanager
+    def foreground_turn(self, exclusive):
+        """Mark a user generation as running so background work yields to it"""
+        with self.activity:
+            self.foreground_requests += 1
         try:
+            if exclusive:
+                with self.model_lock:
+                    yield
+            else:
+                yield
+        finally:
+            with self.activity:
+                self.foreground_requests -= 1
+                self.last_foreground = time.monotonic()
+                self.activity.notify_all()
+    
+    def wait_for_idle(self, idle_seconds):
+        """Block until no user generation has run for idle_seconds"""
+        self.model_ready.wait()
+        with self.activity:
+            while True:
+                idle_for = time.monotonic() - self.last_foreground
+                if self.foreground_requests == 0 and idle_for >= idle_seconds:
+                    return
+                self.activity.wait(None if self.foreground_requests else idle_seconds - idle_for)
+    
+    def generate_background(self, prompt, max_tokens, temperature):
+        """Low-priority generation that stops as soon as a user request wants the model
+        
+        Returns (text, finished); finished is False when it was preempted.
+        """
+        self.wait_until_ready()
+        preempted = False
+        
+        def should_stop():
+            nonlocal preempted
+            preempted = preempted or self.foreground_requests > 0
+            return preempted
+        
+        options = self.sampling_options(max_tokens, temperature, should_stop)
+        if self.batching():
+            # Runs as one more sequence, so it never blocks the active stories
+            options.pop("stopping_criteria")
+            sequence = self.batch_engine.generate(prompt, max_tokens, options, should_stop=should_stop)
+            return sequence.text.strip(), not preempted
+        
+        with self.model_lock:
+            if should_stop():
+                return "", False
+            # Park the resident session's KV state so its next turn still skips prefill
+            if self.resident_session is not None:
+                self.state_cache.put(self.resident_session, self.llm.save_state())
+                self.resident_session = None
+            # One-off summary prompts would only push story preambles out of the prefix cache
+            self.llm.set_cache(None)
+            try:
+                response = self.llm(prompt, **options)
+            finally:
+                self.llm.set_cache(self.prefix_cache)
+        return response["choices"][0]["text"].strip(), not preempted
+    
+    def last_usage(self):
+        return getattr(self.local, "last_usage", {})
+    
+    def model_concurrency(self):
+        """How many model-bound requests may run at the same time"""
+        return max(1, self.batch_sequences)
+    
+    def build_usage(self, prompt_tokens, completion_tokens, start_time, first_token_time):
+        elapsed = time.time() - start_time
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "elapsed_seconds": round(elapsed, 3),
+            "tokens_per_second": round(completion_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+            "model": self.model_name()
+        }
+        if first_token_time is not None:
+            usage["time_to_first_token_seconds"] = round(first_token_time - start_time, 3)
+            # Without llama.cpp's own counters, everything before the first token is prompt eval
+            usage["prompt_eval_seconds"] = usage["time_to_first_token_seconds"]
+            usage["decode_seconds"] = round(time.time() - first_token_time, 3)
+        prompt_report = self.last_prompt_report()
+        if prompt_report:
+            usage["prompt_sections"] = prompt_report["sections"]
+            usage["prompt_dropped"] = prompt_report["dropped"]
+        return usage
+    
+    def model_perf(self):
+        """llama.cpp's cumulative prompt-eval and decode counters, or None if unavailable"""
+        perf_context = getattr(llama_cpp, "llama_perf_context", None)
+        if perf_context is None or self.llm is None:
+            return None
+        try:
+            data = perf_context(self.llm._ctx.ctx)
+        except Exception:
+            return None
+        return data.t_p_eval_ms, data.t_eval_ms, data.n_p_eval, data.n_eval
+    
+    def add_eval_timings(self, usage, perf_before):
+        """Split a generation's time into prompt eval and decode with llama.cpp's counters"""
+        perf_after = self.model_perf()
+        if perf_before is None or perf_after is None:
+            return
+        usage["prompt_eval_seconds"] = round((perf_after[0] - perf_before[0]) / 1000.0, 3)
+        usage["decode_seconds"] = round((perf_after[1] - perf_before[1]) / 1000.0, 3)
+        usage["prompt_eval_tokens"] = perf_after[2] - perf_before[2]
+    
+    def record_usage(self, usage):
+        """Feed one finished generation into the metrics registry"""
+        metrics = self.metrics
+        metrics.inc("generations_total", help_text="Completed generations")
+        metrics.inc("prompt_tokens_total", usage.get("prompt_tokens", 0), "Prompt tokens submitted")
+        metrics.inc("completion_tokens_total", usage.get("completion_tokens", 0), "Tokens generated")
+        metrics.observe("generation_seconds", usage.get("elapsed_seconds", 0.0), "Wall time per generation")
+        metrics.observe("prompt_tokens", usage.get("prompt_tokens", 0), "Prompt tokens per generation",
+                        TOKEN_BUCKETS)
+        metrics.observe("completion_tokens", usage.get("completion_tokens", 0), "Completion tokens per generation",
+                        TOKEN_BUCKETS)
+        metrics.observe("tokens_per_second", usage.get("tokens_per_second", 0.0), "Decode throughput",
+                        RATE_BUCKETS)
+        if "time_to_first_token_seconds" in usage:
+            metrics.observe("time_to_first_token_seconds", usage["time_to_first_token_seconds"],
+                            "Latency until the first streamed token")
+        if "prompt_eval_seconds" in usage:
+            metrics.observe("prompt_eval_seconds", usage["prompt_eval_seconds"], "Prompt prefill time")
+            metrics.observe("decode_seconds", usage["decode_seconds"], "Token generation time")
+    
+    def activate_session(self, session_id):
+        """Swap the session's evaluated state into the model context"""
+        if self.resident_session == session_id:
+            return
+        if self.resident_session is not None:
+            self.state_cache.put(self.resident_session, self.llm.save_state())
+        state = self.state_cache.get(session_id)
+        if state is not None:
+            self.llm.load_state(state)
+            print(f"♻️  KV state restored [{session_id}] ({state.n_tokens} tokens)", file=sys.stderr)
+        self.resident_session = session_id
+    
+    def llm_ok(self, response):
+        """True unless generate_text returned its error message"""
+        return not response.startswith("❌ Generation error")
+    
+    def forget_session_state(self, session_id):
+        """Drop a session's cached KV state"""
+        self.state_cache.discard(session_id)
+        self.alternatives.pop(session_id, None)
+        if self.retrieval is not None:
+            self.retrieval.discard(session_id)
+        if self.resident_session == session_id:
+            self.resident_session = None
+    
+    def profile_for(self, memory, name=None):
+        """The request's profile, else the one the session's story was started with"""
+        return self.profiles.get(name or (memory.profile if memory is not None else None))
+    
+    def can_reuse_state(self, memory, user_input, max_tokens, speculative=None):
+        """Check that the session transcript is cached and still fits the context"""
+        # The batch engine prefills every prompt from scratch, so a raw transcript would only cost more
+        if (memory is None or not memory.transcript or self.uses_batch_engine(speculative)
+                or not self.serving_main_model()):
+            return False
+        session_id = memory.session_id
+        if self.resident_session != session_id and not self.state_cache.has(session_id):
+            return False
+        try:
+            turn_text = memory.transcript + self.create_turn_prompt(user_input, self.profile_for(memory))
+            with self.metrics.timer("tokenize_seconds"):
+                n_tokens = len(self.llm.tokenize(turn_text.encode("utf-8"), special=True))
+            limit = self.llm.n_ctx()
+            if self.under_pressure("reduce_context"):
+                # A long transcript makes every saved KV state long too
+                limit = min(limit, self.pressure_prompt_tokens + max_tokens)
+            return n_tokens + max_tokens <= limit
+        except Exception as e:
+            print(f"❌ Transcript check error: {str(e)}", file=sys.stderr)
+            return False
+    
+    def create_turn_prompt(self, user_input, profile=None):
+        """Next user turn appended to a session transcript"""
+        return (profile or self.profiles.get()).turn_prompt(user_input)
+    
+    def count_tokens(self, text):
+        """Prompt tokens for text, estimated at 4 characters per token until the model loads"""
+        if self.llm is None:
+            return len(text) // 4 + 1
+        with self.metrics.timer("tokenize_seconds"):
+            return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+    
+    def prompt_budget(self, max_tokens, profile=None):
+        """Prompt tokens that still leave room for max_tokens of output"""
+        n_ctx = self.llm.n_ctx() if self.llm is not None else DEFAULT_SETTINGS["n_ctx"]
+        if profile is not None and profile.context_tokens:
+            n_ctx = min(n_ctx, profile.context_tokens)
+        budget = n_ctx - max_tokens
+        if self.max_prompt_tokens:
+            budget = min(budget, self.max_prompt_tokens)
+        if self.under_pressure("reduce_context"):
+            budget = min(budget, self.pressure_prompt_tokens)
+        return budget
+    
+    def last_prompt_report(self):
+        return getattr(self.local, "prompt_report", {})
+    
+    def create_story_prompt(self, config, user_input, is_continuation=False, memory=None, max_tokens=500,
+                            profile=None, speculative=None):
+        """Create the prompt for generation with enhanced context
+        
+        The profile (default: the session's) supplies the templates. Memory
+        sections are fitted into the token budget, dropping the least
+        important first; per-section token counts end up in last_prompt_report().
+        """
+        try:
+            profile = profile or self.profile_for(memory)
+            if is_continuation and self.can_reuse_state(memory, user_input, max_tokens, speculative):
+                # The transcript is already evaluated, so only the new turn gets prefilled
+                turn = self.create_turn_prompt(user_input, profile)
+                self.local.prompt_report = {
+                    "sections": {"transcript": self.count_tokens(memory.transcript), "turn": self.count_tokens(turn)},
+                    "dropped": [],
+                }
+                return memory.transcript + turn
+            
+            builder = PromptBuilder(self.count_tokens, self.prompt_budget(max_tokens, profile))
             if not is_continuation:
-                return f"""<start_of_turn>system
-                    You are a skilled storyteller. Write the FIRST CHAPTER of a {config.genre} story.
-
-                    INITIAL SITUATION: {user_input}
-
-                    MAIN CHARACTERS:
-                    - {config.firstCharacter}
-                    - {config.secondCharacter}
-
-                    WRITING STYLE:
-                    - Use {config.perspective} perspective
-                    - Write in a style fitting for {config.genre}
-                    - Introduce an engaging conflict or mystery
-                    - Create vivid descriptions and natural dialogue
-                    - Length: approximately 400-500 words
-
-                    Respond only with the story text, no commentary or metadata.<end_of_turn>
-
-                    <start_of_turn>user
-                    Begin the story now<end_of_turn>
-                    <start_of_turn>model
-                    """
+                profile.add_first_chapter(builder, config, user_input)
             else:
-                # Enhanced context for continuations
-                memory_context = self.get_memory_context()
-                
-                return f"""<start_of_turn>system
-                    You are continuing a {config.genre} story. Maintain perfect consistency.
-
-                    CHARACTERS:
-                    - {config.firstCharacter}
-                    - {config.secondCharacter}
-
-                    PERSPECTIVE: {config.perspective}
-
-                    {memory_context}
-
-                    INSTRUCTIONS:
-                    - Continue naturally based on: {user_input}
-                    - Maintain perfect consistency with established characters, events, tone and last conversation
-                    - Develop the plot forward in a compelling way
-                    - Take extra attention on describing physical traits if {config.genre} is "EROTIC"
-                    - Include descriptive elements and natural dialogue
-                    - Length: 400-500 words
-                    - Respond only with the next narrative segment
-
-                    <end_of_turn>
-
-                    <start_of_turn>user
-                    {user_input}<end_of_turn>
-                    <start_of_turn>model
-                    """
+                if memory is not None:
+                    memory.recalled = self.recall_passages(memory, user_input, profile)
+                profile.add_continuation(builder, config, user_input, memory)
+            
+            prompt = builder.build()
+            self.local.prompt_report = builder.report
+            report = builder.report
+            print(f"📏 Prompt tokens: {report['total_tokens']}/{report['budget']} {report['sections']}"
+                  + (f", dropped: {report['dropped']}" if report["dropped"] else ""), file=sys.stderr)
+            if report["total_tokens"] > report["budget"]:
+                print("⚠️  Required prompt sections exceed the token budget", file=sys.stderr)
+            return prompt
         except Exception as e:
             print(f"❌ Prompt error: {str(e)}", file=sys.stderr)
             return f"Error: {str(e)}"
     
-    def update_story_memory(self, new_text):
+    def recall_passages(self, memory, user_input, profile):
+        """Earlier passages of the session most related to the user's next instruction"""
+        if self.retrieval is None or not profile.recall:
+            return []
+        return self.retrieval.recall(memory.session_id, user_input)
+    
+    def update_story_memory(self, new_text, memory):
         """Update character and event memory with enhanced tracking"""
         try:
-            # Extract character names with better pattern matching
-            characters = self.extract_characters(new_text)
-            for char in characters:
-                if char not in self.character_memory:
-                    self.character_memory[char] = {
-                        "mentions": 1, 
-                        "last_seen": new_text[:250],
-                        "traits": self.extract_character_traits(new_text, char),
-                        "cup_size": None,  # Track cup size
-                        "emotional_state": None  # Track emotional state
-                    }
+            character_memory = memory.character_memory
+            profile = self.profile_for(memory)
+            # One pass over the text for names, traits, attributes and events
+            extraction = profile.extractor.extract(new_text)
+            for char in extraction.characters:
+                if char not in character_memory:
+                    character_memory[char] = profile.new_character(new_text, extraction, char)
                 else:
-                    self.character_memory[char]["mentions"] += 1
-                    # Update traits if new ones are discovered
-                    new_traits = self.extract_character_traits(new_text, char)
-                    if new_traits:
-                        self.character_memory[char]["traits"].extend(
-                            t for t in new_traits if t not in self.character_memory[char]["traits"]
-                        )
-                    # Update cup size and emotional state if mentioned
-                    cup_size_match = re.search(r'\b([A-D]+\s*cup)\b', new_text, re.IGNORECASE)
-                    if cup_size_match:
-                        self.character_memory[char]["cup_size"] = cup_size_match.group(1)
-
-                    emotional_state_match = re.search(r'\b(aroused|excited|embarrassed|terrified|calm|nervous|desperate)\b', new_text, re.IGNORECASE)
-                    if emotional_state_match:
-                        self.character_memory[char]["emotional_state"] = emotional_state_match.group(1)
-            
-            # Extract important plot points
-            sentences = re.split(r'[.!?]+', new_text)
-            important_events = [
-                s.strip() for s in sentences 
-                if len(s.split()) > 6 and 
-                any(keyword in s.lower() for keyword in [
-                    'decided', 'began', 'found', 'discovered', 'realized',
-                    'promised', 'agreed', 'refused', 'encountered', 'met',
-                    'fought', 'traveled', 'learned', 'changed', 'revealed',
-                    'grew', 'shrunk', 'aroused', 'calmed', 'grow', 'started'  # Added relevant keywords
-                ])
-            ]
-            
-            for event in important_events[:3]:  # Keep more key events
-                if event and event not in self.key_events:
-                    self.key_events.append(event)
+                    character_memory[char]["mentions"] += 1
+                    profile.update_character(character_memory[char], extraction, char)
+            
+            for event in extraction.events:  # Keep more key events
+                if event and event not in memory.key_events:
+                    memory.key_events.append(event)
             
             # Update story summary
-            self.update_story_summary(new_text)
+            if profile.summarize:
+                self.update_story_summary(new_text, memory)
+            if profile.recall and self.retrieval is not None and new_text and self.llm_ok(new_text):
+                self.retrieval.index(memory, new_text)
+            self.sessions.update_size(memory)
+            self.persist_session(memory)
                     
-            print(f"🧠 Memory updated: {len(self.character_memory)} chars, {len(self.key_events)} events", file=sys.stderr)
+            print(profile.memory_log(memory), file=sys.stderr)
             
         except Exception as e:
             print(f"❌ Memory error: {str(e)}", file=sys.stderr)
     
     def extract_characters(self, text):
         """Extract character names with better filtering"""
-        try:
-            # Look for proper nouns that might be characters
-            words = re.findall(r'\b[A-Z][a-z]{2,}\b', text)
-            common_words = {
-                'The', 'And', 'But', 'For', 'With', 'This', 'That', 
-                'There', 'Then', 'You', 'Your', 'They', 'She', 'He', 
-                'It', 'We', 'Us', 'Our', 'Their', 'What', 'When', 'Where'
-            }
-            potential_names = [word for word in words if word not in common_words]
-            
-            # Also look for names in dialogue or descriptions
-            dialogue_pattern = r'\"([A-Z][a-z]+ [A-Z][a-z]+|[A-Z][a-z]+)\"'
-            dialogue_names = re.findall(dialogue_pattern, text)
-            
-            all_names = list(set(potential_names + dialogue_names))
-            return all_names[:5]  # Reasonable number of characters to track
-            
-        except:
-            return []
+        return self.profiles.get().extractor.characters(text)
     
     def extract_character_traits(self, text, character_name):
         """Extract character traits from text"""
-        traits = []
-        try:
-            # Look for descriptions involving the character
-            pattern = rf"{character_name} (was|is|had|has|seemed|looked|appeared) ([^.!?]+)[.!?]"
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            
-            for match in matches:
-                description = match[1].strip()
-                if len(description.split()) > 2:  # Meaningful description
-                    traits.append(description)
-                    
-        except:
-            pass
-            
-        return traits
+        return self.profiles.get().extractor.traits(text).get(character_name.lower(), [])
     
-    def update_story_summary(self, new_text):
+    def update_story_summary(self, new_text, memory):
         """Update the overall story summary"""
         try:
+            if self.summarizer is not None:
+                # The model condenses the turn in the background after the response is sent
+                if new_text and self.llm_ok(new_text):
+                    memory.unsummarized_turns.append(new_text)
+                    self.summarizer.schedule(memory)
+                return
+            
             # Keep a concise summary of the story so far
-            if len(self.story_summary) < 500:  # Keep summary manageable
-                key_points = " ".join(self.key_events[-3:]) if self.key_events else ""
-                self.story_summary = f"{self.story_summary} {key_points}".strip()[:500]
+            if len(memory.story_summary) < 500:  # Keep summary manageable
+                key_points = " ".join(memory.key_events[-3:]) if memory.key_events else ""
+                memory.story_summary = f"{memory.story_summary} {key_points}".strip()[:500]
                 
         except Exception as e:
             print(f"❌ Summary update error: {str(e)}", file=sys.stderr)
     
-    def get_memory_context(self):
+    def add_memory_sections(self, builder, memory):
+        """Add the session profile's memory sections to a prompt builder"""
+        return self.profile_for(memory).add_memory_sections(builder, memory)
+    
+    def get_memory_context(self, memory):
         """Generate comprehensive memory context for the prompt"""
         try:
-            if not self.character_memory:
-                return "CONTEXT: Beginning a new story."
-            
-            memory_text = "CHARACTER CONTEXT:\n"
-            for char, info in list(self.character_memory.items())[:4]:  # Main characters
-                memory_text += f"- {char}: mentioned {info['mentions']} times"
-                if info['traits']:
-                    memory_text += f", traits: {', '.join(info['traits'][:2])}"
-                memory_text += "\n"
-                if info['cup_size']:
-                    memory_text += f", cup size: {info['cup_size']}"
-                if info['emotional_state']:
-                    memory_text += f", emotional state: {info['emotional_state']}"
-                memory_text += "\n"
-            
-            if self.key_events:
-                memory_text += "\nRECENT PLOT DEVELOPMENTS:\n"
-                for event in self.key_events[-3:]:  # Recent key events
-                    memory_text += f"- {event}\n"
-            
-            if self.story_summary:
-                memory_text += f"\nSTORY SUMMARY: {self.story_summary}\n"
-            
-            return memory_text
-            
+            return self.add_memory_sections(PromptBuilder(self.count_tokens, 0), memory).render_all()
         except Exception as e:
             print(f"❌ Memory context error: {str(e)}", file=sys.stderr)
             return ""
     
-    def clear_memory(self):
+    def load_session(self, session_id):
+        """Rehydrate a session from the durable store the first time it reappears"""
+        try:
+            data = self.session_store.load(session_id)
+        except Exception as e:
+            print(f"❌ Session load error [{session_id}]: {str(e)}", file=sys.stderr)
+            return None
+        if data is None:
+            return None
+        memory = StoryMemory.from_dict(session_id, data)
+        if memory.unsummarized_turns and self.summarizer is not None:
+            self.summarizer.schedule(memory)
+        print(f"💽 Session restored [{session_id}]: {len(memory.character_memory)} chars, "
+              f"{len(memory.key_events)} events", file=sys.stderr)
+        return memory
+    
+    def persist_session(self, memory):
+        """Save a live session after it changed; a failed save only costs durability"""
+        if self.session_store is None or not self.sessions.is_current(memory):
+            return
+        try:
+            self.session_store.save(memory)
+        except Exception as e:
+            print(f"❌ Session save error [{memory.session_id}]: {str(e)}", file=sys.stderr)
+    
+    def clear_memory(self, session_id=None):
         """Clear memory while keeping model loaded"""
-        self.character_memory = {}
-        self.key_events = []
-        self.story_summary = ""
-        self.last_chunk = ""
-        print("🧹 Memory cleared for new story", file=sys.stderr)
-    
-    def process_command(self, command_type, data, config_json=None):
-        """Process commands from Spring Boot"""
+        if self.summarizer is not None:
+            self.summarizer.discard(session_id)
+        if self.retrieval is not None:
+            self.retrieval.discard(session_id)
+        if self.session_store is not None:
+            self.session_store.delete(session_id)
+        if session_id is None:
+            self.sessions.clear()
+            self.state_cache.clear()
+            self.alternatives.clear()
+            self.resident_session = None
+            print("🧹 Memory cleared for all sessions", file=sys.stderr)
+            return None
+        memory = self.sessions.reset(session_id)
+        self.state_cache.discard(session_id)
+        self.alternatives.pop(session_id, None)
+        print(f"🧹 Memory cleared for new story [{session_id}]", file=sys.stderr)
+        return memory
+    
+    def process_command(self, command_type, data, config_json=None, emit=None, should_stop=None):
+        """Process commands from Spring Boot
+        
+        GENERATE_STREAM and CONTINUE_STREAM behave like GENERATE and CONTINUE
+        but report progress through emit(kind, payload): one "chunk" frame per
+        decoded piece and a final "end" frame with usage stats. should_stop is
+        forwarded to generate_text so a scheduler can cancel mid-generation.
+        """
         try:
             print(f"📨 Processing: {command_type}", file=sys.stderr)
+            
+            on_chunk = None
+            if command_type.endswith("_STREAM"):
+                command_type = command_type[:-len("_STREAM")]
+                if emit is not None:
+                    on_chunk = lambda text: emit("chunk", {"text": text})
+            # Client input must not mint metric names
+            counted = command_type.lower() if command_type in COMMANDS else "unknown"
+            self.metrics.inc(f"commands_{counted}_total")
 
             # Valores por defecto
             firstCharacter = "Character 1"
@@ -350,6 +1107,14 @@ class StoryGenerator:
             genre = "EROTIC"
             perspective = "third person"
             situation = "an exciting adventure begins"
+            session_id = None
+            use_cache = True
+            speculative = None
+            alternative_count = 3
+            seed = MODEL_SEED
+            profile_name = None
+            current_story = ""
+            model_name = None
 
             if config_json and config_json != "{}":
                 try:
@@ -363,6 +1128,14 @@ class StoryGenerator:
                     genre = config.get("genre", genre)
                     perspective = config.get("perspective", perspective)
                     situation = config.get("situation", situation)
+                    session_id = config.get("sessionId", session_id)
+                    use_cache = not config.get("noCache", False)
+                    speculative = config.get("speculative", speculative)
+                    alternative_count = int(config.get("alternatives", alternative_count))
+                    seed = int(config.get("seed", seed))
+                    profile_name = config.get("profile", profile_name)
+                    current_story = config.get("current_story", current_story)
+                    model_name = config.get("model", model_name)
                     
                 except json.JSONDecodeError as e:
                     print(f"❌ JSON error: {str(e)}", file=sys.stderr)
@@ -375,29 +1148,109 @@ class StoryGenerator:
                 background=background,
                 genre=genre,
                 perspective=perspective,
-                situation=situation
+                situation=situation,
+                current_story=current_story
             )
 
+            if command_type in ("GENERATE", "CONTINUE", "ALTERNATIVES"):
+                self.wait_until_ready()
+                # Loaded on first use; released in the finally below so it can be evicted again
+                self.enter_model(model_name)
+            
             if command_type == "GENERATE":
-                # New story - clear memory first
-                self.clear_memory()
-                prompt = self.create_story_prompt(story_config, data, False)  # Pasar story_config, no config
+                # New story - clear this session's memory first
+                memory = self.clear_memory(session_id or DEFAULT_SESSION_ID)
+                memory.profile = profile_name
+                profile = self.profile_for(memory)
+                max_tokens = self.token_limit(profile.generate_tokens)
+                with self.metrics.timer("prompt_build_seconds"):
+                    prompt = self.create_story_prompt(story_config, data, False, memory,
+                                                      max_tokens)  # Pasar story_config, no config
                 print(f"📋 Generation prompt created ({len(prompt)} chars)", file=sys.stderr)
-                response = self.generate_text(prompt, max_tokens=500)
+                response = self.generate_text_cached(prompt, max_tokens, session_id=memory.session_id,
+                                                     on_chunk=on_chunk, should_stop=should_stop, use_cache=use_cache,
+                                                     speculative=speculative)
+                memory.transcript = f"{prompt}{response}<end_of_turn>\n" if self.llm_ok(response) else ""
                 # Update memory with the new story
-                self.update_story_memory(response)
+                with self.metrics.timer("memory_update_seconds"):
+                    self.update_story_memory(response, memory)
+                self.emit_end(emit, on_chunk, response)
                 return response
 
             elif command_type == "CONTINUE":
-                prompt = self.create_story_prompt(story_config, data, True)
+                memory = self.sessions.get(session_id or DEFAULT_SESSION_ID)
+                if profile_name:
+                    # A request may switch the story to another profile from here on
+                    memory.profile = profile_name
+                profile = self.profile_for(memory)
+                max_tokens = self.token_limit(profile.continue_tokens)
+                with self.metrics.timer("prompt_build_seconds"):
+                    prompt = self.create_story_prompt(story_config, data, True, memory, max_tokens,
+                                                      speculative=speculative)
                 print(f"📋 Continuation prompt created ({len(prompt)} chars)", file=sys.stderr)
-                response = self.generate_text(prompt, max_tokens=500)
-                self.update_story_memory(response) 
+                response = self.generate_text(prompt, max_tokens=max_tokens, session_id=memory.session_id,
+                                              on_chunk=on_chunk, should_stop=should_stop, speculative=speculative)
+                memory.transcript = f"{prompt}{response}<end_of_turn>\n" if self.llm_ok(response) else ""
+                with self.metrics.timer("memory_update_seconds"):
+                    self.update_story_memory(response, memory)
+                self.emit_end(emit, on_chunk, response)
                 return response
 
+            elif command_type == "ALTERNATIVES":
+                # Candidate continuations; memory only changes once CHOOSE picks one
+                memory = self.sessions.get(session_id or DEFAULT_SESSION_ID)
+                if profile_name:
+                    # A request may switch the story to another profile from here on
+                    memory.profile = profile_name
+                profile = self.profile_for(memory)
+                max_tokens = self.token_limit(profile.continue_tokens)
+                with self.metrics.timer("prompt_build_seconds"):
+                    prompt = self.create_story_prompt(story_config, data, True, memory, max_tokens)
+                count = max(1, min(alternative_count, self.max_alternatives))
+                branches = self.generate_alternatives(prompt, count, max_tokens=max_tokens,
+                                                      session_id=memory.session_id,
+                                                      should_stop=should_stop, seed=seed)
+                self.alternatives[memory.session_id] = (prompt, [branch["text"] for branch in branches])
+                response = json.dumps({"alternatives": branches, "usage": self.last_usage()}, ensure_ascii=False)
+                if on_chunk is not None:
+                    # Branches are not streamed as they decode; the whole result goes out as one chunk
+                    on_chunk(response)
+                self.emit_end(emit, on_chunk, response)
+                return response
+            
+            elif command_type == "CHOOSE":
+                # DATA is the index of the alternative to continue the story with
+                memory = self.sessions.get(session_id or DEFAULT_SESSION_ID)
+                prompt, texts = self.alternatives.get(memory.session_id, (None, []))
+                try:
+                    response = texts[int(data)]
+                except (ValueError, IndexError):
+                    error_msg = f"❌ No alternative {data} pending for session {memory.session_id}"
+                    print(error_msg, file=sys.stderr)
+                    return error_msg
+                del self.alternatives[memory.session_id]
+                memory.transcript = f"{prompt}{response}<end_of_turn>\n"
+                with self.metrics.timer("memory_update_seconds"):
+                    self.update_story_memory(response, memory)
+                return response
+            
             elif command_type == "CLEAR_MEMORY":
-                self.clear_memory()
+                # Without a session id every session is cleared, as before
+                self.clear_memory(session_id)
                 return "Memory cleared successfully"
+            
+            elif command_type == "STATUS":
+                return json.dumps(self.status())
+            
+            elif command_type == "STATS":
+                # DATA "prometheus" selects the text exposition format
+                return self.stats(data or "json")
+            
+            elif command_type == "LOGS":
+                # Latest records from the ring buffer sink (STORY_LOG=ring); DATA is how many
+                if not isinstance(sys.stderr, structured_log.StructuredLog):
+                    return "[]"
+                return "[" + ",".join(sys.stderr.tail(int(data) if data else 100)) + "]"
 
             else:
                 error_msg = f"Unknown command: {command_type}"
@@ -409,17 +1262,156 @@ class StoryGenerator:
             print(error_msg, file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
             return error_msg
+        finally:
+            self.leave_model()
+
+    def emit_end(self, emit, on_chunk, response):
+        """Close a stream with its usage stats, or the error that ended it"""
+        if on_chunk is None:
+            return
+        if self.llm_ok(response):
+            emit("end", {"usage": self.last_usage()})
+        else:
+            emit("end", {"error": response})
+
+def write_stream_frame(kind, payload):
+    """Write one streaming frame; JSON keeps newlines in the text escaped"""
+    print(f"STREAM_{kind.upper()}|{json.dumps(payload, ensure_ascii=False)}")
+    sys.stdout.flush()
+
+def run_line_loop(generator):
+    """Legacy protocol: one COMMAND|DATA|CONFIG line in, text plus END_RESPONSE out"""
+    while True:
+        try:
+            line = sys.stdin.readline().strip()
+            if not line:
+                print("📭 No input received (possible shutdown)", file=sys.stderr)
+                break
+                
+            print(f"📥 Received command: {line[:50]}...", file=sys.stderr)
+            
+            parts = line.split('|', 2)
+            if len(parts) < 2:
+                error_msg = "ERROR: Invalid command format. Expected: COMMAND|DATA|CONFIG"
+                print(error_msg, file=sys.stderr)
+                print(error_msg)
+                print("END_RESPONSE")
+                sys.stdout.flush()
+                continue
+                
+            command_type = parts[0]
+            data = parts[1] if len(parts) > 1 else ""
+            config_json = parts[2] if len(parts) > 2 else "{}"
+            
+            streaming = command_type.endswith("_STREAM")
+            frames_sent = []
+            
+            def emit(kind, payload):
+                frames_sent.append(kind)
+                write_stream_frame(kind, payload)
+            
+            start_time = time.perf_counter()
+            result = generator.process_command(command_type, data, config_json, emit=emit if streaming else None)
+            generator.metrics.observe("request_seconds", time.perf_counter() - start_time, "End-to-end command time")
+            
+            # Send response; streamed text has already gone out frame by frame
+            if not streaming:
+                print(result)
+            elif "end" not in frames_sent:
+                write_stream_frame("end", {"error": result})
+            print("END_RESPONSE")
+            sys.stdout.flush()
+            
+            print(f"✅ Response sent ({len(result)} characters)", file=sys.stderr)
+            
+        except Exception as e:
+            error_msg = f"❌ Error in main loop: {str(e)}"
+            print(error_msg, file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            print(error_msg)
+            print("END_RESPONSE")
+            sys.stdout.flush()
+
+def run_framed_loop(generator):
+    """Framed protocol: length-prefixed JSON requests, scheduled and answered by request id"""
+    writer = FrameWriter(sys.stdout.buffer)
+    scheduler = RequestScheduler(
+        generator, writer,
+        max_queue=int(os.environ.get("STORY_MAX_QUEUE", 32)),
+        max_concurrent=generator.model_concurrency()
+    )
+    asyncio.run(scheduler.serve(sys.stdin.buffer))
+
+def run_socket_server(generator, path):
+    """Serve many clients on a Unix domain socket until interrupted"""
+    server = SocketServer(
+        generator, path,
+        max_clients=int(os.environ.get("STORY_MAX_CLIENTS", 16)),
+        max_queue=int(os.environ.get("STORY_MAX_QUEUE", 32))
+    )
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print("🛑 Interrupted, closing socket", file=sys.stderr)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Story generator backend for Spring Boot")
+    parser.add_argument(
+        "--protocol", choices=["line", "framed"],
+        default=os.environ.get("STORY_PROTOCOL", "line"),
+        help="line: COMMAND|DATA|CONFIG lines; framed: length-prefixed JSON with request ids"
+    )
+    parser.add_argument(
+        "--background-load", action="store_true",
+        default=os.environ.get("STORY_BACKGROUND_LOAD", "") not in ("", "0"),
+        help="Accept commands immediately and load the model in the background"
+    )
+    parser.add_argument(
+        "--autotune", action="store_true",
+        help="Benchmark thread, batch and context settings for this machine, save the profile and exit"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("STORY_WORKERS", 1)),
+        help="Run N generator processes sharing the memory-mapped model (framed protocol only)"
+    )
+    parser.add_argument(
+        "--socket", default=os.environ.get("STORY_SOCKET"),
+        help="Listen on this Unix domain socket for many clients instead of serving stdin/stdout"
+    )
+    return parser.parse_args(argv)
 
 def main():
     try:
+        # STORY_LOG=file:PATH|fd:N|ring moves log lines off the pipe Java reads, leaving stdout to the protocol
+        structured_log.install()
+        args = parse_args()
+        
         print("=" * 50, file=sys.stderr)
         print("🚀 STARTING STORY GENERATOR", file=sys.stderr)
         print("=" * 50, file=sys.stderr)
         
         print(f"📌 Python version: {sys.version}", file=sys.stderr)
         print(f"📌 Working directory: {os.getcwd()}", file=sys.stderr)
+        print(f"📌 Protocol: {args.protocol}", file=sys.stderr)
+        
+        if args.autotune:
+            autotune(MODEL_PATH)
+            return
         
-        generator = StoryGenerator()
+        if args.workers > 1 and args.socket:
+            print("⚠️  Worker pool is not available in socket mode, serving from one process", file=sys.stderr)
+        elif args.workers > 1:
+            # The dispatcher never loads the model; each worker maps it itself
+            if args.protocol != "framed":
+                print("⚠️  Worker pool requires the framed protocol, switching to framed", file=sys.stderr)
+            worker_args = ["--background-load"] if args.background_load else []
+            pool = WorkerPool(os.path.abspath(__file__), args.workers, worker_args)
+            print("✅ READY - Waiting for commands...", file=sys.stderr)
+            sys.stderr.flush()
+            pool.serve(sys.stdin.buffer, sys.stdout.buffer)
+            return
+        
+        generator = StoryGenerator(background_load=args.background_load)
         
         # Signal that Java expects
         print("✅ READY - Waiting for commands...", file=sys.stderr)
@@ -429,44 +1421,12 @@ def main():
         sys.stdout.flush()
         
         # Main loop
-        while True:
-            try:
-                line = sys.stdin.readline().strip()
-                if not line:
-                    print("📭 No input received (possible shutdown)", file=sys.stderr)
-                    break
-                    
-                print(f"📥 Received command: {line[:50]}...", file=sys.stderr)
-                
-                parts = line.split('|', 2)
-                if len(parts) < 2:
-                    error_msg = "ERROR: Invalid command format. Expected: COMMAND|DATA|CONFIG"
-                    print(error_msg, file=sys.stderr)
-                    print(error_msg)
-                    print("END_RESPONSE")
-                    sys.stdout.flush()
-                    continue
-                    
-                command_type = parts[0]
-                data = parts[1] if len(parts) > 1 else ""
-                config_json = parts[2] if len(parts) > 2 else "{}"
-                
-                result = generator.process_command(command_type, data, config_json)
-                
-                # Send response
-                print(result)
-                print("END_RESPONSE")
-                sys.stdout.flush()
-                
-                print(f"✅ Response sent ({len(result)} characters)", file=sys.stderr)
-                
-            except Exception as e:
-                error_msg = f"❌ Error in main loop: {str(e)}"
-                print(error_msg, file=sys.stderr)
-                traceback.print_exc(file=sys.stderr)
-                print(error_msg)
-                print("END_RESPONSE")
-                sys.stdout.flush()
+        if args.socket:
+            run_socket_server(generator, args.socket)
+        elif args.protocol == "framed":
+            run_framed_loop(generator)
+        else:
+            run_line_loop(generator)
             
     except Exception as e:
         print(f"❌ Critical error in main: {str(e)}", file=sys.stderr)
@@ -476,4 +1436,4 @@ def main():
         sys.stderr.flush()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
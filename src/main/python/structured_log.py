@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+from collections import deque
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+# Per-request chatter: logged at debug, so it can be filtered out or sampled
+DEBUG_PREFIXES = ("📥", "📨", "📬", "▶️", "📋", "📏", "📝", "⚙️", "🧠", "♻️", "🎯", "💾")
+
+# Lines the Java side waits for on the merged process output; they always reach the real stderr
+PASSTHROUGH_MARKERS = ("READY", "Critical error")
+
+
+def classify(message):
+    """Log level of a line, from the emoji the generator prefixes it with"""
+    text = message.lstrip()
+    if text.startswith("❌"):
+        return "error"
+    if text.startswith("⚠️"):
+        return "warning"
+    if text.startswith(DEBUG_PREFIXES):
+        return "debug"
+    return "info"
+
+
+class RingSink:
+    """Keeps the latest records in memory for the LOGS command"""
+
+    def __init__(self, capacity=2000):
+        self.records = deque(maxlen=capacity)
+
+    def write(self, line):
+        self.records.append(line.rstrip("\n"))
+
+    def tail(self, count=100):
+        return list(self.records)[-count:]
+
+    def flush(self):
+        pass
+
+
+class StructuredLog:
+    """A stand-in for sys.stderr that turns each printed line into a JSON record
+
+    The generator keeps logging with print(..., file=sys.stderr). Every
+    complete line becomes {"ts", "level", "msg", "pid", "thread"} written to
+    the sink (a file, an inherited fd or a ring buffer), so with a sink
+    configured nothing but the READY signal is left on the stream Java reads.
+    Records below min_level are dropped and debug records are kept with
+    probability sample_rate. A traceback is folded into one error record.
+    """
+
+    def __init__(self, sink, min_level="info", sample_rate=1.0, passthrough=None):
+        self.sink = sink
+        self.min_level = LEVELS.get(min_level, LEVELS["info"])
+        self.sample_rate = sample_rate
+        self.passthrough = passthrough
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", "") + text
+        *lines, self.local.buffer = buffer.split("\n")
+        for line in lines:
+            self.add_line(line)
+        return len(text)
+
+    def add_line(self, line):
+        traceback_lines = getattr(self.local, "traceback", None)
+        if traceback_lines is not None:
+            traceback_lines.append(line)
+            # The exception line is the first unindented line after "Traceback ..."
+            if not line.startswith(" "):
+                self.local.traceback = None
+                self.emit("error", "\n".join(traceback_lines))
+            return
+        if line.startswith("Traceback (most recent call last)"):
+            self.local.traceback = [line]
+            return
+        if line.strip():
+            self.emit(classify(line), line)
+
+    def emit(self, level, message):
+        if self.passthrough is not None and any(marker in message for marker in PASSTHROUGH_MARKERS):
+            self.passthrough.write(message + "\n")
+            self.passthrough.flush()
+        if LEVELS[level] < self.min_level or (level == "debug" and random.random() >= self.sample_rate):
+            with self.lock:
+                self.dropped += 1
+            return
+        record = {
+            "ts": round(time.time(), 3),
+            "level": level,
+            "msg": message,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+        if level == "debug" and self.sample_rate < 1.0:
+            record["sample_rate"] = self.sample_rate
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.sink.write(line + "\n")
+            self.sink.flush()
+            self.written += 1
+
+    def flush(self):
+        with self.lock:
+            self.sink.flush()
+
+    def isatty(self):
+        return False
+
+    def tail(self, count=100):
+        """Latest records when logging to the ring buffer"""
+        if isinstance(self.sink, RingSink):
+            return self.sink.tail(count)
+        return []
+
+    def stats(self):
+        with self.lock:
+            return {"written": self.written, "dropped": self.dropped}
+
+
+def open_sink(spec, stderr):
+    """file:PATH, fd:N, ring[:CAPACITY] or stderr"""
+    kind, _, arg = spec.partition(":")
+    if kind == "file":
+        directory = os.path.dirname(arg)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return open(arg, "a", encoding="utf-8", buffering=1)
+    if kind == "fd":
+        return os.fdopen(int(arg), "w", encoding="utf-8", buffering=1, closefd=False)
+    if kind == "ring":
+        return RingSink(int(arg) if arg else 2000)
+    return stderr
+
+
+def install(spec=None, min_level=None, sample_rate=None):
+    """Replace sys.stderr with a StructuredLog configured from STORY_LOG*; returns it, or None when off"""
+    spec = spec if spec is not None else os.environ.get("STORY_LOG", "")
+    if not spec or spec == "off":
+        return None
+    min_level = min_level or os.environ.get("STORY_LOG_LEVEL", "info").lower()
+    sample_rate = sample_rate if sample_rate is not None else float(os.environ.get("STORY_LOG_SAMPLE", 1.0))
+    stderr = sys.stderr
+    try:
+        sink = open_sink(spec, stderr)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Log sink {spec} unavailable ({str(e)}), logging JSON to stderr", file=stderr)
+        sink = stderr
+    # Logging to stderr itself already carries READY, so it needs no passthrough
+    log = StructuredLog(sink, min_level, sample_rate, passthrough=None if sink is stderr else stderr)
+    sys.stderr = log
+    return log
@@ -0,0 +1,130 @@
+import sys
+import time
+import threading
+import traceback
+from collections import OrderedDict
+
+SUMMARY_MAX_CHARS = 1200
+
+
+class BackgroundSummarizer:
+    """Fold finished story turns into a rolling model-written summary
+
+    Turns are queued per session once a response is done and condensed on a
+    daemon thread only while no user request needs the model. A user request
+    that arrives mid-summary stops it after the current token; the turns stay
+    queued and are summarized on the next idle period, so long-range context
+    never adds latency to a turn.
+    """
+
+    def __init__(self, generator, max_tokens=220, idle_seconds=0.5, max_input_tokens=3000):
+        self.generator = generator
+        self.max_tokens = max_tokens
+        self.idle_seconds = idle_seconds
+        self.max_input_tokens = max_input_tokens
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.summaries = 0
+        self.preempted = 0
+        self.failures = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="summarizer", daemon=True)
+        self.thread.start()
+
+    def schedule(self, memory):
+        """Queue a session whose unsummarized_turns grew"""
+        with self.condition:
+            self.pending[memory.session_id] = memory
+            self.pending.move_to_end(memory.session_id)
+            self.condition.notify()
+
+    def discard(self, session_id=None):
+        """Forget queued work for one session, or for all of them"""
+        with self.condition:
+            if session_id is None:
+                self.pending.clear()
+            else:
+                self.pending.pop(session_id, None)
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            self.generator.wait_for_idle(self.idle_seconds)
+            with self.condition:
+                if not self.pending:
+                    continue
+                session_id, memory = self.pending.popitem(last=False)
+            try:
+                if not self.summarize(memory):
+                    # Interrupted by a user request; retry on the next idle period
+                    self.schedule(memory)
+            except Exception as e:
+                self.failures += 1
+                print(f"❌ Summary error [{session_id}]: {str(e)}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+
+    def build_prompt(self, summary, turns):
+        passages = "\n\n".join(turns)
+        return (
+            f"<start_of_turn>user\n"
+            f"Rewrite the story summary below so it also covers the new passages. "
+            f"Keep every character name, relationship and major plot event in order, oldest first. "
+            f"Use at most 150 words and reply with the summary only.\n\n"
+            f"SUMMARY SO FAR: {summary or '(none)'}\n\n"
+            f"NEW PASSAGES:\n{passages}<end_of_turn>\n"
+            f"<start_of_turn>model\n"
+        )
+
+    def select_turns(self, memory):
+        """Oldest unsummarized turns whose prompt fits the input budget (at least one)"""
+        turns = list(memory.unsummarized_turns)
+        while len(turns) > 1:
+            prompt = self.build_prompt(memory.story_summary, turns)
+            if len(self.generator.llm.tokenize(prompt.encode("utf-8"), special=True)) <= self.max_input_tokens:
+                break
+            turns.pop()
+        return turns
+
+    def summarize(self, memory):
+        """Condense a session's queued turns; False when a user request interrupted it"""
+        if not memory.unsummarized_turns or not self.generator.sessions.is_current(memory):
+            return True
+        start_time = time.time()
+        turns = self.select_turns(memory)
+        prompt = self.build_prompt(memory.story_summary, turns)
+        summary, finished = self.generator.generate_background(
+            prompt, self.max_tokens, temperature=0.3
+        )
+        if not finished:
+            self.preempted += 1
+            print(f"⏸️  Summary preempted by a user request [{memory.session_id}]", file=sys.stderr)
+            return False
+        if summary:
+            memory.story_summary = summary[:SUMMARY_MAX_CHARS]
+        # Turns appended meanwhile stay queued for the next pass
+        del memory.unsummarized_turns[:len(turns)]
+        self.generator.sessions.update_size(memory)
+        self.generator.persist_session(memory)
+        self.summaries += 1
+        print(f"📚 Story summary updated [{memory.session_id}] from {len(turns)} turns "
+              f"in {time.time() - start_time:.1f}s", file=sys.stderr)
+        return True
+
+    def stats(self):
+        with self.condition:
+            pending = len(self.pending)
+        return {
+            "pending": pending,
+            "summaries": self.summaries,
+            "preempted": self.preempted,
+            "failures": self.failures,
+        }
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -0,0 +1,29 @@
+"""Shared setup for the Python tests
+
+Puts src/main/python on the import path. Tests that drive a whole
+StoryGenerator use benchmark's FakeLlama in place of a model, but the
+generator still imports llama_cpp, so they are skipped where it is missing.
+
+    python -m unittest discover -s src/test/python
+"""
+import os
+import sys
+import argparse
+
+SOURCE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "main", "python"))
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+try:
+    import llama_cpp
+except ImportError:
+    llama_cpp = None
+
+NEEDS_LLAMA = "llama-cpp-python is not installed"
+
+
+def build_generator():
+    """StoryGenerator on FakeLlama, without the background threads or files the benchmark also turns off"""
+    import benchmark
+    return benchmark.build_generator(argparse.Namespace(model=None, tokens_per_second=0.0,
+                                                        prompt_tokens_per_second=0.0))
@@ -0,0 +1,46 @@
+import json
+import unittest
+
+import support
+
+
+@unittest.skipIf(support.llama_cpp is None, support.NEEDS_LLAMA)
+class AlternativesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.generator = support.build_generator()
+
+    def setUp(self):
+        self.generator.process_command("GENERATE", "A storm over the valley", json.dumps({"sessionId": "alt"}))
+
+    def alternatives(self, command="ALTERNATIVES", **config):
+        frames = []
+        result = self.generator.process_command(command, "They reach the ruins", json.dumps(dict(config, sessionId="alt")),
+                                                emit=lambda kind, payload: frames.append((kind, payload)))
+        return result, frames
+
+    def test_one_branch_per_seed(self):
+        result, _ = self.alternatives(alternatives=3, seed=7)
+        branches = json.loads(result)["alternatives"]
+        self.assertEqual([branch["seed"] for branch in branches], [7, 8, 9])
+        self.assertTrue(all(branch["text"] for branch in branches))
+
+    def test_branch_seeds_do_not_stick_to_the_model(self):
+        from story_generator_v2 import MODEL_SEED
+        self.alternatives(seed=7)
+        self.assertEqual(self.generator.llm.seed, MODEL_SEED)
+
+    def test_stream_delivers_the_result_before_the_end_frame(self):
+        result, frames = self.alternatives("ALTERNATIVES_STREAM", alternatives=2)
+        self.assertEqual([kind for kind, _ in frames], ["chunk", "end"])
+        self.assertEqual(frames[0][1]["text"], result)
+        self.assertEqual(len(json.loads(result)["alternatives"]), 2)
+
+    def test_choose_continues_with_the_picked_branch(self):
+        result, _ = self.alternatives(alternatives=2)
+        picked = json.loads(result)["alternatives"][1]["text"]
+        self.assertEqual(self.generator.process_command("CHOOSE", "1", json.dumps({"sessionId": "alt"})), picked)
+
+
+if __name__ == "__main__":
+    unittest.main()
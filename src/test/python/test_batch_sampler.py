@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+import support
+
+if support.llama_cpp is not None:
+    from batch_engine import ContinuousBatchEngine, BatchSequence
+
+
+def llama_chain(logits, history, repeat_penalty, top_k, top_p, min_p, temperature):
+    """Token probabilities of llama.cpp's default chain, one step at a time"""
+    logits = logits.astype(np.float64)
+    for token in set(history[-64:]):
+        logits[token] = logits[token] / repeat_penalty if logits[token] > 0 else logits[token] * repeat_penalty
+    order = np.argsort(-logits, kind="stable")[:top_k]
+    probs = np.exp(logits[order] - logits[order].max())
+    probs /= probs.sum()
+    cumulative = 0.0
+    for last, prob in enumerate(probs):
+        cumulative += prob
+        if cumulative >= top_p:
+            break
+    order, probs = order[:last + 1], probs[:last + 1]
+    order = order[probs >= min_p * probs.max()]
+    scaled = np.exp((logits[order] - logits[order].max()) / temperature)
+    distribution = np.zeros(len(logits))
+    distribution[order] = scaled / scaled.sum()
+    return distribution
+
+
+@unittest.skipIf(support.llama_cpp is None, support.NEEDS_LLAMA)
+class BatchSamplerTest(unittest.TestCase):
+    def setUp(self):
+        # sample() only needs the vocabulary size, not a llama context
+        self.engine = ContinuousBatchEngine.__new__(ContinuousBatchEngine)
+        self.engine.n_vocab = 200
+        self.logits = np.random.default_rng(0).normal(0, 2, 200).astype(np.float32)
+        self.options = {"temperature": 0.8, "top_p": 0.9, "top_k": 40, "repeat_penalty": 1.2}
+
+    def test_samples_follow_llamas_default_chain(self):
+        sequence = BatchSequence(list(range(0, 100, 3)), 10, self.options, seed=1)
+        sequence.tokens = [5, 7, 9]
+        counts = np.bincount([self.engine.sample(self.logits, sequence) for _ in range(50000)], minlength=200)
+        expected = llama_chain(self.logits, sequence.prompt_tokens + sequence.tokens, 1.2, 40, 0.9, 0.05, 0.8)
+        np.testing.assert_array_equal(counts > 0, expected > 0)
+        self.assertLess(np.abs(counts / counts.sum() - expected).max(), 0.01)
+
+    def test_repeat_penalty_covers_the_prompt(self):
+        best = int(np.argmax(self.logits))
+        greedy = dict(self.options, temperature=0.0, repeat_penalty=100.0)
+        self.assertEqual(self.engine.sample(self.logits, BatchSequence([1, 2], 10, greedy)), best)
+        self.assertNotEqual(self.engine.sample(self.logits, BatchSequence([1, best], 10, greedy)), best)
+
+    def test_min_p_drops_unlikely_tokens(self):
+        logits = np.full(200, -20.0, dtype=np.float32)
+        logits[:3] = [5.0, 4.0, 1.0]
+        sequence = BatchSequence([1], 10, dict(self.options, top_p=1.0, repeat_penalty=1.0, min_p=0.1), seed=3)
+        self.assertEqual({self.engine.sample(logits, sequence) for _ in range(2000)}, {0, 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
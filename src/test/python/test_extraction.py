@@ -0,0 +1,64 @@
+import unittest
+
+import support  # noqa: F401
+from extraction import StoryExtractor
+
+PASSAGE = (
+    'Elena decided to follow the river north before the storm arrived. '
+    'Marcus was tall and quiet, with a scar across his cheek. '
+    'They found an abandoned lighthouse where the keeper had left a journal full of maps. '
+    '"Captain Reyes" waited at the pier, and Elena seemed nervous about the old ruins.'
+)
+
+
+class StoryExtractorTest(unittest.TestCase):
+    def setUp(self):
+        self.extractor = StoryExtractor()
+
+    def test_characters_in_order_of_first_appearance(self):
+        characters = self.extractor.characters(PASSAGE)
+        self.assertEqual(characters[:2], ["Elena", "Marcus"])
+        self.assertIn("Captain Reyes", characters)
+        self.assertNotIn("They", characters)
+
+    def test_characters_are_capped(self):
+        text = " ".join(f"{name} arrived." for name in ("Alba", "Bruno", "Clara", "Dario", "Elisa", "Fabio"))
+        self.assertEqual(len(StoryExtractor(max_characters=3).characters(text)), 3)
+
+    def test_traits_are_keyed_by_subject(self):
+        extraction = self.extractor.extract(PASSAGE)
+        self.assertEqual(extraction.traits_for("Marcus"), ["tall and quiet, with a scar across his cheek"])
+        self.assertEqual(extraction.traits_for("elena"), ["nervous about the old ruins"])
+
+    def test_short_descriptions_are_not_traits(self):
+        self.assertEqual(self.extractor.traits("Marcus was tall."), {})
+
+    def test_later_subjects_in_a_sentence_keep_their_traits(self):
+        traits = self.extractor.traits("Elena was happy and proud and Marcus was tall and very strong.")
+        self.assertEqual(traits["elena"], ["happy and proud and Marcus was tall and very strong"])
+        self.assertEqual(traits["marcus"], ["tall and very strong"])
+
+    def test_two_word_names(self):
+        traits = self.extractor.traits("John Smith seemed tired of the long road.")
+        self.assertEqual(traits["john smith"], ["tired of the long road"])
+        self.assertEqual(traits["smith"], ["tired of the long road"])
+
+    def test_events_need_a_keyword_and_enough_words(self):
+        events = self.extractor.events(PASSAGE + " Elena found it. Nothing happened in the quiet town that night.")
+        self.assertEqual(events, [
+            "Elena decided to follow the river north before the storm arrived",
+            "They found an abandoned lighthouse where the keeper had left a journal full of maps",
+        ])
+
+    def test_events_are_capped(self):
+        text = " ".join(f"Elena discovered a secret door in room number {n}." for n in range(5))
+        self.assertEqual(len(self.extractor.events(text)), 3)
+
+    def test_attributes_keep_the_original_case(self):
+        extraction = self.extractor.extract("She was Nervous but wore a C cup dress.")
+        self.assertEqual(extraction.emotional_state, "Nervous")
+        self.assertEqual(extraction.cup_size, "C cup")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import support  # noqa: F401
+from prompt_builder import PromptBuilder, compact
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class PromptBuilderTest(unittest.TestCase):
+    def builder(self, budget):
+        return (PromptBuilder(count_words, budget)
+                .group("characters", "CHARACTERS:")
+                .add("system", "You write stories.")
+                .add("character:Elena", "Elena: brave, curious.", priority=2, group="characters")
+                .add("character:Marcus", "Marcus: tall and quiet.", priority=2, group="characters")
+                .add("summary", "Earlier, Elena found a map of the valley.", priority=1)
+                .add("user", "Continue the story."))
+
+    def test_everything_fits_an_ample_budget(self):
+        builder = self.builder(100)
+        prompt = builder.build()
+        self.assertEqual(prompt, builder.render_all())
+        self.assertEqual(builder.report["dropped"], [])
+        self.assertEqual(builder.report["total_tokens"], count_words(prompt))
+
+    def test_sections_of_a_group_share_one_header(self):
+        prompt = self.builder(0).build()
+        self.assertEqual(prompt.count("CHARACTERS:"), 1)
+        self.assertIn("CHARACTERS:\nElena: brave, curious.\nMarcus: tall and quiet.\n", prompt)
+
+    def test_highest_priority_number_is_dropped_first_latest_on_ties(self):
+        builder = self.builder(20)
+        prompt = builder.build()
+        self.assertEqual(builder.report["dropped"], ["character:Marcus"])
+        self.assertIn("Elena", prompt)
+        self.assertLessEqual(count_words(prompt), 20)
+
+    def test_dropping_continues_until_it_fits(self):
+        builder = self.builder(12)
+        prompt = builder.build()
+        self.assertEqual(builder.report["dropped"], ["character:Marcus", "character:Elena", "summary"])
+        self.assertNotIn("CHARACTERS:", prompt)
+        self.assertEqual(set(builder.report["sections"]), {"system", "user"})
+
+    def test_required_sections_are_kept_over_budget(self):
+        builder = self.builder(1)
+        prompt = builder.build()
+        self.assertIn("You write stories.", prompt)
+        self.assertIn("Continue the story.", prompt)
+        self.assertGreater(builder.report["total_tokens"], 1)
+
+    def test_empty_sections_are_skipped(self):
+        builder = PromptBuilder(count_words, 0).add("empty", "  \n ").add("user", "Go.")
+        self.assertEqual(builder.build(), "Go.\n")
+        self.assertEqual(builder.report["sections"], {"user": 1})
+
+    def test_compact_strips_template_indentation(self):
+        self.assertEqual(compact("\n    First line\n\n\n\n    Second line\n    "), "First line\n\nSecond line\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
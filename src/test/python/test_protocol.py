@@ -0,0 +1,77 @@
+import io
+import json
+import threading
+import unittest
+
+import support  # noqa: F401
+from protocol import (HEADER, FrameWriter, ProtocolError, decode_frame, encode_frame, parse_request,
+                      read_frame)
+
+
+class ChunkedStream(io.BytesIO):
+    """A stream that hands out at most a few bytes per read, like a socket"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 3) if size and size > 0 else size)
+
+
+class ProtocolTest(unittest.TestCase):
+    def test_frames_round_trip(self):
+        messages = [
+            {"id": 1, "command": "GENERATE", "data": "Línea uno\nlínea dos 🐉", "config": {"sessionId": "a"}},
+            {"id": "two", "type": "chunk", "text": ""},
+            {},
+        ]
+        stream = ChunkedStream(b"".join(encode_frame(message) for message in messages))
+        self.assertEqual([read_frame(stream) for _ in messages], messages)
+        self.assertIsNone(read_frame(stream))
+
+    def test_header_is_the_big_endian_body_length(self):
+        frame = encode_frame({"id": 1})
+        (length,) = HEADER.unpack(frame[:HEADER.size])
+        self.assertEqual(length, len(frame) - HEADER.size)
+        self.assertEqual(json.loads(frame[HEADER.size:]), {"id": 1})
+
+    def test_truncated_frame_is_an_error(self):
+        frame = encode_frame({"id": 1, "command": "STATUS"})
+        for cut in (2, HEADER.size + 3):
+            with self.assertRaises(ProtocolError):
+                read_frame(io.BytesIO(frame[:cut]))
+
+    def test_oversized_length_is_rejected_before_reading(self):
+        with self.assertRaises(ProtocolError):
+            read_frame(io.BytesIO(HEADER.pack(2 ** 31)))
+
+    def test_payload_must_be_an_object(self):
+        with self.assertRaises(ProtocolError):
+            decode_frame(b"[1, 2]")
+
+    def test_parse_request(self):
+        self.assertEqual(parse_request({"id": 7, "command": "CONTINUE", "data": "go", "config": {"sessionId": "a"}}),
+                         (7, "CONTINUE", "go", '{"sessionId": "a"}'))
+        self.assertEqual(parse_request({"command": "STATUS", "config": "{}"}), (None, "STATUS", "", "{}"))
+        with self.assertRaises(ProtocolError):
+            parse_request({"id": 1})
+
+    def test_concurrent_writers_never_interleave_frames(self):
+        stream = io.BytesIO()
+        writer = FrameWriter(stream)
+
+        def send(sender):
+            for index in range(200):
+                writer.send(index, "chunk", text=f"{sender}-{index} " * 20)
+
+        threads = [threading.Thread(target=send, args=(sender,)) for sender in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stream.seek(0)
+        frames = list(iter(lambda: read_frame(stream), None))
+        self.assertEqual(len(frames), 800)
+        for frame in frames:
+            self.assertEqual(len(set(frame["text"].split())), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
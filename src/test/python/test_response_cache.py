@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+import support
+from response_cache import ResponseCache
+
+PARAMS = {"max_tokens": 400, "temperature": 0.8, "top_p": 0.9, "seed": 42, "backend": "llama"}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="response_cache_test_")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.cache = ResponseCache(self.directory, "model-a")
+
+    def test_key_ignores_whitespace_and_parameter_order(self):
+        key = self.cache.key("Write a story\n    about a dragon.", PARAMS)
+        self.assertEqual(key, self.cache.key("  Write a story about   a dragon. ", dict(reversed(list(PARAMS.items())))))
+
+    def test_key_changes_with_prompt_parameters_and_model(self):
+        key = self.cache.key("Write a story.", PARAMS)
+        self.assertNotEqual(key, self.cache.key("Write a poem.", PARAMS))
+        self.assertNotEqual(key, self.cache.key("Write a story.", dict(PARAMS, seed=43)))
+        self.assertNotEqual(key, self.cache.key("Write a story.", dict(PARAMS, backend="batch")))
+        self.assertNotEqual(key, ResponseCache(self.directory, "model-b").key("Write a story.", PARAMS))
+
+    def test_put_then_get(self):
+        key = self.cache.key("Write a story.", PARAMS)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, "Once upon a time", {"completion_tokens": 4})
+        entry = self.cache.get(key)
+        self.assertEqual(entry["response"], "Once upon a time")
+        self.assertEqual(entry["usage"], {"completion_tokens": 4})
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_expired_entries_are_misses(self):
+        cache = ResponseCache(self.directory, "model-a", ttl_seconds=60)
+        key = cache.key("Write a story.", PARAMS)
+        cache.put(key, "Once upon a time")
+        with open(cache.path(key), "r+", encoding="utf-8") as f:
+            entry = json.load(f)
+            entry["created"] = time.time() - 61
+            f.seek(0)
+            f.truncate()
+            json.dump(entry, f)
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(os.path.exists(cache.path(key)))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [self.cache.key(f"Story {index}", PARAMS) for index in range(4)]
+        for index, key in enumerate(keys):
+            self.cache.put(key, "x" * 100)
+            os.utime(self.cache.path(key), (1000 + index, 1000 + index))
+        # Room for four and a half entries, so a fifth evicts exactly one
+        self.cache.max_bytes = self.cache.stats()["bytes"] * 9 // 8
+        self.cache.get(keys[0])
+        self.cache.put(self.cache.key("Story 4", PARAMS), "x" * 100)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+
+@unittest.skipIf(support.llama_cpp is None, support.NEEDS_LLAMA)
+class GeneratorResponseCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.generator = support.build_generator()
+        cls.directory = tempfile.mkdtemp(prefix="response_cache_test_")
+        cls.generator.response_cache = ResponseCache(cls.directory, "fake-model")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, True)
+
+    def generate(self, **config):
+        return self.generator.process_command("GENERATE", "A storm over the valley",
+                                              json.dumps(dict(config, sessionId="cached")))
+
+    def test_repeated_generate_is_answered_from_the_cache(self):
+        first = self.generate()
+        second = self.generate()
+        self.assertEqual(first, second)
+        self.assertTrue(self.generator.last_usage().get("cached"))
+        self.assertEqual(self.generate(noCache=True), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
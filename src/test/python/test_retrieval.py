@@ -0,0 +1,108 @@
+import time
+import threading
+import unittest
+
+import numpy as np
+
+import support  # noqa: F401
+from metrics import MetricsRegistry
+from retrieval import RetrievalMemory, VectorIndex, chunk_text, unit_vector
+from session_memory import SessionMemoryStore
+
+WORDS = ["dragon", "castle", "river", "map", "storm", "sword"]
+
+
+class BagOfWordsEmbedder:
+    def embed(self, text, truncate=True):
+        return [float(text.lower().count(word)) for word in WORDS]
+
+
+class FakeGenerator:
+    def __init__(self):
+        self.metrics = MetricsRegistry()
+        self.sessions = SessionMemoryStore(ttl_seconds=0)
+
+    def wait_for_idle(self, seconds):
+        pass
+
+
+def wait_for(condition, seconds=5.0):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class ChunkTextTest(unittest.TestCase):
+    def test_passages_overlap(self):
+        text = " ".join(str(index) for index in range(10))
+        self.assertEqual(chunk_text(text, words=4, overlap=2), ["0 1 2 3", "2 3 4 5", "4 5 6 7", "6 7 8 9"])
+
+    def test_short_and_empty_text(self):
+        self.assertEqual(chunk_text("a b", words=4, overlap=2), ["a b"])
+        self.assertEqual(chunk_text("  "), [])
+
+
+class VectorIndexTest(unittest.TestCase):
+    def test_search_returns_the_closest_rows_best_first_across_growth(self):
+        index = VectorIndex(2, capacity=1)
+        for angle in (0.0, 1.0, 0.2, 3.0):
+            index.add(np.array([np.cos(angle), np.sin(angle)], dtype=np.float32), str(angle))
+        rows, scores = index.search(unit_vector([1.0, 0.0]), 2)
+        self.assertEqual([index.texts[row] for row in rows], ["0.0", "0.2"])
+        self.assertGreater(scores[0], scores[1])
+        self.assertEqual(len(index), 4)
+
+
+class RetrievalMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = FakeGenerator()
+        self.retrieval = RetrievalMemory(self.generator, BagOfWordsEmbedder, top_k=1, chunk_words=4, chunk_overlap=0)
+        self.generator.sessions.on_evict = self.retrieval.discard
+        self.addCleanup(self.retrieval.close)
+        self.memory = self.generator.sessions.get("a")
+
+    def test_indexed_passages_are_recalled_by_similarity(self):
+        self.retrieval.index(self.memory, "the dragon slept there. a storm broke the river")
+        self.assertTrue(wait_for(lambda: self.retrieval.stats()["embedded"] == 3))
+        self.assertEqual(self.retrieval.recall("a", "Where is the storm?"), ["a storm broke the"])
+        self.assertEqual(self.retrieval.recall("b", "Where is the storm?"), [])
+
+    def test_recall_is_skipped_while_the_embedder_is_busy(self):
+        self.retrieval.store(self.memory, unit_vector([1, 0, 0, 0, 0, 0]), "the dragon")
+        with self.retrieval.embed_lock:
+            self.assertEqual(self.retrieval.recall("a", "dragon"), [])
+        self.assertEqual(self.retrieval.stats()["skipped"], 1)
+
+    def test_passages_of_a_discarded_session_are_not_stored(self):
+        self.generator.sessions.discard("a")
+        self.retrieval.store(self.memory, unit_vector([1, 0, 0, 0, 0, 0]), "the dragon")
+        self.assertEqual(self.retrieval.stats()["passages"], 0)
+
+    def test_eviction_during_store_neither_deadlocks_nor_keeps_the_passage(self):
+        sessions = self.generator.sessions
+        is_current = sessions.is_current
+        evictions = []
+
+        def evict():
+            # Eviction calls discard while it holds the session store's lock
+            with sessions.lock:
+                sessions.evict("a", "evicted")
+
+        def evict_once_then_check(memory):
+            if not evictions:
+                evictions.append(threading.Thread(target=evict, daemon=True))
+                evictions[0].start()
+                evictions[0].join(1)
+            return is_current(memory)
+
+        sessions.is_current = evict_once_then_check
+        self.retrieval.store(self.memory, unit_vector([1, 0, 0, 0, 0, 0]), "the dragon")
+        self.assertFalse(evictions[0].is_alive())
+        self.assertEqual(self.retrieval.stats()["passages"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import io
+import asyncio
+import threading
+import unittest
+
+import support  # noqa: F401
+from metrics import MetricsRegistry
+from protocol import FrameWriter, encode_frame, read_frame
+from scheduler import RequestScheduler
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.frames = []
+        self.lock = threading.Lock()
+
+    def send(self, request_id, kind, **payload):
+        with self.lock:
+            self.frames.append((request_id, kind, payload))
+
+    def kinds(self, request_id):
+        with self.lock:
+            return [kind for frame_id, kind, _ in self.frames if frame_id == request_id]
+
+
+class FakeGenerator:
+    """Records the order commands run in; data "block" holds the model until released"""
+
+    def __init__(self):
+        self.metrics = MetricsRegistry()
+        self.ran = []
+        self.release = threading.Event()
+        self.blocking = threading.Event()
+
+    def process_command(self, command, data, config_json, emit=None, should_stop=None):
+        if data == "block":
+            self.blocking.set()
+            while not self.release.wait(0.01):
+                if should_stop():
+                    return "partial"
+        self.ran.append(data)
+        return f"{command} {data}"
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.generator = FakeGenerator()
+        self.writer = RecordingWriter()
+
+    def run_scheduler(self, scenario):
+        async def main():
+            scheduler = RequestScheduler(self.generator, self.writer, max_queue=4)
+            workers = scheduler.start_workers()
+            try:
+                await scenario(scheduler)
+                await asyncio.wait_for(scheduler.queue.join(), 5)
+            finally:
+                self.generator.release.set()
+                scheduler.stop_workers(workers)
+
+        asyncio.run(main())
+
+    async def start_blocker(self, scheduler):
+        """Occupy the only model thread so later requests queue up"""
+        await scheduler.submit({"id": "blocker", "command": "GENERATE", "data": "block"})
+        await asyncio.get_running_loop().run_in_executor(None, self.generator.blocking.wait, 5)
+
+    def test_lower_priority_number_runs_first_and_ties_keep_arrival_order(self):
+        async def scenario(scheduler):
+            await self.start_blocker(scheduler)
+            await scheduler.submit({"id": 1, "command": "GENERATE", "data": "generate"})
+            await scheduler.submit({"id": 2, "command": "CONTINUE", "data": "continue"})
+            await scheduler.submit({"id": 3, "command": "GENERATE", "data": "urgent", "priority": 0})
+            await scheduler.submit({"id": 4, "command": "CONTINUE", "data": "continue again"})
+            self.generator.release.set()
+
+        self.run_scheduler(scenario)
+        self.assertEqual(self.generator.ran, ["block", "urgent", "continue", "continue again", "generate"])
+
+    def test_invalid_priority_is_answered_and_the_queue_keeps_working(self):
+        async def scenario(scheduler):
+            await self.start_blocker(scheduler)
+            await scheduler.submit({"id": 1, "command": "GENERATE", "data": "bad", "priority": "high"})
+            await scheduler.submit({"id": 2, "command": "GENERATE", "data": "default"})
+            await scheduler.submit({"id": 3, "command": "GENERATE", "data": "numeric string", "priority": "1"})
+            self.generator.release.set()
+
+        self.run_scheduler(scenario)
+        self.assertEqual(self.writer.kinds(1), ["error"])
+        self.assertEqual(self.writer.kinds(2), ["response"])
+        self.assertEqual(self.generator.ran, ["block", "numeric string", "default"])
+
+    def test_request_past_its_deadline_is_not_run(self):
+        async def scenario(scheduler):
+            await self.start_blocker(scheduler)
+            await scheduler.submit({"id": 1, "command": "GENERATE", "data": "late", "timeout_ms": 1})
+            await asyncio.sleep(0.05)
+            self.generator.release.set()
+
+        self.run_scheduler(scenario)
+        self.assertEqual(self.writer.kinds(1), ["deadline"])
+        self.assertNotIn("late", self.generator.ran)
+
+    def test_cancel_answers_a_queued_request_without_running_it(self):
+        async def scenario(scheduler):
+            await self.start_blocker(scheduler)
+            await scheduler.submit({"id": 1, "command": "GENERATE", "data": "queued"})
+            await scheduler.submit({"id": 2, "command": "CANCEL", "target": 1})
+            self.generator.release.set()
+
+        self.run_scheduler(scenario)
+        self.assertEqual(self.writer.kinds(1), ["cancelled"])
+        self.assertEqual(self.writer.kinds(2), ["response"])
+        self.assertNotIn("queued", self.generator.ran)
+
+    def test_cancel_stops_a_running_request(self):
+        async def scenario(scheduler):
+            await self.start_blocker(scheduler)
+            await scheduler.submit({"id": 2, "command": "CANCEL", "target": "blocker"})
+
+        self.run_scheduler(scenario)
+        self.assertEqual(self.writer.kinds("blocker"), ["cancelled"])
+        self.assertEqual(self.writer.frames[-1][2]["result"], "partial")
+
+    def test_full_queue_rejects_new_requests(self):
+        async def scenario(scheduler):
+            await self.start_blocker(scheduler)
+            for request_id in range(5):
+                await scheduler.submit({"id": request_id, "command": "GENERATE", "data": str(request_id)})
+            self.generator.release.set()
+
+        self.run_scheduler(scenario)
+        self.assertEqual(self.writer.kinds(4), ["error"])
+        self.assertEqual(self.generator.ran, ["block", "0", "1", "2", "3"])
+
+    def test_serve_answers_every_frame_of_a_stream(self):
+        frames = [{"id": 1, "command": "GENERATE", "data": "one"},
+                  {"id": 2, "command": "GENERATE", "data": "two", "priority": "high"},
+                  {"id": 3, "command": "CONTINUE", "data": "three"}]
+        output = io.BytesIO()
+        scheduler = RequestScheduler(self.generator, FrameWriter(output))
+        asyncio.run(scheduler.serve(io.BytesIO(b"".join(encode_frame(frame) for frame in frames))))
+        output.seek(0)
+        answers = {frame["id"]: frame["type"] for frame in iter(lambda: read_frame(output), None)}
+        self.assertEqual(answers, {1: "response", 2: "error", 3: "response"})
+
+
+if __name__ == "__main__":
+    unittest.main()
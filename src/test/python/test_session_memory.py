@@ -0,0 +1,72 @@
+import time
+import unittest
+
+import support  # noqa: F401
+from session_memory import SessionMemoryStore, StoryMemory
+
+
+class SessionMemoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.evicted = []
+        self.store = SessionMemoryStore(max_sessions=3, max_bytes=0, ttl_seconds=60, on_evict=self.evicted.append)
+
+    def test_get_returns_the_same_memory_per_session(self):
+        memory = self.store.get("a")
+        self.assertIs(self.store.get("a"), memory)
+        self.assertIsNot(self.store.get("b"), memory)
+        self.assertEqual(memory.session_id, "a")
+
+    def test_least_recently_used_session_is_evicted(self):
+        for session_id in ("a", "b", "c"):
+            self.store.get(session_id)
+        self.store.get("a")
+        self.store.get("d")
+        self.assertEqual(list(self.store.sessions), ["c", "a", "d"])
+        self.assertEqual(self.evicted, ["b"])
+        self.assertEqual(self.store.stats()["evictions"], 1)
+
+    def test_idle_sessions_expire(self):
+        old = self.store.get("old")
+        self.store.get("recent")
+        old.last_access = time.monotonic() - 61
+        self.store.get("new")
+        self.assertEqual(list(self.store.sessions), ["recent", "new"])
+        self.assertEqual(self.evicted, ["old"])
+        self.assertFalse(self.store.is_current(old))
+
+    def test_byte_budget_evicts_other_sessions_first(self):
+        store = SessionMemoryStore(max_sessions=10, max_bytes=400, ttl_seconds=0, on_evict=self.evicted.append)
+        for session_id in ("a", "b"):
+            memory = store.get(session_id)
+            memory.story_summary = "x" * 150
+            store.update_size(memory)
+        self.assertEqual(self.evicted, ["a"])
+        self.assertEqual(list(store.sessions), ["b"])
+        self.assertLessEqual(store.total_bytes, 400)
+
+    def test_oversized_current_session_is_kept(self):
+        store = SessionMemoryStore(max_sessions=10, max_bytes=100, ttl_seconds=0)
+        memory = store.get("big")
+        memory.story_summary = "x" * 500
+        store.update_size(memory)
+        self.assertTrue(store.is_current(memory))
+
+    def test_reset_replaces_the_memory(self):
+        memory = self.store.get("a")
+        memory.key_events.append("Elena found the map")
+        fresh = self.store.reset("a")
+        self.assertIsNot(fresh, memory)
+        self.assertTrue(fresh.is_empty())
+        self.assertFalse(self.store.is_current(memory))
+
+    def test_loader_rehydrates_missing_sessions(self):
+        saved = StoryMemory.from_dict("a", {"story_summary": "Elena left the village."})
+        store = SessionMemoryStore(loader=lambda session_id: saved if session_id == "a" else None)
+        self.assertIs(store.get("a"), saved)
+        self.assertGreater(store.total_bytes, 0)
+        self.assertTrue(store.get("b").is_empty())
+        self.assertTrue(store.reset("a").is_empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import support  # noqa: F401
+from session_memory import SessionMemoryStore, StoryMemory
+from session_store import SessionStore
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="session_store_test_")
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, "sessions.db")
+        self.store = SessionStore(self.path)
+        self.addCleanup(self.store.close)
+
+    def memory(self, session_id="a"):
+        memory = StoryMemory(session_id)
+        memory.profile = "v2"
+        memory.character_memory = {"Elena": {"mentions": 2, "traits": ["brave and curious"]}}
+        memory.key_events = ["Elena found the map"]
+        memory.story_summary = "Elena left the village."
+        memory.transcript = "<start_of_turn>user ..."
+        return memory
+
+    def test_memory_survives_a_reopen_without_its_transcript(self):
+        self.store.save(self.memory())
+        self.store.close()
+        reopened = SessionStore(self.path)
+        self.addCleanup(reopened.close)
+        data = reopened.load("a")
+        restored = StoryMemory.from_dict("a", data)
+        self.assertEqual(restored.to_dict(), dict(self.memory().to_dict(), transcript=""))
+
+    def test_save_overwrites_the_previous_copy(self):
+        memory = self.memory()
+        self.store.save(memory)
+        memory.key_events.append("Marcus promised to guide her")
+        self.store.save(memory)
+        self.assertEqual(self.store.load("a")["key_events"], memory.key_events)
+        self.assertEqual(self.store.stats()["sessions"], 1)
+
+    def test_delete_one_or_all(self):
+        for session_id in ("a", "b", "c"):
+            self.store.save(self.memory(session_id))
+        self.store.delete("a")
+        self.assertIsNone(self.store.load("a"))
+        self.assertIsNotNone(self.store.load("b"))
+        self.store.delete()
+        self.assertEqual(self.store.stats()["sessions"], 0)
+
+    def test_sessions_past_the_ttl_are_gone(self):
+        self.store.save(self.memory())
+        with self.store.lock:
+            self.store.connection.execute("UPDATE sessions SET updated_at = ?", (time.time() - 120,))
+            self.store.connection.commit()
+        self.store.ttl_seconds = 60
+        self.assertIsNone(self.store.load("a"))
+        self.assertEqual(self.store.stats()["sessions"], 0)
+
+    def test_session_memory_store_rehydrates_through_the_store(self):
+        self.store.save(self.memory())
+
+        def loader(session_id):
+            data = self.store.load(session_id)
+            return StoryMemory.from_dict(session_id, data) if data is not None else None
+
+        sessions = SessionMemoryStore(loader=loader)
+        self.assertEqual(sessions.get("a").key_events, ["Elena found the map"])
+        self.assertTrue(sessions.get("unknown").is_empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import time
+import socket
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+
+import support  # noqa: F401
+from metrics import MetricsRegistry
+from protocol import encode_frame, read_frame
+from socket_server import SocketServer
+
+
+class FakeGenerator:
+    """Streams a chunk every few milliseconds until the request is stopped"""
+
+    def __init__(self):
+        self.metrics = MetricsRegistry()
+        self.stopped = threading.Event()
+
+    def model_concurrency(self):
+        return 1
+
+    def process_command(self, command, data, config_json, emit=None, should_stop=None):
+        if not command.endswith("_STREAM"):
+            return f"{command} {data}"
+        for _ in range(2000):
+            if should_stop():
+                self.stopped.set()
+                break
+            emit("chunk", {"text": "word "})
+            time.sleep(0.005)
+        emit("end", {"usage": {}})
+        return "done"
+
+
+def wait_for(condition, seconds=5.0):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class SocketServerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="sock")
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, "story.sock")
+        self.generator = FakeGenerator()
+        self.server = SocketServer(self.generator, self.path, max_clients=2)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        self.assertTrue(wait_for(lambda: os.path.exists(self.path)))
+        self.addCleanup(self.stop_server)
+
+    def serve(self):
+        try:
+            asyncio.run(self.server.serve())
+        except asyncio.CancelledError:
+            pass
+
+    def stop_server(self):
+        self.server.loop.call_soon_threadsafe(lambda: [task.cancel() for task in asyncio.all_tasks()])
+        self.thread.join(5)
+
+    def connect(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        self.addCleanup(client.close)
+        return client
+
+    def test_line_client_gets_the_response_and_end_marker(self):
+        client = self.connect()
+        client.sendall(b"STATUS|x|{}\n")
+        reader = client.makefile("rb")
+        self.assertEqual([reader.readline(), reader.readline()], [b"STATUS x\n", b"END_RESPONSE\n"])
+
+    def test_framed_client_round_trip(self):
+        client = self.connect()
+        client.sendall(encode_frame({"id": 1, "command": "GENERATE", "data": "dragon"}))
+        self.assertEqual(read_frame(client.makefile("rb")), {"id": 1, "type": "response", "result": "GENERATE dragon"})
+
+    def test_line_client_dropping_mid_stream_frees_its_slot_and_cancels(self):
+        for _ in range(3):
+            client = self.connect()
+            client.sendall(b'GENERATE_STREAM|dragon|{}\n')
+            self.assertTrue(client.recv(64).startswith(b"STREAM_CHUNK|"))
+            client.close()
+            self.assertTrue(wait_for(lambda: self.server.stats()["clients"] == 0))
+            self.assertTrue(self.generator.stopped.wait(5))
+            self.generator.stopped.clear()
+        self.assertEqual(self.server.stats()["refused"], 0)
+
+    def test_connections_over_the_limit_are_refused(self):
+        clients = [self.connect() for _ in range(2)]
+        for client in clients:
+            client.sendall(b"STATUS||{}\n")
+            client.makefile("rb").readline()
+        refused = self.connect()
+        self.assertEqual(read_frame(refused.makefile("rb"))["error"], "Too many connections")
+        self.assertEqual(self.server.stats()["refused"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # noqa: F401
+from state_cache import SessionStateCache
+
+
+class FakeState:
+    """Picklable stand-in for a LlamaState of a given size"""
+
+    def __init__(self, name, size):
+        self.name = name
+        self.llama_state_size = size
+
+
+class SessionStateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="state_cache_test_")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.cache = SessionStateCache(ram_bytes=250, disk_bytes=1000, disk_dir=self.directory)
+
+    def test_least_recently_used_state_spills_to_disk(self):
+        self.cache.put("a", FakeState("a", 100))
+        self.cache.put("b", FakeState("b", 100))
+        self.cache.get("a")
+        self.cache.put("c", FakeState("c", 100))
+        self.assertEqual(list(self.cache.ram), ["a", "c"])
+        self.assertEqual(list(self.cache.disk), ["b"])
+        self.assertTrue(os.path.exists(self.cache.disk_path("b")))
+        self.assertEqual(self.cache.stats()["ram_bytes"], 200)
+
+    def test_spilled_state_is_promoted_back_to_ram(self):
+        for session_id in ("a", "b", "c"):
+            self.cache.put(session_id, FakeState(session_id, 100))
+        state = self.cache.get("a")
+        self.assertEqual(state.name, "a")
+        self.assertIn("a", self.cache.ram)
+        self.assertNotIn("a", self.cache.disk)
+        self.assertFalse(os.path.exists(self.cache.disk_path("a")))
+        self.assertEqual(self.cache.stats()["hits"], {"ram": 0, "disk": 1})
+
+    def test_state_larger_than_ram_goes_straight_to_disk(self):
+        self.cache.put("big", FakeState("big", 400))
+        self.assertNotIn("big", self.cache.ram)
+        self.assertIn("big", self.cache.disk)
+
+    def test_disk_tier_drops_its_oldest_state_when_full(self):
+        cache = SessionStateCache(ram_bytes=100, disk_bytes=250, disk_dir=self.directory)
+        for session_id in ("a", "b", "c", "d"):
+            cache.put(session_id, FakeState(session_id, 100))
+        self.assertEqual(list(cache.ram), ["d"])
+        self.assertEqual(list(cache.disk), ["b", "c"])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_resize_spills_what_no_longer_fits(self):
+        self.cache.put("a", FakeState("a", 100))
+        self.cache.put("b", FakeState("b", 100))
+        self.cache.resize(100)
+        self.assertEqual(list(self.cache.ram), ["b"])
+        self.assertEqual(list(self.cache.disk), ["a"])
+
+    def test_discard_removes_both_tiers(self):
+        for session_id in ("a", "b", "c"):
+            self.cache.put(session_id, FakeState(session_id, 100))
+        self.cache.discard("a")
+        self.cache.discard("c")
+        self.assertFalse(self.cache.has("a"))
+        self.assertFalse(self.cache.has("c"))
+        self.assertFalse(os.path.exists(self.cache.disk_path("a")))
+        self.assertEqual(self.cache.stats()["disk_bytes"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
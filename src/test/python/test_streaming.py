@@ -0,0 +1,49 @@
+import json
+import unittest
+
+import support
+
+
+@unittest.skipIf(support.llama_cpp is None, support.NEEDS_LLAMA)
+class StreamingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.generator = support.build_generator()
+
+    def run_stream(self, command, data, config):
+        frames = []
+        result = self.generator.process_command(command, data, json.dumps(config),
+                                                emit=lambda kind, payload: frames.append((kind, payload)))
+        return result, frames
+
+    def test_stream_chunks_add_up_to_the_blocking_result(self):
+        config = {"sessionId": "stream", "noCache": True}
+        blocking = self.generator.process_command("GENERATE", "A storm over the valley", json.dumps(config))
+        result, frames = self.run_stream("GENERATE_STREAM", "A storm over the valley", config)
+        chunks = [payload["text"] for kind, payload in frames if kind == "chunk"]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), result)
+        self.assertEqual(result, blocking)
+
+    def test_stream_ends_with_usage(self):
+        self.run_stream("GENERATE_STREAM", "A storm over the valley", {"sessionId": "usage"})
+        result, frames = self.run_stream("CONTINUE_STREAM", "They reach the ruins", {"sessionId": "usage"})
+        kind, payload = frames[-1]
+        self.assertEqual(kind, "end")
+        self.assertGreater(payload["usage"]["completion_tokens"], 0)
+        self.assertEqual([kind for kind, _ in frames].count("end"), 1)
+
+    def test_stream_stops_when_asked(self):
+        chunks = []
+
+        def emit(kind, payload):
+            chunks.append(kind)
+
+        self.generator.process_command("GENERATE_STREAM", "A storm over the valley",
+                                       json.dumps({"sessionId": "stop", "noCache": True}), emit=emit,
+                                       should_stop=lambda: chunks.count("chunk") >= 3)
+        self.assertLessEqual(chunks.count("chunk"), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import time
+import unittest
+
+import support  # noqa: F401
+from session_memory import SessionMemoryStore
+from summarizer import SUMMARY_MAX_CHARS, BackgroundSummarizer
+
+
+class WordTokenizer:
+    def tokenize(self, text, special=False):
+        return text.split()
+
+
+class FakeGenerator:
+    """The parts of StoryGenerator the summarizer uses; replies are queued (text, finished) pairs"""
+
+    def __init__(self, replies):
+        self.llm = WordTokenizer()
+        self.sessions = SessionMemoryStore()
+        self.replies = list(replies)
+        self.prompts = []
+        self.persisted = []
+
+    def wait_for_idle(self, seconds):
+        pass
+
+    def generate_background(self, prompt, max_tokens, temperature):
+        self.prompts.append(prompt)
+        return self.replies.pop(0)
+
+    def persist_session(self, memory):
+        self.persisted.append(memory.session_id)
+
+
+class BackgroundSummarizerTest(unittest.TestCase):
+    def make_summarizer(self, replies, **kwargs):
+        self.generator = FakeGenerator(replies)
+        summarizer = BackgroundSummarizer(self.generator, **kwargs)
+        self.addCleanup(summarizer.close)
+        return summarizer
+
+    def test_turns_fold_into_the_summary(self):
+        summarizer = self.make_summarizer([("Elena and Marcus reached the lighthouse.", True)])
+        memory = self.generator.sessions.get("a")
+        memory.story_summary = "Elena met Marcus."
+        memory.unsummarized_turns = ["They walked north.", "They found a lighthouse."]
+        self.assertTrue(summarizer.summarize(memory))
+        self.assertEqual(memory.story_summary, "Elena and Marcus reached the lighthouse.")
+        self.assertEqual(memory.unsummarized_turns, [])
+        self.assertIn("SUMMARY SO FAR: Elena met Marcus.", self.generator.prompts[0])
+        self.assertIn("They walked north.\n\nThey found a lighthouse.", self.generator.prompts[0])
+        self.assertEqual(self.generator.persisted, ["a"])
+
+    def test_preempted_summary_keeps_the_turns(self):
+        summarizer = self.make_summarizer([("Elena", False)])
+        memory = self.generator.sessions.get("a")
+        memory.unsummarized_turns = ["They walked north."]
+        self.assertFalse(summarizer.summarize(memory))
+        self.assertEqual(memory.story_summary, "")
+        self.assertEqual(memory.unsummarized_turns, ["They walked north."])
+        self.assertEqual(summarizer.stats()["preempted"], 1)
+
+    def test_turns_over_the_input_budget_wait_for_the_next_pass(self):
+        summarizer = self.make_summarizer([("Short summary.", True)], max_input_tokens=80)
+        memory = self.generator.sessions.get("a")
+        memory.unsummarized_turns = ["word " * 20, "word " * 20, "word " * 20]
+        summarizer.summarize(memory)
+        self.assertEqual(len(memory.unsummarized_turns), 2)
+
+    def test_a_single_turn_is_summarized_even_over_budget(self):
+        summarizer = self.make_summarizer([("Short summary.", True)], max_input_tokens=10)
+        memory = self.generator.sessions.get("a")
+        memory.unsummarized_turns = ["word " * 50]
+        summarizer.summarize(memory)
+        self.assertEqual(memory.unsummarized_turns, [])
+
+    def test_summary_is_capped(self):
+        summarizer = self.make_summarizer([("x" * (SUMMARY_MAX_CHARS + 100), True)])
+        memory = self.generator.sessions.get("a")
+        memory.unsummarized_turns = ["They walked north."]
+        summarizer.summarize(memory)
+        self.assertEqual(len(memory.story_summary), SUMMARY_MAX_CHARS)
+
+    def test_replaced_session_is_skipped(self):
+        summarizer = self.make_summarizer([])
+        memory = self.generator.sessions.get("a")
+        memory.unsummarized_turns = ["They walked north."]
+        self.generator.sessions.reset("a")
+        self.assertTrue(summarizer.summarize(memory))
+        self.assertEqual(self.generator.prompts, [])
+
+    def test_background_thread_retries_after_preemption(self):
+        summarizer = self.make_summarizer([("", False), ("Elena walked north.", True)], idle_seconds=0)
+        memory = self.generator.sessions.get("a")
+        memory.unsummarized_turns = ["They walked north."]
+        summarizer.schedule(memory)
+        for _ in range(200):
+            if summarizer.stats()["summaries"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(memory.story_summary, "Elena walked north.")
+        self.assertEqual(summarizer.stats()["preempted"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()